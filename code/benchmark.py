@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+'''
+Benchmarks for chainer_dcgan.py on synthetic data.
+
+Training flags such as `--lambda_gp` are shared with chainer_dcgan.py.
+
+Example:
+
+  ./benchmark.py --task backends --archs dcgan64,resnet128 --backends numpy,intel64,chainerx --batch_sizes 8
+  ./benchmark.py --task static_graph --gpu -1 --batch_sizes 1,4,16
+  ./benchmark.py --task mixed_precision --gpu -1 --archs dcgan64 --steps 50
+  ./benchmark.py --task throughput --gpu -1 --batch_sizes 1,8,32 --json_out bench/$(git rev-parse --short HEAD).json
+  ./benchmark.py --task batch_size --archs resnet128,resnet256 --memory_budget_mb 11000
+  ./benchmark.py --task onnx --archs dcgan64,resnet128 --batch_sizes 1,8,32
+'''
+from concurrent import futures
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from absl import app
+from absl import flags
+from absl import logging
+import chainer
+import chainer.functions as F
+import numpy as np
+
+import chainer_dcgan
+import chainer_models
+import onnx_export
+import trainer_extensions
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string('task', 'backends', 'Benchmark to run.')
+flags.DEFINE_list('archs', sorted(chainer_dcgan.ARCHS), 'Architectures to benchmark.')
+flags.DEFINE_list('backends', ['numpy', 'intel64', 'chainerx'], 'Backends to benchmark.')
+flags.DEFINE_list('batch_sizes', ['8'], 'Batch sizes to benchmark.')
+flags.DEFINE_integer('warmup_steps', 2, 'Number of untimed steps before measuring.')
+flags.DEFINE_integer('steps', 5, 'Number of timed steps.')
+flags.DEFINE_float('tolerance', 1e-4, 'Max abs difference allowed by equivalence checks.')
+flags.DEFINE_string('json_out', 'benchmark.json', 'Where to write machine-readable results.')
+
+
+def synchronize(device):
+    if isinstance(device, chainer.backend.GpuDevice):
+        device.device.synchronize()
+
+
+def time_steps(step, device, warmup_steps, steps):
+    """Return the mean wall time in seconds of `step()`."""
+    for _ in range(warmup_steps):
+        step()
+    synchronize(device)
+
+    start = time.perf_counter()
+    for _ in range(steps):
+        step()
+    synchronize(device)
+    return (time.perf_counter() - start) / steps
+
+
+def time_update(updater, warmup_steps, steps):
+    """Return the mean wall time in seconds of a DRAGAN update step."""
+    return time_steps(updater.update, updater.gen.device, warmup_steps, steps)
+
+
+def host_info():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'host': platform.node(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'chainer': chainer.__version__,
+        'numpy': np.__version__,
+        'commit': commit,
+    }
+
+
+def backends():
+    rows = []
+    for arch in FLAGS.archs:
+        for backend in FLAGS.backends:
+            if not chainer_dcgan.backend_is_available(backend, FLAGS.gpu):
+                logging.warning('Skipping backend %s: not available.', backend)
+                continue
+            device = chainer_dcgan.get_device(backend, FLAGS.gpu)
+            for batch_size in map(int, FLAGS.batch_sizes):
+                updater = chainer_dcgan.make_synthetic_updater(
+                    arch, batch_size, device, lambda_gp=FLAGS.lambda_gp, smoothing=FLAGS.smoothing)
+                step_time = time_update(updater, FLAGS.warmup_steps, FLAGS.steps)
+                rows.append((arch, backend, batch_size, step_time))
+                logging.info('%s %s batch_size=%d: %.4f s/step', arch, backend, batch_size, step_time)
+
+    print('%-10s %-10s %10s %12s %12s' % ('arch', 'backend', 'batch_size', 'sec/step', 'images/sec'))
+    for arch, backend, batch_size, step_time in rows:
+        print('%-10s %-10s %10d %12.4f %12.1f' % (arch, backend, batch_size, step_time, batch_size / step_time))
+
+
+def forward_backward(model, x):
+    y = model(chainer.Variable(x))
+    model.cleargrads()
+    F.sum(y).backward()
+    return y
+
+
+def max_abs_diff(a, b):
+    a = chainer.backend.CpuDevice().send(a)
+    b = chainer.backend.CpuDevice().send(b)
+    return float(np.max(np.abs(a - b)))
+
+
+def time_forward_backward(model, x, warmup_steps, steps):
+    return time_steps(lambda: forward_backward(model, x), model.device, warmup_steps, steps)
+
+
+def static_graph():
+    """Check that static-graph models match define-by-run ones and compare their per-step overhead."""
+    device = chainer_dcgan.get_device(FLAGS.backend, FLAGS.gpu)
+    device.use()
+
+    rows = []
+    for arch in FLAGS.archs:
+        generator_class, discriminator_class, image_size = chainer_dcgan.get_arch(arch)
+        for model_name, model_class in (('gen', generator_class), ('dis', discriminator_class)):
+            for batch_size in map(int, FLAGS.batch_sizes):
+                define_by_run = model_class()
+                static = chainer_dcgan.make_static(model_class)()
+                chainer_dcgan.copy_param(static, define_by_run)
+                define_by_run.to_device(device)
+                static.to_device(device)
+
+                if model_name == 'gen':
+                    x = define_by_run.make_hidden(batch_size)
+                else:
+                    x = np.random.uniform(-1, 1, (batch_size, 3, image_size, image_size)).astype(np.float32)
+                x = chainer_dcgan.to_device(device, x)
+
+                # The first static call traces the graph, later ones replay it; compare both.
+                output_diff = 0.0
+                for _ in range(2):
+                    y_define_by_run = forward_backward(define_by_run, x)
+                    y_static = forward_backward(static, x)
+                    output_diff = max(output_diff, max_abs_diff(y_define_by_run.array, y_static.array))
+                static_params = dict(static.namedparams())
+                grad_diff = max(
+                    max_abs_diff(param.grad, static_params[name].grad) for name, param in define_by_run.namedparams())
+
+                define_by_run_time = time_forward_backward(define_by_run, x, FLAGS.warmup_steps, FLAGS.steps)
+                static_time = time_forward_backward(static, x, FLAGS.warmup_steps, FLAGS.steps)
+                rows.append((arch, model_name, batch_size, output_diff, grad_diff, define_by_run_time, static_time))
+                logging.info('%s %s batch_size=%d: output diff %g, grad diff %g', arch, model_name, batch_size,
+                             output_diff, grad_diff)
+
+    print('%-10s %-5s %10s %12s %12s %14s %14s' % (
+        'arch', 'model', 'batch_size', 'output_diff', 'grad_diff', 'dbr ms/step', 'static ms/step'))
+    for arch, model_name, batch_size, output_diff, grad_diff, define_by_run_time, static_time in rows:
+        print('%-10s %-5s %10d %12.3g %12.3g %14.2f %14.2f' % (
+            arch, model_name, batch_size, output_diff, grad_diff, define_by_run_time * 1e3, static_time * 1e3))
+
+    mismatches = [row[:3] for row in rows if max(row[3], row[4]) > FLAGS.tolerance]
+    if mismatches:
+        raise AssertionError('static graph differs from define-by-run for %s' % mismatches)
+
+
+def mixed_precision():
+    """Train a short run in float32 and in mixed16 on CPU, comparing losses and peak host memory per step."""
+    device = chainer_dcgan.get_device(FLAGS.backend, FLAGS.gpu)
+    keys = ['gen/loss_adv', 'dis/loss_adv', 'dis/loss_gp']
+
+    rows = []
+    for arch in FLAGS.archs:
+        for batch_size in map(int, FLAGS.batch_sizes):
+            for mixed in (False, True):
+                np.random.seed(0)
+                updater = chainer_dcgan.make_synthetic_updater(
+                    arch, batch_size, device, mixed_precision=mixed, lambda_gp=FLAGS.lambda_gp)
+                reporter = chainer.Reporter()
+                reporter.add_observer('gen', updater.gen)
+                reporter.add_observer('dis', updater.dis)
+
+                peak_bytes = 0
+                non_finite_steps = 0
+                for _ in range(FLAGS.steps):
+                    observation = {}
+                    tracemalloc.start()
+                    with reporter.scope(observation):
+                        updater.update()
+                    peak_bytes = max(peak_bytes, tracemalloc.get_traced_memory()[1])
+                    tracemalloc.stop()
+                    losses = [float(observation[key].array) for key in keys if key in observation]
+                    if not np.all(np.isfinite(losses)):
+                        non_finite_steps += 1
+
+                loss_scale = chainer_dcgan.get_loss_scale(updater.get_optimizer('dis'))
+                rows.append((arch, batch_size, 'mixed16' if mixed else 'float32', losses, non_finite_steps,
+                             peak_bytes, loss_scale))
+
+    print('%-10s %10s %8s %30s %10s %10s %10s' % (
+        'arch', 'batch_size', 'dtype', ' '.join(keys), 'non_finite', 'peak MB', 'loss_scale'))
+    for arch, batch_size, dtype, losses, non_finite_steps, peak_bytes, loss_scale in rows:
+        print('%-10s %10d %8s %30s %10d %10.1f %10s' % (
+            arch, batch_size, dtype, ' '.join('%.4f' % loss for loss in losses), non_finite_steps, peak_bytes / 2**20,
+            loss_scale))
+
+    unstable = [row[:3] for row in rows if not np.all(np.isfinite(row[3]))]
+    if unstable:
+        raise AssertionError('losses are not finite at the end of the run for %s' % unstable)
+
+
+def measure_throughput(arch, batch_size, backend, gpu, warmup_steps, steps):
+    """Measure one configuration. It runs in a fresh process, so the peak RSS is that of this configuration alone."""
+    device = chainer_dcgan.get_device(backend, gpu)
+    updater = chainer_dcgan.make_synthetic_updater(arch, batch_size, device)
+    gen = updater.gen
+    z = chainer_dcgan.to_device(device, gen.make_hidden(batch_size))
+
+    def generate():
+        with chainer.using_config('train', False), chainer.using_config('enable_backprop', False):
+            gen(z)
+
+    inference_time = time_steps(generate, device, warmup_steps, steps)
+    update_time = time_update(updater, warmup_steps, steps)
+    return {
+        'arch': arch,
+        'batch_size': batch_size,
+        'backend': backend,
+        'device': str(device),
+        'inference_sec_per_batch': inference_time,
+        'inference_images_per_sec': batch_size / inference_time,
+        'update_sec_per_step': update_time,
+        'update_steps_per_sec': 1.0 / update_time,
+        'peak_rss_bytes': trainer_extensions.peak_rss_bytes(),
+    }
+
+
+def throughput():
+    """Generator inference and DRAGAN update throughput plus peak RSS for every arch and batch size, as JSON."""
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for arch in FLAGS.archs:
+        for batch_size in map(int, FLAGS.batch_sizes):
+            with futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                future = executor.submit(measure_throughput, arch, batch_size, FLAGS.backend, FLAGS.gpu,
+                                         FLAGS.warmup_steps, FLAGS.steps)
+                try:
+                    result = future.result()
+                except (MemoryError, futures.BrokenExecutor) as e:
+                    logging.warning('%s batch_size=%d failed: %r', arch, batch_size, e)
+                    result = {'arch': arch, 'batch_size': batch_size, 'backend': FLAGS.backend, 'error': repr(e)}
+            logging.info('%s', result)
+            results.append(result)
+
+    output_dir = os.path.dirname(FLAGS.json_out)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    with open(FLAGS.json_out, 'w') as f:
+        json.dump({'host': host_info(), 'warmup_steps': FLAGS.warmup_steps, 'steps': FLAGS.steps,
+                   'results': results}, f, indent=2, sort_keys=True)
+    logging.info('Wrote %d results to %s', len(results), FLAGS.json_out)
+
+
+def import_seconds(module):
+    """Wall time of importing `module` in a fresh interpreter."""
+    code = 'import time; start = time.perf_counter(); import %s; print(time.perf_counter() - start)' % module
+    return float(subprocess.check_output([sys.executable, '-c', code]))
+
+
+def measure_cpu_inference(arch, batch_size, runtime, path, warmup_steps, steps):
+    """Cold start (load and first batch) and throughput of a generator on `chainer` or `onnxruntime`, on CPU.
+
+    It runs in a fresh process, so nothing is cached from an earlier configuration.
+    """
+    z = np.random.RandomState(0).randn(batch_size, 128).astype(np.float32)
+    start = time.perf_counter()
+    if runtime == 'onnxruntime':
+        run = onnx_export.OnnxGenerator(path)
+    else:
+        gen = chainer_models.make_inference_generator(arch, dict(np.load(path)))
+
+        def run(z):
+            with chainer.using_config('train', False), chainer.using_config('enable_backprop', False):
+                return gen(z.reshape(z.shape + (1, 1))).array
+    run(z)
+    load_and_first_batch = time.perf_counter() - start
+
+    inference_time = time_steps(lambda: run(z), chainer.get_device('@numpy'), warmup_steps, steps)
+    return {
+        'arch': arch,
+        'batch_size': batch_size,
+        'runtime': runtime,
+        'load_and_first_batch_sec': load_and_first_batch,
+        'inference_sec_per_batch': inference_time,
+        'inference_images_per_sec': batch_size / inference_time,
+        'peak_rss_bytes': trainer_extensions.peak_rss_bytes(),
+    }
+
+
+def onnx():
+    """Chainer CPU inference against the ONNX export on ONNX Runtime: cold start and throughput, as JSON.
+
+    Generators have random initial weights. Cold start is the import time of the runtime's package plus loading the
+    model and running the first batch, each configuration in a fresh process.
+    """
+    imports = {'chainer': import_seconds('chainer'), 'onnxruntime': import_seconds('onnxruntime')}
+    results = []
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as directory:
+        for arch in FLAGS.archs:
+            gen = chainer_models.get_arch(arch)[0]()
+            paths = {
+                'chainer': os.path.join(directory, arch + '.npz'),
+                'onnxruntime': os.path.join(directory, arch + '.onnx'),
+            }
+            chainer.serializers.save_npz(paths['chainer'], gen)
+            onnx_export.export_onnx(arch, trainer_extensions.host_copy(gen), paths['onnxruntime'])
+
+            for batch_size in map(int, FLAGS.batch_sizes):
+                for runtime, path in paths.items():
+                    with futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                        result = executor.submit(measure_cpu_inference, arch, batch_size, runtime, path,
+                                                 FLAGS.warmup_steps, FLAGS.steps).result()
+                    result['import_sec'] = imports[runtime]
+                    result['cold_start_sec'] = imports[runtime] + result['load_and_first_batch_sec']
+                    results.append(result)
+
+    print('%-10s %10s %12s %14s %14s' % ('arch', 'batch_size', 'runtime', 'cold_start_s', 'images_per_sec'))
+    for result in results:
+        print('%-10s %10d %12s %14.2f %14.1f' % (result['arch'], result['batch_size'], result['runtime'],
+                                                 result['cold_start_sec'], result['inference_images_per_sec']))
+    with open(FLAGS.json_out, 'w') as f:
+        json.dump({'host': host_info(), 'warmup_steps': FLAGS.warmup_steps, 'steps': FLAGS.steps,
+                   'results': results}, f, indent=2, sort_keys=True)
+
+
+def batch_size():
+    """Largest and fastest batch size of every arch within --memory_budget_mb."""
+    device = chainer_dcgan.get_device(FLAGS.backend, FLAGS.gpu)
+    device.use()
+    memory_budget = FLAGS.memory_budget_mb * 2**20 or chainer_dcgan.default_memory_budget(device)
+
+    results = {}
+    for arch in FLAGS.archs:
+        results[arch] = chainer_dcgan.find_batch_size(arch, memory_budget, device,
+                                                      mixed_precision=FLAGS.mixed_precision, lambda_gp=FLAGS.lambda_gp)
+
+    print('memory budget: %d MB' % (memory_budget // 2**20))
+    print('%-10s %10s %10s' % ('arch', 'largest', 'fastest'))
+    for arch, found in results.items():
+        print('%-10s %10d %10d' % (arch, found['largest'], found['fastest']))
+
+    with open(FLAGS.json_out, 'w') as f:
+        json.dump({'host': host_info(), 'memory_budget_bytes': memory_budget, 'results': results}, f, indent=2)
+
+
+def main(argv):
+    del argv  # Unused.
+
+    logging.info('task is %s.' % FLAGS.task)
+    func = globals()[FLAGS.task]
+    func()
+
+
+if __name__ == '__main__':
+    app.run(main)
@@ -1,6 +1,10 @@
 #!/usr/bin/env python3
+from concurrent import futures
+import functools
 import sys
 import os
+import time
+import tracemalloc
 # import copy
 # import six
 # import subprocess
@@ -11,19 +15,43 @@ from absl import flags
 
 import chainer
 import chainer.cuda
+import chainer.function_hooks
 # from chainer.dataset import concat_examples
 # from chainer import function
 import chainer.functions as F
 import chainer.links as L
+from chainer import static_graph
 from chainer import Variable
 from chainer import training
 from chainer.training import extension
 from chainer.training import extensions
+import chainerx
 import numpy as np
-import tensorflow as tf
 from PIL import Image
 
-import tensorflow_datasets as tfds
+from chainer_models import (  # noqa: F401 (re-exported)
+    ARCHS,
+    DCGANGenerator64,
+    DCGANDiscriminator64,
+    DCGANGenerator128,
+    DCGANDiscriminator128,
+    DCGANGenerator256,
+    DCGANDiscriminator256,
+    ResNetResBlockUp,
+    ResNetResBlockDown,
+    LinkRelu,
+    LinkTanh,
+    ResNetInputDense,
+    ResNetOutputDense,
+    ResNetGenerator128,
+    ResNetDiscriminator128,
+    ResNetGenerator256,
+    ResNetDiscriminator256,
+    get_arch,
+)
+import evaluation
+import model_export
+import trainer_extensions
 
 def record_setting(out):
     """Record scripts and commandline arguments"""
@@ -37,23 +65,75 @@ def record_setting(out):
         f.write(" ".join(sys.argv) + "\n")
 
 
+def backend_is_available(backend, gpu=0):
+    if backend == 'cupy':
+        return chainer.backends.cuda.available and gpu >= 0
+    elif backend == 'intel64':
+        return chainer.backends.intel64.is_ideep_available()
+    elif backend == 'chainerx':
+        return chainerx.is_available()
+    elif backend == 'numpy':
+        return True
+    else:
+        raise ValueError('Unknown --backend %s' % backend)
+
+
+def get_device(backend, gpu=0):
+    """Resolve --backend into a chainer device, falling back to NumPy when it is unavailable."""
+    if backend == 'auto':
+        backend = 'cupy' if gpu >= 0 else 'numpy'
+
+    if not backend_is_available(backend, gpu):
+        print('backend {} is not available, falling back to numpy'.format(backend))
+        backend = 'numpy'
+
+    if backend == 'cupy':
+        return chainer.get_device('@cupy:%d' % gpu)
+    elif backend == 'intel64':
+        chainer.global_config.use_ideep = 'auto'
+        return chainer.get_device('@intel64')
+    elif backend == 'chainerx':
+        return chainer.get_device('native:0')
+    return chainer.get_device('@numpy')
+
+
+def get_input_dtype(model):
+    """The dtype `model` expects for its input, i.e. that of its weights.
+
+    Under `chainer.mixed16` weights are float16 while BatchNormalization parameters stay float32.
+    """
+    for link in model.links():
+        if isinstance(link, (L.Linear, L.Convolution2D, L.Deconvolution2D)):
+            return link.W.dtype
+    return np.dtype(np.float32)
+
+
+def to_device(device, array):
+    """Send a NumPy array to `device`. iDeep functions take NumPy inputs directly, so those stay on host."""
+    if isinstance(device, chainer.backend.Intel64Device):
+        return array
+    return device.send(array)
+
+
+def tile_images(x, rows, cols):
+    """Arrange a (rows * cols, 3, H, W) batch in [-1, 1] into a single uint8 (rows * H, cols * W, 3) image."""
+    x = np.asarray(np.clip(x * 127.5 + 127.5, 0.0, 255.0), dtype=np.uint8)
+    _, _, H, W = x.shape
+    x = x.reshape((rows, cols, 3, H, W))
+    x = x.transpose(0, 3, 1, 4, 2)
+    return x.reshape((rows * H, cols * W, 3))
+
+
 def sample_generate_light(gen, dst, rows=5, cols=5, seed=0, subdir='preview'):
     @chainer.training.make_extension()
     def make_image(trainer):
-        np.random.seed(seed)
         n_images = rows * cols
-        xp = gen.xp
-        z = Variable(xp.asarray(gen.make_hidden(n_images)))
+        z = evaluation.make_fixed_hidden(gen, n_images, seed)
+        z = Variable(to_device(gen.device, z.astype(get_input_dtype(gen))))
         with chainer.using_config('train', False), chainer.using_config('enable_backprop', False):
             x = gen(z)
-        x = chainer.cuda.to_cpu(x.data)
-        np.random.seed()
-
-        x = np.asarray(np.clip(x * 127.5 + 127.5, 0.0, 255.0), dtype=np.uint8)
-        _, _, H, W = x.shape
-        x = x.reshape((rows, cols, 3, H, W))
-        x = x.transpose(0, 3, 1, 4, 2)
-        x = x.reshape((rows * H, cols * W, 3))
+        x = chainer.backend.CpuDevice().send(x.data)
+        x = tile_images(x, rows, cols)
 
         preview_dir = '{}/{}'.format(dst, subdir)
         if not os.path.exists(preview_dir):
@@ -67,25 +147,72 @@ def sample_generate_light(gen, dst, rows=5, cols=5, seed=0, subdir='preview'):
     return make_image
 
 
+class AsyncPreview(extension.Extension):
+    """Same previews as `sample_generate_light`, rendered off the training thread.
+
+    The latents are drawn once and kept on the generator's device. On each call the generator's weights are copied to
+    a private snapshot, and a single worker thread runs the snapshot and encodes and writes the PNGs. The training
+    thread only waits if the previous preview is still being rendered. The snapshot is a define-by-run instance, so it
+    shares no static graph schedule with a `make_static` generator.
+    """
+
+    def __init__(self, gen, dst, rows=5, cols=5, seed=0, subdir='preview'):
+        self.gen = gen
+        self.rows = rows
+        self.cols = cols
+        self.seed = seed
+        self.preview_dir = os.path.join(dst, subdir)
+        self.snapshot = None
+        self.z = None
+        self.executor = futures.ThreadPoolExecutor(max_workers=1)
+        self.pending = None
+
+    def __call__(self, trainer):
+        if self.pending is not None:
+            self.pending.result()  # Also raises errors from the worker.
+        if self.snapshot is None:
+            gen_class = getattr(type(self.gen), 'plain_class', type(self.gen))
+            dtype = get_input_dtype(self.gen)
+            with chainer.using_config('dtype', chainer.mixed16 if dtype == np.float16 else np.float32):
+                self.snapshot = gen_class()
+            self.snapshot.to_device(self.gen.device)
+            z = evaluation.make_fixed_hidden(self.gen, self.rows * self.cols, self.seed)
+            self.z = to_device(self.gen.device, z.astype(dtype))
+        copy_param(self.snapshot, self.gen)
+        self.pending = self.executor.submit(self.render, trainer.updater.iteration)
+
+    def render(self, iteration):
+        # Chainer's config and the current CUDA device are thread-local.
+        self.snapshot.device.use()
+        with chainer.using_config('train', False), chainer.using_config('enable_backprop', False):
+            x = self.snapshot(Variable(self.z))
+        x = tile_images(chainer.backend.CpuDevice().send(x.data), self.rows, self.cols)
+
+        if not os.path.exists(self.preview_dir):
+            os.makedirs(self.preview_dir, exist_ok=True)
+        image = Image.fromarray(x)
+        image.save(os.path.join(self.preview_dir, 'image_latest.png'))
+        image.save(os.path.join(self.preview_dir, 'image{:0>8}.png'.format(iteration)))
+
+    def finalize(self):
+        if self.pending is not None:
+            self.pending.result()
+            self.pending = None
+        self.executor.shutdown()
+
+
 def sample_generate(gen, dst, rows=10, cols=10, seed=0, subdir='preview'):
     """Visualization of rows*cols images randomly generated by the generator."""
 
     @chainer.training.make_extension()
     def make_image(trainer):
-        np.random.seed(seed)
         n_images = rows * cols
-        xp = gen.xp
-        z = Variable(xp.asarray(gen.make_hidden(n_images)))
+        z = evaluation.make_fixed_hidden(gen, n_images, seed)
+        z = Variable(to_device(gen.device, z.astype(get_input_dtype(gen))))
         with chainer.using_config('train', False), chainer.using_config('enable_backprop', False):
             x = gen(z)
-        x = chainer.cuda.to_cpu(x.data)
-        np.random.seed()
-
-        x = np.asarray(np.clip(x * 127.5 + 127.5, 0.0, 255.0), dtype=np.uint8)
-        _, _, h, w = x.shape
-        x = x.reshape((rows, cols, 3, h, w))
-        x = x.transpose(0, 3, 1, 4, 2)
-        x = x.reshape((rows * h, cols * w, 3))
+        x = chainer.backend.CpuDevice().send(x.data)
+        x = tile_images(x, rows, cols)
 
         preview_dir = '{}/{}'.format(dst, subdir)
         preview_path = preview_dir + '/image{:0>8}.png'.format(trainer.updater.iteration)
@@ -96,562 +223,25 @@ def sample_generate(gen, dst, rows=10, cols=10, seed=0, subdir='preview'):
     return make_image
 
 
-class DCGANGenerator64(chainer.Chain):
-    def __init__(self,
-                 n_hidden=128,
-                 bottom_width=4,
-                 ch=512,
-                 wscale=0.02,
-                 z_distribution="normal",
-                 hidden_activation=F.relu,
-                 output_activation=F.tanh,
-                 use_bn=True):
-        super().__init__()
-        self.n_hidden = n_hidden
-        self.ch = ch
-        self.bottom_width = bottom_width
-        self.z_distribution = z_distribution
-        self.hidden_activation = hidden_activation
-        self.output_activation = output_activation
-        self.use_bn = use_bn
-
-        with self.init_scope():
-            w = chainer.initializers.Normal(wscale)
-            self.l0 = L.Linear(self.n_hidden, bottom_width * bottom_width * ch, initialW=w)
-            self.dc1 = L.Deconvolution2D(ch, ch // 2, 4, 2, 1, initialW=w)
-            self.dc2 = L.Deconvolution2D(ch // 2, ch // 4, 4, 2, 1, initialW=w)
-            self.dc3 = L.Deconvolution2D(ch // 4, ch // 8, 4, 2, 1, initialW=w)
-            self.dc4 = L.Deconvolution2D(ch // 8, 3, 4, 2, 1, initialW=w)
-            if self.use_bn:
-                self.bn0 = L.BatchNormalization(bottom_width * bottom_width * ch)
-                self.bn1 = L.BatchNormalization(ch // 2)
-                self.bn2 = L.BatchNormalization(ch // 4)
-                self.bn3 = L.BatchNormalization(ch // 8)
-
-    def make_hidden(self, batchsize):
-        if self.z_distribution == "normal":
-            return np.random.randn(batchsize, self.n_hidden, 1, 1) \
-                .astype(np.float32)
-        elif self.z_distribution == "uniform":
-            return np.random.uniform(-1, 1, (batchsize, self.n_hidden, 1, 1)) \
-                .astype(np.float32)
-        else:
-            raise Exception("unknown z distribution: %s" % self.z_distribution)
-
-    def __call__(self, z):
-        if not self.use_bn:
-            h = F.reshape(self.hidden_activation(self.l0(z)), (len(z), self.ch, self.bottom_width, self.bottom_width))
-            h = self.hidden_activation(self.dc1(h))
-            h = self.hidden_activation(self.dc2(h))
-            h = self.hidden_activation(self.dc3(h))
-            x = self.output_activation(self.dc4(h))
-        else:
-            h = F.reshape(
-                self.hidden_activation(self.bn0(self.l0(z))), (len(z), self.ch, self.bottom_width, self.bottom_width))
-            h = self.hidden_activation(self.bn1(self.dc1(h)))
-            h = self.hidden_activation(self.bn2(self.dc2(h)))
-            h = self.hidden_activation(self.bn3(self.dc3(h)))
-            x = self.output_activation(self.dc4(h))
-        return x
-
-
-class DCGANDiscriminator64(chainer.Chain):
-    def __init__(self, bottom_width=4, ch=512, wscale=0.02, output_dim=1):
-        w = chainer.initializers.Normal(wscale)
-        super().__init__()
-        with self.init_scope():
-            self.c0_0 = L.Convolution2D(3, ch // 8, 4, 2, 1, initialW=w)
-            self.c0_1 = L.Convolution2D(ch // 8, ch // 4, 4, 2, 1, initialW=w)
-            self.c1_0 = L.Convolution2D(ch // 4, ch // 4, 3, 1, 1, initialW=w)
-            self.c1_1 = L.Convolution2D(ch // 4, ch // 2, 4, 2, 1, initialW=w)
-            self.c2_0 = L.Convolution2D(ch // 2, ch // 2, 3, 1, 1, initialW=w)
-            self.c2_1 = L.Convolution2D(ch // 2, ch // 1, 4, 2, 1, initialW=w)
-            self.c3_0 = L.Convolution2D(ch // 1, ch // 1, 3, 1, 1, initialW=w)
-            self.l4 = L.Linear(bottom_width * bottom_width * ch, output_dim, initialW=w)
-            self.bn0_1 = L.BatchNormalization(ch // 4, use_gamma=False)
-            self.bn1_0 = L.BatchNormalization(ch // 4, use_gamma=False)
-            self.bn1_1 = L.BatchNormalization(ch // 2, use_gamma=False)
-            self.bn2_0 = L.BatchNormalization(ch // 2, use_gamma=False)
-            self.bn2_1 = L.BatchNormalization(ch // 1, use_gamma=False)
-            self.bn3_0 = L.BatchNormalization(ch // 1, use_gamma=False)
-
-    def __call__(self, x):
-        h = F.leaky_relu(self.c0_0(x))
-        h = F.leaky_relu(self.bn0_1(self.c0_1(h)))
-        h = F.leaky_relu(self.bn1_0(self.c1_0(h)))
-        h = F.leaky_relu(self.bn1_1(self.c1_1(h)))
-        h = F.leaky_relu(self.bn2_0(self.c2_0(h)))
-        h = F.leaky_relu(self.bn2_1(self.c2_1(h)))
-        h = F.leaky_relu(self.bn3_0(self.c3_0(h)))
-        return self.l4(h)
-
-# ******* GAN 128 x 128 ************************************************ #
-
-class DCGANGenerator128(chainer.Chain):
-    def __init__(self,
-                 n_hidden=128,
-                 bottom_width=4,
-                 ch=1024,
-                 wscale=0.02,
-                 z_distribution="normal",
-                 hidden_activation=F.relu,
-                 output_activation=F.tanh,
-                 use_bn=True):
-        super().__init__()
-        self.n_hidden = n_hidden
-        self.ch = ch
-        self.bottom_width = bottom_width
-        self.z_distribution = z_distribution
-        self.hidden_activation = hidden_activation
-        self.output_activation = output_activation
-        self.use_bn = use_bn
-
-        with self.init_scope():
-            w = chainer.initializers.Normal(wscale)
-            self.l0 = L.Linear(self.n_hidden, bottom_width * bottom_width * ch, initialW=w) # out: (b, 16384, 1)
-                                                                                            # reshape: (128, 1024, 4, 4)
-            self.dc1 = L.Deconvolution2D(ch, ch // 2, 4, 2, 1, initialW=w)       # (b, 512, 8, 8)
-            self.dc2 = L.Deconvolution2D(ch // 2, ch // 4, 4, 2, 1, initialW=w)  # (b, 256, 16, 16)
-            self.dc3 = L.Deconvolution2D(ch // 4, ch // 8, 4, 2, 1, initialW=w)  # (b, 128, 32, 32)
-            self.dc4 = L.Deconvolution2D(ch // 8, ch // 16, 4, 2, 1, initialW=w) # (b, 64, 64, 64)
-            self.dc5 = L.Deconvolution2D(ch // 16, 3, 4, 2, 1, initialW=w)       # (b, 3, 128, 128)
-            if self.use_bn:
-                self.bn0 = L.BatchNormalization(bottom_width * bottom_width * ch)
-                self.bn1 = L.BatchNormalization(ch // 2)
-                self.bn2 = L.BatchNormalization(ch // 4)
-                self.bn3 = L.BatchNormalization(ch // 8)
-                self.bn4 = L.BatchNormalization(ch // 16)
-
-    def make_hidden(self, batchsize):
-        if self.z_distribution == "normal":
-            return np.random.randn(batchsize, self.n_hidden, 1, 1) \
-                .astype(np.float32)
-        elif self.z_distribution == "uniform":
-            return np.random.uniform(-1, 1, (batchsize, self.n_hidden, 1, 1)) \
-                .astype(np.float32)
-        else:
-            raise Exception("unknown z distribution: %s" % self.z_distribution)
-
-    def __call__(self, z):
-        if not self.use_bn:
-            h = F.reshape(self.hidden_activation(self.l0(z)), (len(z), self.ch, self.bottom_width, self.bottom_width))
-            h = self.hidden_activation(self.dc1(h))
-            h = self.hidden_activation(self.dc2(h))
-            h = self.hidden_activation(self.dc3(h))
-            h = self.output_activation(self.dc4(h))
-            x = self.output_activation(self.dc5(h))
-        else:
-            h = F.reshape(
-                self.hidden_activation(self.bn0(self.l0(z))), (len(z), self.ch, self.bottom_width, self.bottom_width))
-            h = self.hidden_activation(self.bn1(self.dc1(h)))
-            h = self.hidden_activation(self.bn2(self.dc2(h)))
-            h = self.hidden_activation(self.bn3(self.dc3(h)))
-            h = self.hidden_activation(self.bn4(self.dc4(h)))
-            x = self.output_activation(self.dc5(h))
-        return x
-
-#(in_channels, out_channels, ksize=None, stride=1, pad=0, nobias=False, initialW=None, initial_bias=None, *, dilate=1, groups=1)
-
-class DCGANDiscriminator128(chainer.Chain):
-    def __init__(self, bottom_width=2, ch=1024, wscale=0.02, output_dim=1):
-        w = chainer.initializers.Normal(wscale)
-        super().__init__()
-        with self.init_scope():                                                 # out: (b,    c,  w,  h)
-            self.c0_0 = L.Convolution2D(3, ch // 16, 4, 2, 1, initialW=w)       # out: (b,   64, 64, 64)
-            self.c0_1 = L.Convolution2D(ch // 16, ch // 8, 4, 2, 1, initialW=w) # out: (b,   64, 32, 32)
-            self.c1_0 = L.Convolution2D(ch // 8, ch // 8, 3, 2, 1, initialW=w)  # out: (b,  128, 16, 16)
-            self.c1_1 = L.Convolution2D(ch // 8, ch // 4, 4, 2, 1, initialW=w)  # out: (b,  256,  8,  8)
-            self.c2_0 = L.Convolution2D(ch // 4, ch // 4, 3, 1, 1, initialW=w)  # out: (b,  256,  4,  4)
-            self.c2_1 = L.Convolution2D(ch // 4, ch // 2, 4, 2, 1, initialW=w)  # out: (b,  512,  2,  2)
-            self.c3_0 = L.Convolution2D(ch // 2, ch // 2, 3, 1, 1, initialW=w)  # out: (b,  512,  2,  2)
-            self.c3_1 = L.Convolution2D(ch // 2, ch // 1, 4, 2, 1, initialW=w)  # out: (b, 1024,  1,  1)
-            self.c4_0 = L.Convolution2D(ch // 1, ch // 1, 3, 1, 1, initialW=w)  # out: (b, 1024,  1,  1)
-
-            self.l4 = L.Linear(bottom_width * bottom_width * ch, output_dim, initialW=w) # in: (4096) out: (b, 1)
-
-            self.bn0_1 = L.BatchNormalization(ch // 8, use_gamma=False)
-            self.bn1_0 = L.BatchNormalization(ch // 8, use_gamma=False)
-            self.bn1_1 = L.BatchNormalization(ch // 4, use_gamma=False)
-            self.bn2_0 = L.BatchNormalization(ch // 4, use_gamma=False)
-            self.bn2_1 = L.BatchNormalization(ch // 2, use_gamma=False)
-            self.bn3_0 = L.BatchNormalization(ch // 2, use_gamma=False)
-            self.bn3_1 = L.BatchNormalization(ch // 1, use_gamma=False)
-            self.bn4_0 = L.BatchNormalization(ch // 1, use_gamma=False)
-
-    def __call__(self, x):
-        h = F.leaky_relu(self.c0_0(x))
-        h = F.leaky_relu(self.bn0_1(self.c0_1(h)))
-        h = F.leaky_relu(self.bn1_0(self.c1_0(h)))
-        h = F.leaky_relu(self.bn1_1(self.c1_1(h)))
-        h = F.leaky_relu(self.bn2_0(self.c2_0(h)))
-        h = F.leaky_relu(self.bn2_1(self.c2_1(h)))
-        h = F.leaky_relu(self.bn3_0(self.c3_0(h)))
-        h = F.leaky_relu(self.bn3_1(self.c3_1(h)))
-        h = F.leaky_relu(self.bn4_0(self.c4_0(h)))
-        return self.l4(h)
-
-# ******* GAN 256 x 256 ************************************************ #
-
-class DCGANGenerator256(chainer.Chain):
-    def __init__(self,
-                 n_hidden=128,
-                 bottom_width=4,
-                 ch=1024,
-                 wscale=0.02,
-                 z_distribution="normal",
-                 hidden_activation=F.relu,
-                 output_activation=F.tanh,
-                 use_bn=True):
-        super().__init__()
-        self.n_hidden = n_hidden
-        self.ch = ch
-        self.bottom_width = bottom_width
-        self.z_distribution = z_distribution
-        self.hidden_activation = hidden_activation
-        self.output_activation = output_activation
-        self.use_bn = use_bn
-
-        with self.init_scope():
-            w = chainer.initializers.Normal(wscale)
-            self.l0 = L.Linear(self.n_hidden, bottom_width * bottom_width * ch, initialW=w) # out: (b, 16384, 1)
-                                                                                            # reshape: (128, 1024, 4, 4)
-            self.dc1 = L.Deconvolution2D(ch, ch // 2, 4, 2, 1, initialW=w)       # (b, 512, 8, 8)
-            self.dc2 = L.Deconvolution2D(ch // 2, ch // 4, 4, 2, 1, initialW=w)  # (b, 256, 16, 16)
-            self.dc3 = L.Deconvolution2D(ch // 4, ch // 8, 4, 2, 1, initialW=w)  # (b, 128, 32, 32)
-            self.dc4 = L.Deconvolution2D(ch // 8, ch // 8, 4, 2, 1, initialW=w) # (b, 64, 64, 64)
-            self.dc5 = L.Deconvolution2D(ch // 8, ch // 16, 4, 2, 1, initialW=w)       # (b, 64, 128, 128)
-            self.dc6 = L.Deconvolution2D(ch // 16, 3, 4, 2, 1, initialW=w)       # (b, 3, 256, 256)
-            if self.use_bn:
-                self.bn0 = L.BatchNormalization(bottom_width * bottom_width * ch)
-                self.bn1 = L.BatchNormalization(ch // 2)
-                self.bn2 = L.BatchNormalization(ch // 4)
-                self.bn3 = L.BatchNormalization(ch // 8)
-                self.bn4 = L.BatchNormalization(ch // 8)
-                self.bn5 = L.BatchNormalization(ch // 16)
-
-    def make_hidden(self, batchsize):
-        if self.z_distribution == "normal":
-            return np.random.randn(batchsize, self.n_hidden, 1, 1) \
-                .astype(np.float32)
-        elif self.z_distribution == "uniform":
-            return np.random.uniform(-1, 1, (batchsize, self.n_hidden, 1, 1)) \
-                .astype(np.float32)
-        else:
-            raise Exception("unknown z distribution: %s" % self.z_distribution)
-
-    def __call__(self, z):
-        if not self.use_bn:
-            h = F.reshape(self.hidden_activation(self.l0(z)), (len(z), self.ch, self.bottom_width, self.bottom_width))
-            h = self.hidden_activation(self.dc1(h))
-            h = self.hidden_activation(self.dc2(h))
-            h = self.hidden_activation(self.dc3(h))
-            h = self.output_activation(self.dc4(h))
-            h = self.output_activation(self.dc5(h))
-            x = self.output_activation(self.dc6(h))
-        else:
-            h = F.reshape(
-                self.hidden_activation(self.bn0(self.l0(z))), (len(z), self.ch, self.bottom_width, self.bottom_width))
-            h = self.hidden_activation(self.bn1(self.dc1(h)))
-            h = self.hidden_activation(self.bn2(self.dc2(h)))
-            h = self.hidden_activation(self.bn3(self.dc3(h)))
-            h = self.hidden_activation(self.bn4(self.dc4(h)))
-            h = self.hidden_activation(self.bn5(self.dc5(h)))
-            x = self.output_activation(self.dc6(h))
-        return x
-
-class DCGANDiscriminator256(chainer.Chain):
-    def __init__(self, bottom_width=2, ch=1024, wscale=0.02, output_dim=1):
-        w = chainer.initializers.Normal(wscale)
-        super().__init__()
-        with self.init_scope():                                                 # out: (b,    c,  w,  h)
-            self.c0_0 = L.Convolution2D(3, ch // 16, 4, 2, 1, initialW=w)       # out: (b,   64, 64, 64)
-            self.c0_1 = L.Convolution2D(ch // 16, ch // 8, 4, 2, 1, initialW=w) # out: (b,   64, 32, 32)
-            self.c1_0 = L.Convolution2D(ch // 8, ch // 8, 3, 2, 1, initialW=w)  # out: (b,  128, 16, 16)
-            self.c1_1 = L.Convolution2D(ch // 8, ch // 4, 4, 2, 1, initialW=w)  # out: (b,  256,  8,  8)
-
-            self.c2_0 = L.Convolution2D(ch // 8, ch // 8, 3, 2, 1, initialW=w)  # out: (b,  128, 16, 16)
-            self.c2_1 = L.Convolution2D(ch // 8, ch // 4, 4, 2, 1, initialW=w)  # out: (b,  256,  8,  8)
-
-            self.c3_0 = L.Convolution2D(ch // 4, ch // 4, 3, 1, 1, initialW=w)  # out: (b,  256,  4,  4)
-            self.c3_1 = L.Convolution2D(ch // 4, ch // 2, 4, 2, 1, initialW=w)  # out: (b,  512,  2,  2)
-            self.c4_0 = L.Convolution2D(ch // 2, ch // 2, 3, 1, 1, initialW=w)  # out: (b,  512,  2,  2)
-            self.c4_1 = L.Convolution2D(ch // 2, ch // 1, 4, 2, 1, initialW=w)  # out: (b, 1024,  1,  1)
-            self.c5_0 = L.Convolution2D(ch // 1, ch // 1, 3, 1, 1, initialW=w)  # out: (b, 1024,  1,  1)
-
-            self.l4 = L.Linear(bottom_width * bottom_width * ch, output_dim, initialW=w) # in: (4096) out: (b, 1)
-
-            self.bn0_1 = L.BatchNormalization(ch // 8, use_gamma=False)
-            self.bn1_0 = L.BatchNormalization(ch // 8, use_gamma=False)
-            self.bn1_1 = L.BatchNormalization(ch // 4, use_gamma=False)
-            self.bn2_0 = L.BatchNormalization(ch // 4, use_gamma=False)
-
-            self.bn2_1 = L.BatchNormalization(ch // 4, use_gamma=False)
-            self.bn3_0 = L.BatchNormalization(ch // 4, use_gamma=False)
-
-            self.bn3_1 = L.BatchNormalization(ch // 2, use_gamma=False)
-            self.bn4_0 = L.BatchNormalization(ch // 2, use_gamma=False)
-            self.bn4_1 = L.BatchNormalization(ch // 1, use_gamma=False)
-            self.bn5_0 = L.BatchNormalization(ch // 1, use_gamma=False)
-
-    def __call__(self, x):
-        h = F.leaky_relu(self.c0_0(x))
-        h = F.leaky_relu(self.bn0_1(self.c0_1(h)))
-        h = F.leaky_relu(self.bn1_0(self.c1_0(h)))
-        h = F.leaky_relu(self.bn1_1(self.c1_1(h)))
-        h = F.leaky_relu(self.bn2_0(self.c2_0(h)))
-
-        h = F.leaky_relu(self.bn2_1(self.c2_1(h)))
-        h = F.leaky_relu(self.bn3_0(self.c3_0(h)))
-
-        h = F.leaky_relu(self.bn3_1(self.c3_1(h)))
-        h = F.leaky_relu(self.bn4_0(self.c4_0(h)))
-        h = F.leaky_relu(self.bn4_1(self.c4_1(h)))
-        h = F.leaky_relu(self.bn5_0(self.c5_0(h)))
-        return self.l4(h)
-
-
-# *********** END 256x256 MODEL ****************
-
-
-class ResNetResBlockUp(chainer.Chain):
-    def __init__(self, in_ch, out_ch=None, wscale=0.02):
-        super().__init__()
-        out_ch = out_ch or in_ch
-        with self.init_scope():
-            w = chainer.initializers.Normal(wscale)
-            self.c0 = L.Convolution2D(in_ch, out_ch, 3, 1, 1, initialW=w)
-            self.c1 = L.Convolution2D(out_ch, out_ch, 3, 1, 1, initialW=w)
-            self.cs = L.Convolution2D(in_ch, out_ch, 3, 1, 1, initialW=w)
-            self.bn0 = L.BatchNormalization(in_ch)
-            self.bn1 = L.BatchNormalization(out_ch)
-
-    def __call__(self, x):
-        h = self.c0(F.unpooling_2d(F.relu(self.bn0(x)), 2, 2, 0, cover_all=False))
-        h = self.c1(F.relu(self.bn1(h)))
-        hs = self.cs(F.unpooling_2d(x, 2, 2, 0, cover_all=False))
-        return h + hs
-
-
-class ResNetResBlockDown(chainer.Chain):
-    def __init__(self, in_ch, out_ch=None, wscale=0.02):
-        super().__init__()
-        out_ch = out_ch or in_ch
-        self.in_ch = in_ch
-        self.out_ch = out_ch
-
-        with self.init_scope():
-            w = chainer.initializers.Normal(wscale)
-            self.c0 = L.Convolution2D(in_ch, out_ch, 3, 1, 1, initialW=w)
-            self.c1 = L.Convolution2D(out_ch, out_ch, 4, 2, 1, initialW=w)
-            self.cs = L.Convolution2D(in_ch, out_ch, 4, 2, 1, initialW=w)
-            self.bn0 = L.BatchNormalization(in_ch)
-            self.bn1 = L.BatchNormalization(out_ch)
-
-    def __call__(self, x):
-        self.h0 = x
-        self.h1 = self.c0(F.relu(self.h0))
-        self.h2 = self.c1(F.relu(self.h1))
-        self.h3 = self.cs(self.h0)
-        self.h4 = self.h2 + self.h3
-        return self.h4
-
-
-class LinkRelu(chainer.Chain):
-    def __init__(self):
-        super().__init__()
-
-    def __call__(self, x):
-        return F.relu(x)
-
+def make_static(model_class):
+    """Subclass `model_class` so that its forward pass is traced once and replayed as a static graph.
 
-class LinkTanh(chainer.Chain):
-    def __init__(self):
-        super().__init__()
-
-    def __call__(self, x):
-        return F.tanh(x)
-
-
-class ResNetInputDense(chainer.Chain):
-    def __init__(self, n_hidden, bottom_width, ch, wscale=0.02):
-        super().__init__()
-        self.n_hidden = n_hidden
-        self.ch = ch
-        self.bottom_width = bottom_width
-        with self.init_scope():
-            w = chainer.initializers.Normal(wscale)
-            self.l = L.Linear(self.n_hidden, bottom_width * bottom_width * ch, initialW=w)
-
-    def __call__(self, z):
-        return F.reshape(self.l(z), (len(z), self.ch, self.bottom_width, self.bottom_width))
-
-
-class ResNetOutputDense(chainer.Chain):
-    def __init__(self, bottom_width, ch, n_output, wscale=0.02):
-        super().__init__()
-        self.ch = ch
-        self.bottom_width = bottom_width
-        self.n_output = n_output
-        with self.init_scope():
-            w = chainer.initializers.Normal(wscale)
-            self.l = L.Linear(bottom_width * bottom_width * ch, self.n_output, initialW=w)
-
-    def __call__(self, z):
-        z = F.reshape(z, (len(z), self.ch * self.bottom_width * self.bottom_width))
-        return self.l(z)
-
-
-class ResNetGenerator128(chainer.Chain):
-    def __init__(self, n_hidden=128, bottom_width=4, ch=1024, wscale=0.02, z_distribution="normal"):
-        super().__init__()
-        self.n_hidden = n_hidden
-        self.ch = ch
-        self.bottom_width = bottom_width
-        self.z_distribution = z_distribution
-
-        with self.init_scope():
-            w = chainer.initializers.Normal(wscale)
-            self.dense = ResNetInputDense(n_hidden, bottom_width, ch)
-            self.resblockups = chainer.ChainList(
-                ResNetResBlockUp(ch, ch),
-                ResNetResBlockUp(ch, ch // 2),
-                ResNetResBlockUp(ch // 2, ch // 4),
-                ResNetResBlockUp(ch // 4, ch // 8),
-                ResNetResBlockUp(ch // 8, ch // 16),
-            )
-            self.finals = chainer.ChainList(
-                L.BatchNormalization(ch // 16),
-                LinkRelu(),
-                L.Convolution2D(ch // 16, 3, 3, 1, 1, initialW=w),
-                LinkTanh(),
-            )
-
-    def make_hidden(self, batchsize):
-        if self.z_distribution == "normal":
-            return np.random.randn(batchsize, self.n_hidden, 1, 1) \
-                .astype(np.float32)
-        elif self.z_distribution == "uniform":
-            return np.random.uniform(-1, 1, (batchsize, self.n_hidden, 1, 1)) \
-                .astype(np.float32)
-        else:
-            raise Exception("unknown z distribution: %s" % self.z_distribution)
-
-    def __call__(self, x):
-        h = x
-        h = self.dense(h)
-        for _layers in self.resblockups:
-            h = _layers(h)
-        for _layer in self.finals:
-            h = _layer(h)
-        return h
-
-
-class ResNetDiscriminator128(chainer.Chain):
-    def __init__(self, bottom_width=4, ch=1024, wscale=0.02, output_dim=1):
-        super().__init__()
-        self.bottom_width = bottom_width
-        self.ch = ch
-        self.wscale = wscale
-        self.output_dim = output_dim
-
-        with self.init_scope():
-            self.resblockdowns = chainer.ChainList(
-                ResNetResBlockDown(3, ch // 16),
-                ResNetResBlockDown(ch // 16, ch // 8),
-                ResNetResBlockDown(ch // 8, ch // 4),
-                ResNetResBlockDown(ch // 4, ch // 2),
-                ResNetResBlockDown(ch // 2, ch),
-            )
-            self.finals = chainer.ChainList(LinkRelu(), ResNetOutputDense(bottom_width, ch, output_dim))
-
-    def __call__(self, x):
-        h = x
-        for _layers in self.resblockdowns:
-            h = _layers(h)
-        for _layer in self.finals:
-            h = _layer(h)
-        return h
-
-
-class ResNetGenerator256(chainer.Chain):
-    def __init__(self, n_hidden=128, bottom_width=4, ch=1024, wscale=0.02, z_distribution="normal"):
-        super().__init__()
-        self.n_hidden = n_hidden
-        self.ch = ch
-        self.bottom_width = bottom_width
-        self.z_distribution = z_distribution
-
-        with self.init_scope():
-            w = chainer.initializers.Normal(wscale)
-            self.dense = ResNetInputDense(n_hidden, bottom_width, ch)
-            self.resblockups = chainer.ChainList(
-                ResNetResBlockUp(ch, ch),
-                ResNetResBlockUp(ch, ch // 2),
-                ResNetResBlockUp(ch // 2, ch // 4),
-                ResNetResBlockUp(ch // 4, ch // 8),
-                ResNetResBlockUp(ch // 8, ch // 16),
-                ResNetResBlockUp(ch // 16, ch // 32),
-            )
-            self.finals = chainer.ChainList(
-                L.BatchNormalization(ch // 32),
-                LinkRelu(),
-                L.Convolution2D(ch // 32, 3, 3, 1, 1, initialW=w),
-                LinkTanh(),
-            )
-
-    def make_hidden(self, batchsize):
-        if self.z_distribution == "normal":
-            return np.random.randn(batchsize, self.n_hidden, 1, 1) \
-                .astype(np.float32)
-        elif self.z_distribution == "uniform":
-            return np.random.uniform(-1, 1, (batchsize, self.n_hidden, 1, 1)) \
-                .astype(np.float32)
-        else:
-            raise Exception("unknown z distribution: %s" % self.z_distribution)
-
-    def __call__(self, x):
-        h = x
-        h = self.dense(h)
-        for _layers in self.resblockups:
-            h = _layers(h)
-        for _layer in self.finals:
-            h = _layer(h)
-        return h
-
-
-class ResNetDiscriminator256(chainer.Chain):
-    def __init__(self, bottom_width=4, ch=1024, wscale=0.02, output_dim=1):
-        super().__init__()
-        self.bottom_width = bottom_width
-        self.ch = ch
-        self.wscale = wscale
-        self.output_dim = output_dim
-
-        with self.init_scope():
-            self.resblockdowns = chainer.ChainList(
-                ResNetResBlockDown(3, ch // 32),
-                ResNetResBlockDown(ch // 32, ch // 16),
-                ResNetResBlockDown(ch // 16, ch // 8),
-                ResNetResBlockDown(ch // 8, ch // 4),
-                ResNetResBlockDown(ch // 4, ch // 2),
-                ResNetResBlockDown(ch // 2, ch),
-            )
-            self.finals = chainer.ChainList(LinkRelu(), ResNetOutputDense(bottom_width, ch, output_dim))
-
-    def __call__(self, x):
-        h = x
-        for _layers in self.resblockdowns:
-            h = _layers(h)
-        for _layer in self.finals:
-            h = _layer(h)
-        return h
+    Parameter names are unchanged, so snapshots load into either class, which is kept as `plain_class`. Static graphs
+    do not support double backprop, so they cannot be used for a discriminator trained with a gradient penalty.
+    """
+    return type('Static' + model_class.__name__, (model_class, ), {
+        '__call__': static_graph(model_class.__call__),
+        'plain_class': model_class,
+    })
 
 
 def dcgan_loss_real(y):
+    y = F.cast(y, np.float32)
     return F.sum(F.softplus(-y)) / np.prod(y.shape)
 
 
 def dcgan_loss_fake(y):
+    y = F.cast(y, np.float32)
     return F.sum(F.softplus(y)) / np.prod(y.shape)
 
 
@@ -663,33 +253,142 @@ def copy_param(target_link, source_link):
     """Copy parameters of a link to another link."""
     target_params = dict(target_link.namedparams())
     for param_name, param in source_link.namedparams():
-        target_params[param_name].data[:] = param.data
+        target_data = chainer.backend.from_chx(target_params[param_name].data)
+        target_data[:] = chainer.backend.from_chx(param.data)
 
     # Copy Batch Normalization's statistics
     target_links = dict(target_link.namedlinks())
     for link_name, link in source_link.namedlinks():
         if isinstance(link, L.BatchNormalization):
             target_bn = target_links[link_name]
-            target_bn.avg_mean[:] = link.avg_mean
-            target_bn.avg_var[:] = link.avg_var
+            chainer.backend.from_chx(target_bn.avg_mean)[:] = chainer.backend.from_chx(link.avg_mean)
+            chainer.backend.from_chx(target_bn.avg_var)[:] = chainer.backend.from_chx(link.avg_var)
 
 
 def soft_copy_param(target_link, source_link, tau):
     """Soft-copy parameters of a link to another link."""
+    # ChainerX arrays are updated through their NumPy/CuPy views (`from_chx` is a no-op for other arrays).
     target_params = dict(target_link.namedparams())
     for param_name, param in source_link.namedparams():
-        target_params[param_name].data[:] *= (1 - tau)
-        target_params[param_name].data[:] += tau * param.data
+        target_data = chainer.backend.from_chx(target_params[param_name].data)
+        target_data[:] *= (1 - tau)
+        target_data[:] += tau * chainer.backend.from_chx(param.data).astype(target_data.dtype, copy=False)
 
     # Soft-copy Batch Normalization's statistics
     target_links = dict(target_link.namedlinks())
     for link_name, link in source_link.namedlinks():
         if isinstance(link, L.BatchNormalization):
             target_bn = target_links[link_name]
-            target_bn.avg_mean[:] *= (1 - tau)
-            target_bn.avg_mean[:] += tau * link.avg_mean
-            target_bn.avg_var[:] *= (1 - tau)
-            target_bn.avg_var[:] += tau * link.avg_var
+            target_avg_mean = chainer.backend.from_chx(target_bn.avg_mean)
+            target_avg_var = chainer.backend.from_chx(target_bn.avg_var)
+            target_avg_mean[:] *= (1 - tau)
+            target_avg_mean[:] += tau * chainer.backend.from_chx(link.avg_mean)
+            target_avg_var[:] *= (1 - tau)
+            target_avg_var[:] += tau * chainer.backend.from_chx(link.avg_var)
+
+
+def get_loss_scale(optimizer):
+    """Current loss scale of `optimizer`, or None unless loss scaling is enabled (see `make_optimizer`).
+
+    Chainer keeps the dynamic loss scale in a private attribute with no public accessors. This function and
+    `set_loss_scale` are the only places that touch it.
+    """
+    return optimizer._loss_scale
+
+
+def set_loss_scale(optimizer, loss_scale):
+    """Set the dynamic loss scale of `optimizer`, e.g. when restoring it from a checkpoint."""
+    optimizer._loss_scale = loss_scale
+
+
+class PhaseTimer(object):
+    """Wall time of the consecutive phases of an update, reported as `time/<phase>`.
+
+    Device work is asynchronous on GPU, so there a phase measures the time to issue its work rather than to run it.
+    """
+
+    def __init__(self):
+        self.times = {}
+        self.start = self.last = time.perf_counter()
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.times[phase] = self.times.get(phase, 0.0) + (now - self.last)
+        self.last = now
+
+    def report(self):
+        observation = {'time/' + phase: t for phase, t in self.times.items()}
+        observation['time/total'] = self.last - self.start
+        chainer.report(observation)
+
+
+class HostMemoryHook(chainer.FunctionHook):
+    """Function hook recording host bytes allocated by each function, as traced by tracemalloc.
+
+    NumPy registers its buffers with tracemalloc, so this is the CPU counterpart of CupyMemoryProfileHook.
+    The bytes of a call are those still allocated when it returns, i.e. mostly its outputs.
+    """
+
+    name = 'HostMemoryHook'
+
+    def __init__(self):
+        self.call_history = []
+        self._started_tracing = False
+        self._starts = []
+
+    def added(self, function=None):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    def deleted(self, function=None):
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def _preprocess(self):
+        self._starts.append(tracemalloc.get_traced_memory()[0])
+
+    def _postprocess(self, function):
+        allocated = tracemalloc.get_traced_memory()[0] - self._starts.pop()
+        self.call_history.append((function._impl_name, max(allocated, 0)))
+
+    def forward_preprocess(self, function, in_data):
+        self._preprocess()
+
+    def forward_postprocess(self, function, in_data):
+        self._postprocess(function)
+
+    def backward_preprocess(self, function, in_data, out_grad):
+        self._preprocess()
+
+    def backward_postprocess(self, function, in_data, out_grad):
+        self._postprocess(function)
+
+    def summary(self):
+        summary = {}
+        for function_name, allocated in self.call_history:
+            record = summary.setdefault(function_name, {'used_bytes': 0, 'occurrence': 0})
+            record['used_bytes'] += allocated
+            record['occurrence'] += 1
+        return summary
+
+
+def write_profile(path, timer_hook, memory_hook):
+    """Write a per-function-type table of time, call count and bytes allocated, slowest first."""
+    times = timer_hook.summary()
+    memory = memory_hook.summary()
+    rows = []
+    for function_name in set(times) | set(memory):
+        elapsed_time = times.get(function_name, {}).get('elapsed_time', 0.0)
+        occurrence = times.get(function_name, {}).get('occurrence', 0)
+        used_bytes = memory.get(function_name, {}).get('used_bytes', 0)
+        rows.append((elapsed_time, function_name, occurrence, used_bytes))
+
+    with open(path, 'w') as f:
+        f.write('function\tcalls\ttime_sec\tbytes\n')
+        for elapsed_time, function_name, occurrence, used_bytes in sorted(rows, reverse=True):
+            f.write('%s\t%d\t%.6f\t%d\n' % (function_name, occurrence, elapsed_time, used_bytes))
 
 
 class DRAGANUpdater(chainer.training.StandardUpdater):
@@ -701,32 +400,56 @@ class DRAGANUpdater(chainer.training.StandardUpdater):
         self.learning_rate_anneal = kwargs.pop('learning_rate_anneal')
         self.learning_rate_anneal_trigger = kwargs.pop('learning_rate_anneal_trigger')
         self.learning_rate_anneal_interval = kwargs.pop('learning_rate_anneal_interval')
+        self.profile_every = kwargs.pop('profile_every', 0)
+        self.profile_out = kwargs.pop('profile_out', None)
         super().__init__(*args, **kwargs)
+        self.gen_dtype = get_input_dtype(self.gen)
+        self.dis_dtype = get_input_dtype(self.dis)
 
     def get_x_real_data(self, batch, batch_size):
-        xp = self.gen.xp
         x_real_data = []
         for i in range(batch_size):
             this_instance = batch[i]
             if isinstance(this_instance, tuple):
                 this_instance = this_instance[0]  # It's (data, data_id), so take the first one.
-            x_real_data.append(np.asarray(this_instance).astype("f"))
-        x_real_data = xp.asarray(x_real_data)
+            x_real_data.append(np.asarray(this_instance).astype(self.dis_dtype))
+        x_real_data = to_device(self.gen.device, np.asarray(x_real_data))
         return x_real_data
 
     def get_z_fake_data(self, batch_size):
-        xp = self.gen.xp
-        return xp.asarray(self.gen.make_hidden(batch_size))
+        return to_device(self.gen.device, self.gen.make_hidden(batch_size).astype(self.gen_dtype))
 
-    def update_core(self):
-        xp = self.gen.xp
+    def update(self):
+        if self.profile_every > 0 and (self.iteration + 1) % self.profile_every == 0:
+            self.profile_update()
+        else:
+            super().update()
+
+    def profile_update(self):
+        """Run one update under function hooks and write the per-function table to `profile_out`."""
+        timer_hook = chainer.function_hooks.TimerHook()
+        if isinstance(self.gen.device, chainer.backend.GpuDevice):
+            memory_hook = chainer.function_hooks.CupyMemoryProfileHook()
+        else:
+            memory_hook = HostMemoryHook()
+
+        with timer_hook, memory_hook:
+            super().update()
 
+        profile_dir = os.path.join(self.profile_out, 'profile')
+        if not os.path.exists(profile_dir):
+            os.makedirs(profile_dir)
+        write_profile(os.path.join(profile_dir, 'iter_{:0>8}.tsv'.format(self.iteration)), timer_hook, memory_hook)
+
+    def update_core(self):
         opt_g = self.get_optimizer('gen')
         opt_d = self.get_optimizer('dis')
+        timer = PhaseTimer()
 
         # z: latent | x: data | y: dis output
         # *_real/*_fake/*_pertubed: Variable
         # *_data: just data (xp array)
+        # Backward passes use the optimizers' loss scale, which is None unless --mixed_precision is set.
 
         batch = self.get_iterator('main').next()
         batch_size = len(batch)
@@ -736,6 +459,7 @@ class DRAGANUpdater(chainer.training.StandardUpdater):
 
         x_real = Variable(x_real_data)
         z_fake = Variable(z_fake_data)
+        timer.lap('data')
 
         x_fake = self.gen(z_fake)
         y_fake = self.dis(x_fake)
@@ -743,20 +467,24 @@ class DRAGANUpdater(chainer.training.StandardUpdater):
         chainer.report({'loss_adv': loss_gen}, self.gen)
 
         self.gen.cleargrads()
-        loss_gen.backward()
+        loss_gen.backward(loss_scale=get_loss_scale(opt_g))
         opt_g.update()
         x_fake.unchain_backward()
+        timer.lap('gen')
 
         # keep smoothed generator.
         soft_copy_param(self.smoothed_gen, self.gen, 1.0 - self.smoothing)
+        timer.lap('ema')
 
         # alternative gradient update
         x_fake = self.gen(z_fake)
         x_fake.unchain_backward()
+        timer.lap('gen2')
         y_fake = self.dis(x_fake)
         if self.lambda_gp > 0:
             y_real = self.dis(x_real)
             loss_adv = dcgan_loss_real(y_real) + dcgan_loss_fake(y_fake)
+            timer.lap('dis')
             '''
             # WGAN-GP specific start
             eta = xp.random.uniform(
@@ -766,18 +494,27 @@ class DRAGANUpdater(chainer.training.StandardUpdater):
             # WGAN-GP specific ends
             '''
             # DRAGAN specific starts
-            std_x_real_data = xp.std(x_real.data, axis=0, keepdims=True)
-            rnd_x = xp.random.uniform(-1, 1, x_real.data.shape).astype("f")
-            x_perturbed = Variable((x_real.data + 0.5 * rnd_x * std_x_real_data).astype('f'))
+            # The perturbation is drawn with NumPy/CuPy, which also backs ChainerX arrays.
+            x_real_data = chainer.backend.from_chx(x_real.data)
+            xp = chainer.backend.get_array_module(x_real_data)
+            std_x_real_data = xp.std(x_real_data, axis=0, keepdims=True)
+            rnd_x = xp.random.uniform(-1, 1, x_real_data.shape).astype("f")
+            x_perturbed = (x_real_data + 0.5 * rnd_x * std_x_real_data).astype(self.dis_dtype)
+            x_perturbed = Variable(to_device(self.gen.device, x_perturbed))
             # DRAGAN specific ends
 
             y_perturbed = self.dis(x_perturbed)
 
+            # In float16 the input gradient underflows, so it is taken on the scaled output and unscaled in float32.
+            gp_scale = get_loss_scale(opt_d) or 1.0
+            y_perturbed = F.cast(y_perturbed, np.float32) * gp_scale
             grad_x_perturbed, = chainer.grad([y_perturbed], [x_perturbed], enable_double_backprop=True)
+            grad_x_perturbed = F.cast(grad_x_perturbed, np.float32) / gp_scale
             grad_l2 = F.sqrt(F.sum(grad_x_perturbed**2, axis=(1, 2, 3)))
             loss_gp = self.lambda_gp * loss_l2(grad_l2, 1.0)
 
             loss_dis = loss_adv + loss_gp
+            timer.lap('gp')
 
             chainer.report({'loss_adv': loss_adv, 'loss_gp': loss_gp}, self.dis)
         else:
@@ -785,17 +522,50 @@ class DRAGANUpdater(chainer.training.StandardUpdater):
             loss_adv = dcgan_loss_real(y_real) + dcgan_loss_fake(y_fake)
 
             loss_dis = loss_adv
+            timer.lap('dis')
 
             chainer.report({'loss_adv': loss_adv}, self.dis)
 
+        # The backward pass includes the gradient penalty's double backward, so `time/gp` covers only its forward pass
+        # and the first-order gradient.
         self.dis.cleargrads()
-        loss_dis.backward()
+        loss_dis.backward(loss_scale=get_loss_scale(opt_d))
         opt_d.update()
+        timer.lap('dis_backward')
+        timer.report()
 
         if (self.learning_rate_anneal > 0 and self.iteration >= self.learning_rate_anneal_trigger
                 and self.iteration % self.learning_rate_anneal_interval == 0):
             self.update_learning_rate()
 
+    def serialize(self, serializer):
+        """Also (de)serialize the smoothed generator, loss scales and NumPy's global RNG, and save the batch size.
+
+        The global RNG drives the iterator's shuffling and the latent samples. CuPy's RNG is not saved.
+        """
+        super().serialize(serializer)
+        self.smoothed_gen.serialize(serializer['smoothed_gen'])
+        if isinstance(serializer, chainer.serializer.Serializer):
+            # Only saved: `main` reads it from the checkpoint to resume `--batch_size auto` with the same batch size.
+            serializer('batch_size', self.get_iterator('main').batch_size)
+        for name, optimizer in self.get_all_optimizers().items():
+            loss_scale = get_loss_scale(optimizer)
+            if loss_scale is not None:
+                set_loss_scale(optimizer, serializer['optimizer:' + name]('loss_scale', loss_scale))
+
+        _, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+        keys = np.array(keys, copy=True)
+        serializer('numpy_rng_keys', keys)
+        pos = serializer('numpy_rng_pos', pos)
+        has_gauss = serializer('numpy_rng_has_gauss', has_gauss)
+        cached_gaussian = serializer('numpy_rng_cached_gaussian', cached_gaussian)
+
+        if isinstance(serializer, chainer.serializer.Deserializer):
+            np.random.set_state(('MT19937', keys, int(pos), int(has_gauss), float(cached_gaussian)))
+            # The annealed learning rate is a hyperparameter, so recompute it for the restored iteration.
+            if self.learning_rate_anneal > 0:
+                self.update_learning_rate()
+
     def update_learning_rate(self):
         opt_g = self.get_optimizer('gen')
         opt_d = self.get_optimizer('dis')
@@ -817,7 +587,9 @@ flags.DEFINE_integer('image_size', 32, 'Size of image.')
 
 # hps (training dynamics)
 # flags.DEFINE_integer('seed', 19260817, '')
-flags.DEFINE_integer('batch_size', 64, '')
+flags.DEFINE_string('batch_size', '64', 'Batch size, or `auto` for the largest that fits in --memory_budget_mb.')
+flags.DEFINE_integer('memory_budget_mb', 0,
+                     'Memory budget for --batch_size auto. 0 uses 90% of free GPU memory or 80% of available RAM.')
 flags.DEFINE_float('adam_alpha', 0.0002, 'alpha in Adam optimizer')
 flags.DEFINE_float('adam_beta1', 0.5, 'beta1 in Adam optimizer')
 flags.DEFINE_float('adam_beta2', 0.999, 'beta2 in Adam optimizer')
@@ -830,22 +602,201 @@ flags.DEFINE_integer('learning_rate_anneal_interval', 10000, 'interval of learni
 
 # hps (device)
 flags.DEFINE_integer('gpu', 0, 'GPU ID (negative value indicates CPU)')
+flags.DEFINE_enum('backend', 'auto', ['auto', 'numpy', 'cupy', 'intel64', 'chainerx'],
+                  'Array backend. `auto` uses cupy when --gpu >= 0 and numpy otherwise.')
+
+# hps (execution)
+flags.DEFINE_boolean('static_graph', False,
+                     'Run the generator forward pass (and the discriminator one when --lambda_gp is 0) '
+                     'as a chainer static graph.')
+
+flags.DEFINE_boolean('mixed_precision', False,
+                     'Train with float16 activations and float32 master weights, BatchNormalization statistics and '
+                     'smoothed generator, using dynamic loss scaling.')
 
 # hps (I/O)
 flags.DEFINE_string('npz_path', '', 'path to dataset npz file')
 flags.DEFINE_string('out', 'result', 'Directory to output the result')
 flags.DEFINE_integer('snapshot_interval', 10000, 'Interval of snapshot')
+flags.DEFINE_integer('snapshot_max_outstanding', 2,
+                     'Max snapshots being written in the background at once. 0 writes them on the training thread.')
+flags.DEFINE_integer('snapshot_keep_last', 0, 'Keep the newest N snapshots of each model. 0 disables the rule.')
+flags.DEFINE_integer('snapshot_keep_every', 0, 'Keep snapshots at multiples of N iterations. 0 disables the rule.')
+flags.DEFINE_integer('snapshot_keep_best', 0, 'Keep the best N snapshots by --snapshot_best_metric. 0 disables it.')
+flags.DEFINE_string('snapshot_best_metric', '', 'Reported value ranking snapshots for --snapshot_keep_best.')
+flags.DEFINE_enum('snapshot_best_mode', 'min', ['min', 'max'], 'Whether lower or higher metric values are better.')
+flags.DEFINE_integer('discriminator_keep_last', -1,
+                     'Keep only the newest N Discriminator snapshots. -1 applies the --snapshot_keep_* rules.')
+flags.DEFINE_integer('checkpoint_keep_last', 0, 'Keep the newest N trainer checkpoints. 0 keeps all of them.')
+flags.DEFINE_boolean('export_inference', False,
+                     'Also write float16 SmoothedGenerator weights to inference/ at every snapshot.')
+flags.DEFINE_boolean('export_fold_bn', False, 'Fold BatchNormalization into the preceding layers of exported weights.')
+flags.DEFINE_integer('checkpoint_interval', 0,
+                     'Interval of full trainer checkpoints (models, optimizers, iterator, RNG). 0 disables them.')
+flags.DEFINE_string('resume', '', 'Checkpoint to resume from, or `auto` for the latest one in --out if any.')
 flags.DEFINE_integer('evaluation_interval', 10000, 'Interval of heavy evaluation')
+flags.DEFINE_string('evaluation_model_path', '',
+                    'Local weights of the feature network for heavy evaluation. Evaluation is disabled when empty.')
+flags.DEFINE_enum('evaluation_network', 'resnet50', list(evaluation.NETWORKS), 'Feature network for heavy evaluation.')
+flags.DEFINE_integer('evaluation_samples', 5000, 'Number of generated images per heavy evaluation.')
+flags.DEFINE_integer('evaluation_batch_size', 100, 'Batch size of heavy evaluation.')
+flags.DEFINE_boolean('evaluation_process', False, 'Run heavy evaluation in a separate process instead of pausing.')
 flags.DEFINE_integer('evaluation_sample_interval', 500, 'Interval of evaluation sampling')
 flags.DEFINE_integer('display_interval', 100, 'Interval of displaying log to console')
+flags.DEFINE_integer('telemetry_port', 0, 'Serve training gauges on http://127.0.0.1:<port>/metrics. 0 disables it.')
+flags.DEFINE_string('telemetry_file', '', 'Also rewrite the training gauges to this file (Prometheus text format).')
+flags.DEFINE_integer('telemetry_interval', 100, 'Interval in iterations of updating the training gauges.')
+flags.DEFINE_integer('profile_every', 0,
+                     'Every N iterations, profile one update per function type into <out>/profile. 0 disables.')
 
 
-def make_optimizer(model, alpha, beta1, beta2):
+def make_optimizer(model, alpha, beta1, beta2, mixed_precision=False):
     optimizer = chainer.optimizers.Adam(alpha=alpha, beta1=beta1, beta2=beta2)
     optimizer.setup(model)
+    if mixed_precision:
+        # Keep float32 master weights for float16 parameters and scale losses dynamically.
+        optimizer.use_fp32_update()
+        optimizer.loss_scaling()
     return optimizer
 
+
+def make_synthetic_updater(arch, batch_size, device, n_batches=4, mixed_precision=False, **kwargs):
+    """Build a DRAGANUpdater for `arch` on random data, for benchmarking without a dataset."""
+    generator_class, discriminator_class, image_size = get_arch(arch)
+    with chainer.using_config('dtype', chainer.mixed16 if mixed_precision else np.float32):
+        models = [generator_class(), discriminator_class()]
+    models.append(generator_class())
+    device.use()
+    for model in models:
+        model.to_device(device)
+
+    data = np.random.uniform(-1, 1, (batch_size * n_batches, 3, image_size, image_size)).astype(np.float32)
+    train_iter = chainer.iterators.SerialIterator(data, batch_size)
+
+    updater_args = {
+        'iterator': {
+            'main': train_iter
+        },
+        'optimizer': {
+            'gen': make_optimizer(models[0], 0.0001, 0.5, 0.999, mixed_precision),
+            'dis': make_optimizer(models[1], 0.0001, 0.5, 0.999, mixed_precision),
+        },
+        'device': device,
+        'models': models,
+        'lambda_gp': 1.0,
+        'smoothing': 0.999,
+        'learning_rate': 0.0001,
+        'learning_rate_anneal': 0.0,
+        'learning_rate_anneal_trigger': 0,
+        'learning_rate_anneal_interval': 1,
+    }
+    updater_args.update(kwargs)
+    return DRAGANUpdater(**updater_args)
+
+
+def default_memory_budget(device):
+    """Bytes available to training: 90% of free GPU memory, or 80% of available host memory."""
+    if isinstance(device, chainer.backend.GpuDevice):
+        free_bytes, _ = device.device.mem_info
+        return int(free_bytes * 0.9)
+    return int(os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') * 0.8)
+
+
+def probe_batch_size(arch, batch_size, device, steps=2, **kwargs):
+    """Run DRAGAN updates of `arch` at `batch_size` and return (peak bytes, seconds per step).
+
+    The peak covers models, optimizer state and a whole update including the gradient penalty's double backward.
+    It is the CuPy memory pool size on GPU and the tracemalloc peak, which traces NumPy buffers, on CPU.
+    """
+    is_gpu = isinstance(device, chainer.backend.GpuDevice)
+    if is_gpu:
+        import cupy
+        pool = cupy.get_default_memory_pool()
+        pool.free_all_blocks()
+    else:
+        tracemalloc.start()
+
+    try:
+        updater = make_synthetic_updater(arch, batch_size, device, n_batches=1, **kwargs)
+        updater.update()
+        if is_gpu:
+            device.device.synchronize()
+            peak_bytes = pool.total_bytes()
+        else:
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        if not is_gpu:
+            tracemalloc.stop()
+
+    start = time.perf_counter()
+    for _ in range(steps):
+        updater.update()
+    if is_gpu:
+        device.device.synchronize()
+    step_time = (time.perf_counter() - start) / steps
+
+    del updater
+    if is_gpu:
+        pool.free_all_blocks()
+    return peak_bytes, step_time
+
+
+def find_batch_size(arch, memory_budget, device, max_batch_size=4096, **kwargs):
+    """Find the batch sizes of `arch` that fit in `memory_budget` bytes.
+
+    Batch sizes are doubled until one does not fit, then the gap is bisected. Returns a dict with the largest
+    batch size that fits (`largest`), the one with the most images per second (`fastest`) and all `probes`.
+    """
+    probes = {}
+
+    def fits(batch_size):
+        if batch_size not in probes:
+            try:
+                peak_bytes, step_time = probe_batch_size(arch, batch_size, device, **kwargs)
+                probes[batch_size] = {
+                    'batch_size': batch_size,
+                    'peak_bytes': peak_bytes,
+                    'sec_per_step': step_time,
+                    'images_per_sec': batch_size / step_time,
+                }
+            except MemoryError:  # CuPy's OutOfMemoryError is a MemoryError too.
+                probes[batch_size] = {'batch_size': batch_size, 'peak_bytes': None}
+            print('batch size probe:', probes[batch_size])
+        peak_bytes = probes[batch_size]['peak_bytes']
+        return peak_bytes is not None and peak_bytes <= memory_budget
+
+    if not fits(1):
+        raise ValueError('Batch size 1 of %s does not fit in %d bytes' % (arch, memory_budget))
+
+    low, high = 1, None
+    while high is None and low < max_batch_size:
+        batch_size = min(low * 2, max_batch_size)
+        if fits(batch_size):
+            low = batch_size
+        else:
+            high = batch_size
+    # Bisect down to a step of 1, so `largest` is exact.
+    while high is not None and high - low > 1:
+        batch_size = (low + high) // 2
+        if fits(batch_size):
+            low = batch_size
+        else:
+            high = batch_size
+
+    fitting = [probe for probe in probes.values() if probe['peak_bytes'] is not None
+               and probe['peak_bytes'] <= memory_budget]
+    return {
+        'largest': low,
+        'fastest': max(fitting, key=lambda probe: probe['images_per_sec'])['batch_size'],
+        'probes': sorted(probes.values(), key=lambda probe: probe['batch_size']),
+    }
+
+
 def prepareCelebADatasetFromTensorflow(size):
+    # TensorFlow is only needed here, so it is not loaded (or counted in memory use) by training and benchmarks.
+    import tensorflow as tf
+    import tensorflow_datasets as tfds
+
     def resize(_size):
       def parse(batch):
           image = batch["image"]
@@ -868,14 +819,36 @@ def main(argv):
     record_setting(FLAGS.out)
     report_keys = ['epoch', 'iteration', 'elapsed_time']
 
-    device = FLAGS.gpu
+    device = get_device(FLAGS.backend, FLAGS.gpu)
 
     # Set up dataset and its iterator
     X_train = np.load(FLAGS.npz_path)['size_%d' % FLAGS.image_size]
     X_train = (X_train.astype(np.float32) - 127.5) / 127.5
     train_dataset = X_train
 
-    train_iter = chainer.iterators.SerialIterator(train_dataset, FLAGS.batch_size)
+    resume = FLAGS.resume
+    if resume == 'auto':
+        resume = trainer_extensions.find_latest_checkpoint(FLAGS.out)
+
+    if FLAGS.batch_size == 'auto' and resume:
+        # Probing again could pick a different batch size from the current free memory, so the resumed run would not
+        # continue the checkpointed one exactly.
+        with np.load(resume) as checkpoint:
+            if 'updater/batch_size' not in checkpoint:
+                raise ValueError('%s does not record its batch size; pass --batch_size to resume it' % resume)
+            batch_size = int(checkpoint['updater/batch_size'])
+        print('batch size {} from {}'.format(batch_size, resume))
+    elif FLAGS.batch_size == 'auto':
+        memory_budget = FLAGS.memory_budget_mb * 2**20 or default_memory_budget(device)
+        found = find_batch_size(FLAGS.arch, memory_budget, device, mixed_precision=FLAGS.mixed_precision,
+                                lambda_gp=FLAGS.lambda_gp)
+        batch_size = found['largest']
+        print('largest batch size within {} MB: {} (best throughput at {})'.format(
+            memory_budget // 2**20, batch_size, found['fastest']))
+    else:
+        batch_size = int(FLAGS.batch_size)
+
+    train_iter = chainer.iterators.SerialIterator(train_dataset, batch_size)
 
     # Setup algorithm specific networks and updaters
     models = []
@@ -891,50 +864,42 @@ def main(argv):
         'learning_rate_anneal': FLAGS.learning_rate_anneal,
         'learning_rate_anneal_trigger': FLAGS.learning_rate_anneal_trigger,
         'learning_rate_anneal_interval': FLAGS.learning_rate_anneal_interval,
+        'profile_every': FLAGS.profile_every,
+        'profile_out': FLAGS.out,
     }
 
     Updater = DRAGANUpdater
 
-    if FLAGS.arch == 'dcgan64':
-        generator_class = DCGANGenerator64
-        discriminator_class = DCGANDiscriminator64
-        assert FLAGS.image_size == 64
-    elif FLAGS.arch == 'dcgan128':
-        generator_class = DCGANGenerator128
-        discriminator_class = DCGANDiscriminator128
-        assert FLAGS.image_size == 128
-    elif FLAGS.arch == 'dcgan256':
-        generator_class = DCGANGenerator256
-        discriminator_class = DCGANDiscriminator256
-        assert FLAGS.image_size == 256
-    elif FLAGS.arch == 'resnet128':
-        generator_class = ResNetGenerator128
-        discriminator_class = ResNetDiscriminator128
-        assert FLAGS.image_size == 128
-    elif FLAGS.arch == 'resnet256':
-        generator_class = ResNetGenerator256
-        discriminator_class = ResNetDiscriminator256
-        assert FLAGS.image_size == 256
-    else:
-        raise ValueError('Unknown -arch %s' % FLAGS.arch)
+    generator_class, discriminator_class, image_size = get_arch(FLAGS.arch)
+    assert FLAGS.image_size == image_size
+
+    if FLAGS.static_graph:
+        generator_class = make_static(generator_class)
+        if FLAGS.lambda_gp == 0:
+            discriminator_class = make_static(discriminator_class)
 
-    generator = generator_class()
-    discriminator = discriminator_class()
-    smoothed_generator = generator_class()
+    with chainer.using_config('dtype', chainer.mixed16 if FLAGS.mixed_precision else np.float32):
+        generator = generator_class()
+        discriminator = discriminator_class()
+    # The smoothed generator is an EMA of tiny updates, so it always stays in float32.
+    smoothed_generator = get_arch(FLAGS.arch)[0]()
     models = [generator, discriminator, smoothed_generator]
     model_names = ['Generator', 'Discriminator', 'SmoothedGenerator']
     report_keys.extend(["gen/loss_adv", "dis/loss_adv", 'dis/loss_gp'])
+    report_keys.extend(['time/data', 'time/gen', 'time/ema', 'time/gen2', 'time/dis', 'time/gp', 'time/dis_backward',
+                        'time/total'])
     updater_args['lambda_gp'] = FLAGS.lambda_gp
 
-    if device > -1:
-        chainer.cuda.get_device_from_id(device).use()
-        print("use gpu {}".format(device))
-        for model in models:
-            model.to_gpu()
+    device.use()
+    print("use device {}".format(device))
+    for model in models:
+        model.to_device(device)
 
     # Set up optimizers
-    opts["gen"] = make_optimizer(generator, FLAGS.adam_alpha, FLAGS.adam_beta1, FLAGS.adam_beta2)
-    opts["dis"] = make_optimizer(discriminator, FLAGS.adam_alpha, FLAGS.adam_beta1, FLAGS.adam_beta2)
+    opts["gen"] = make_optimizer(generator, FLAGS.adam_alpha, FLAGS.adam_beta1, FLAGS.adam_beta2,
+                                 FLAGS.mixed_precision)
+    opts["dis"] = make_optimizer(discriminator, FLAGS.adam_alpha, FLAGS.adam_beta1, FLAGS.adam_beta2,
+                                 FLAGS.mixed_precision)
 
     updater_args["optimizer"] = opts
     updater_args["models"] = models
@@ -944,22 +909,99 @@ def main(argv):
     trainer = training.Trainer(updater, (FLAGS.max_iter, 'iteration'), out=FLAGS.out)
 
     # Set up extensions
+    snapshot_writer = None
+    snapshot_rules = {}
+    if FLAGS.snapshot_keep_last or FLAGS.snapshot_keep_every or FLAGS.snapshot_keep_best:
+        snapshot_rules = dict(
+            keep_last=FLAGS.snapshot_keep_last,
+            keep_every=FLAGS.snapshot_keep_every,
+            keep_best=FLAGS.snapshot_keep_best,
+            metric=FLAGS.snapshot_best_metric,
+            minimize=FLAGS.snapshot_best_mode == 'min')
+    if FLAGS.snapshot_max_outstanding > 0:
+        snapshot_writer = trainer_extensions.AsyncWriter(FLAGS.snapshot_max_outstanding)
     for model, model_name in zip(models, model_names):
+        if FLAGS.snapshot_max_outstanding > 0:
+            snapshot = trainer_extensions.AsyncSnapshot(model, model_name + '_{.updater.iteration}.npz',
+                                                        snapshot_writer)
+        else:
+            snapshot = extensions.snapshot_object(model, model_name + '_{.updater.iteration}.npz')
+        trainer.extend(snapshot, name='snapshot_' + model_name, trigger=(FLAGS.snapshot_interval, 'iteration'))
+
+        # Retention is registered only when a rule is set, so it has no effect on runs and checkpoints without one.
+        if model_name == 'Discriminator' and FLAGS.discriminator_keep_last >= 0:
+            retention = trainer_extensions.SnapshotRetention(model_name + '_', keep_last=FLAGS.discriminator_keep_last)
+        elif snapshot_rules:
+            retention = trainer_extensions.SnapshotRetention(model_name + '_', **snapshot_rules)
+        else:
+            continue
+        trainer.extend(retention, name='retention_' + model_name, trigger=(FLAGS.snapshot_interval, 'iteration'))
+    if FLAGS.export_inference:
         trainer.extend(
-            extensions.snapshot_object(model, model_name + '_{.updater.iteration}.npz'),
+            trainer_extensions.AsyncSnapshot(
+                smoothed_generator,
+                os.path.join('inference', 'SmoothedGenerator_{.updater.iteration}.npz'),
+                snapshot_writer,
+                transform=functools.partial(model_export.inference_arrays, fold_bn=FLAGS.export_fold_bn)),
+            name='export_inference',
             trigger=(FLAGS.snapshot_interval, 'iteration'))
+        if snapshot_rules:
+            trainer.extend(
+                trainer_extensions.SnapshotRetention('SmoothedGenerator_', subdir='inference', **snapshot_rules),
+                name='retention_inference',
+                trigger=(FLAGS.snapshot_interval, 'iteration'))
+    if FLAGS.checkpoint_interval > 0:
+        # Runs after every other extension so the saved log and triggers are up to date.
+        if FLAGS.snapshot_max_outstanding > 0:
+            checkpoint = trainer_extensions.AsyncSnapshot(trainer, 'checkpoint_{.updater.iteration}.npz',
+                                                          snapshot_writer)
+        else:
+            checkpoint = extensions.snapshot(filename='checkpoint_{.updater.iteration}.npz')
+        trainer.extend(checkpoint, name='checkpoint', trigger=(FLAGS.checkpoint_interval, 'iteration'), priority=-100)
+        if FLAGS.checkpoint_keep_last:
+            trainer.extend(
+                trainer_extensions.SnapshotRetention('checkpoint_', keep_last=FLAGS.checkpoint_keep_last),
+                name='retention_checkpoint',
+                trigger=(FLAGS.checkpoint_interval, 'iteration'))
     trainer.extend(extensions.ProgressBar(update_interval=10))
     trainer.extend(
-        sample_generate_light(generator, FLAGS.out),
+        AsyncPreview(generator, FLAGS.out),
+        name='preview',
         trigger=(FLAGS.evaluation_sample_interval, 'iteration'),
         priority=extension.PRIORITY_WRITER)
     trainer.extend(
-        sample_generate_light(smoothed_generator, FLAGS.out, rows=4, cols=4, subdir='preview_smoothed'),
+        AsyncPreview(smoothed_generator, FLAGS.out, rows=4, cols=4, subdir='preview_smoothed'),
+        name='preview_smoothed',
         trigger=(FLAGS.evaluation_sample_interval, 'iteration'),
         priority=extension.PRIORITY_WRITER)
-    trainer.extend(extensions.LogReport(keys=report_keys, trigger=(FLAGS.display_interval * 5, 'iteration')))
+    if FLAGS.evaluation_model_path and FLAGS.evaluation_interval > 0:
+        trainer.extend(
+            evaluation.FrechetEvaluation(
+                smoothed_generator,
+                FLAGS.evaluation_network,
+                FLAGS.evaluation_model_path,
+                FLAGS.npz_path,
+                'size_%d' % FLAGS.image_size,
+                trigger=(FLAGS.evaluation_interval, 'iteration'),
+                n_samples=FLAGS.evaluation_samples,
+                batch_size=FLAGS.evaluation_batch_size,
+                separate_process=FLAGS.evaluation_process),
+            name='evaluation')
+        report_keys.extend(['evaluation/frechet_distance', 'evaluation/iteration'])
+    if FLAGS.telemetry_port or FLAGS.telemetry_file:
+        trainer.extend(
+            trainer_extensions.Telemetry(['gen/loss_adv', 'dis/loss_adv', 'dis/loss_gp'], FLAGS.telemetry_interval,
+                                         FLAGS.telemetry_port, FLAGS.telemetry_file or None),
+            name='telemetry')
+    trainer.extend(
+        trainer_extensions.JsonLinesLogReport(keys=report_keys, trigger=(FLAGS.display_interval * 5, 'iteration')),
+        name='LogReport')
     trainer.extend(extensions.PrintReport(report_keys), trigger=(FLAGS.display_interval, 'iteration'))
 
+    if resume:
+        print('resume from {}'.format(resume))
+        chainer.serializers.load_npz(resume, trainer)
+
     # Run the training
     trainer.run()
 
@@ -0,0 +1,597 @@
+'''
+Chainer generator and discriminator models, and the `--arch` names of chainer_dcgan.py.
+
+This module defines no flags, so exporters and tools can import the models without chainer_dcgan's training setup.
+'''
+import chainer
+import chainer.functions as F
+import chainer.links as L
+import numpy as np
+
+import model_export
+
+
+class DCGANGenerator64(chainer.Chain):
+    def __init__(self,
+                 n_hidden=128,
+                 bottom_width=4,
+                 ch=512,
+                 wscale=0.02,
+                 z_distribution="normal",
+                 hidden_activation=F.relu,
+                 output_activation=F.tanh,
+                 use_bn=True):
+        super().__init__()
+        self.n_hidden = n_hidden
+        self.ch = ch
+        self.bottom_width = bottom_width
+        self.z_distribution = z_distribution
+        self.hidden_activation = hidden_activation
+        self.output_activation = output_activation
+        self.use_bn = use_bn
+
+        with self.init_scope():
+            w = chainer.initializers.Normal(wscale)
+            self.l0 = L.Linear(self.n_hidden, bottom_width * bottom_width * ch, initialW=w)
+            self.dc1 = L.Deconvolution2D(ch, ch // 2, 4, 2, 1, initialW=w)
+            self.dc2 = L.Deconvolution2D(ch // 2, ch // 4, 4, 2, 1, initialW=w)
+            self.dc3 = L.Deconvolution2D(ch // 4, ch // 8, 4, 2, 1, initialW=w)
+            self.dc4 = L.Deconvolution2D(ch // 8, 3, 4, 2, 1, initialW=w)
+            if self.use_bn:
+                self.bn0 = L.BatchNormalization(bottom_width * bottom_width * ch)
+                self.bn1 = L.BatchNormalization(ch // 2)
+                self.bn2 = L.BatchNormalization(ch // 4)
+                self.bn3 = L.BatchNormalization(ch // 8)
+
+    def make_hidden(self, batchsize):
+        if self.z_distribution == "normal":
+            return np.random.randn(batchsize, self.n_hidden, 1, 1) \
+                .astype(np.float32)
+        elif self.z_distribution == "uniform":
+            return np.random.uniform(-1, 1, (batchsize, self.n_hidden, 1, 1)) \
+                .astype(np.float32)
+        else:
+            raise Exception("unknown z distribution: %s" % self.z_distribution)
+
+    def __call__(self, z):
+        if not self.use_bn:
+            h = F.reshape(self.hidden_activation(self.l0(z)), (len(z), self.ch, self.bottom_width, self.bottom_width))
+            h = self.hidden_activation(self.dc1(h))
+            h = self.hidden_activation(self.dc2(h))
+            h = self.hidden_activation(self.dc3(h))
+            x = self.output_activation(self.dc4(h))
+        else:
+            h = F.reshape(
+                self.hidden_activation(self.bn0(self.l0(z))), (len(z), self.ch, self.bottom_width, self.bottom_width))
+            h = self.hidden_activation(self.bn1(self.dc1(h)))
+            h = self.hidden_activation(self.bn2(self.dc2(h)))
+            h = self.hidden_activation(self.bn3(self.dc3(h)))
+            x = self.output_activation(self.dc4(h))
+        return x
+
+
+class DCGANDiscriminator64(chainer.Chain):
+    def __init__(self, bottom_width=4, ch=512, wscale=0.02, output_dim=1):
+        w = chainer.initializers.Normal(wscale)
+        super().__init__()
+        with self.init_scope():
+            self.c0_0 = L.Convolution2D(3, ch // 8, 4, 2, 1, initialW=w)
+            self.c0_1 = L.Convolution2D(ch // 8, ch // 4, 4, 2, 1, initialW=w)
+            self.c1_0 = L.Convolution2D(ch // 4, ch // 4, 3, 1, 1, initialW=w)
+            self.c1_1 = L.Convolution2D(ch // 4, ch // 2, 4, 2, 1, initialW=w)
+            self.c2_0 = L.Convolution2D(ch // 2, ch // 2, 3, 1, 1, initialW=w)
+            self.c2_1 = L.Convolution2D(ch // 2, ch // 1, 4, 2, 1, initialW=w)
+            self.c3_0 = L.Convolution2D(ch // 1, ch // 1, 3, 1, 1, initialW=w)
+            self.l4 = L.Linear(bottom_width * bottom_width * ch, output_dim, initialW=w)
+            self.bn0_1 = L.BatchNormalization(ch // 4, use_gamma=False)
+            self.bn1_0 = L.BatchNormalization(ch // 4, use_gamma=False)
+            self.bn1_1 = L.BatchNormalization(ch // 2, use_gamma=False)
+            self.bn2_0 = L.BatchNormalization(ch // 2, use_gamma=False)
+            self.bn2_1 = L.BatchNormalization(ch // 1, use_gamma=False)
+            self.bn3_0 = L.BatchNormalization(ch // 1, use_gamma=False)
+
+    def __call__(self, x):
+        h = F.leaky_relu(self.c0_0(x))
+        h = F.leaky_relu(self.bn0_1(self.c0_1(h)))
+        h = F.leaky_relu(self.bn1_0(self.c1_0(h)))
+        h = F.leaky_relu(self.bn1_1(self.c1_1(h)))
+        h = F.leaky_relu(self.bn2_0(self.c2_0(h)))
+        h = F.leaky_relu(self.bn2_1(self.c2_1(h)))
+        h = F.leaky_relu(self.bn3_0(self.c3_0(h)))
+        return self.l4(h)
+
+# ******* GAN 128 x 128 ************************************************ #
+
+class DCGANGenerator128(chainer.Chain):
+    def __init__(self,
+                 n_hidden=128,
+                 bottom_width=4,
+                 ch=1024,
+                 wscale=0.02,
+                 z_distribution="normal",
+                 hidden_activation=F.relu,
+                 output_activation=F.tanh,
+                 use_bn=True):
+        super().__init__()
+        self.n_hidden = n_hidden
+        self.ch = ch
+        self.bottom_width = bottom_width
+        self.z_distribution = z_distribution
+        self.hidden_activation = hidden_activation
+        self.output_activation = output_activation
+        self.use_bn = use_bn
+
+        with self.init_scope():
+            w = chainer.initializers.Normal(wscale)
+            self.l0 = L.Linear(self.n_hidden, bottom_width * bottom_width * ch, initialW=w) # out: (b, 16384, 1)
+                                                                                            # reshape: (128, 1024, 4, 4)
+            self.dc1 = L.Deconvolution2D(ch, ch // 2, 4, 2, 1, initialW=w)       # (b, 512, 8, 8)
+            self.dc2 = L.Deconvolution2D(ch // 2, ch // 4, 4, 2, 1, initialW=w)  # (b, 256, 16, 16)
+            self.dc3 = L.Deconvolution2D(ch // 4, ch // 8, 4, 2, 1, initialW=w)  # (b, 128, 32, 32)
+            self.dc4 = L.Deconvolution2D(ch // 8, ch // 16, 4, 2, 1, initialW=w) # (b, 64, 64, 64)
+            self.dc5 = L.Deconvolution2D(ch // 16, 3, 4, 2, 1, initialW=w)       # (b, 3, 128, 128)
+            if self.use_bn:
+                self.bn0 = L.BatchNormalization(bottom_width * bottom_width * ch)
+                self.bn1 = L.BatchNormalization(ch // 2)
+                self.bn2 = L.BatchNormalization(ch // 4)
+                self.bn3 = L.BatchNormalization(ch // 8)
+                self.bn4 = L.BatchNormalization(ch // 16)
+
+    def make_hidden(self, batchsize):
+        if self.z_distribution == "normal":
+            return np.random.randn(batchsize, self.n_hidden, 1, 1) \
+                .astype(np.float32)
+        elif self.z_distribution == "uniform":
+            return np.random.uniform(-1, 1, (batchsize, self.n_hidden, 1, 1)) \
+                .astype(np.float32)
+        else:
+            raise Exception("unknown z distribution: %s" % self.z_distribution)
+
+    def __call__(self, z):
+        if not self.use_bn:
+            h = F.reshape(self.hidden_activation(self.l0(z)), (len(z), self.ch, self.bottom_width, self.bottom_width))
+            h = self.hidden_activation(self.dc1(h))
+            h = self.hidden_activation(self.dc2(h))
+            h = self.hidden_activation(self.dc3(h))
+            h = self.hidden_activation(self.dc4(h))
+            x = self.output_activation(self.dc5(h))
+        else:
+            h = F.reshape(
+                self.hidden_activation(self.bn0(self.l0(z))), (len(z), self.ch, self.bottom_width, self.bottom_width))
+            h = self.hidden_activation(self.bn1(self.dc1(h)))
+            h = self.hidden_activation(self.bn2(self.dc2(h)))
+            h = self.hidden_activation(self.bn3(self.dc3(h)))
+            h = self.hidden_activation(self.bn4(self.dc4(h)))
+            x = self.output_activation(self.dc5(h))
+        return x
+
+#(in_channels, out_channels, ksize=None, stride=1, pad=0, nobias=False, initialW=None, initial_bias=None, *, dilate=1, groups=1)
+
+class DCGANDiscriminator128(chainer.Chain):
+    def __init__(self, bottom_width=2, ch=1024, wscale=0.02, output_dim=1):
+        w = chainer.initializers.Normal(wscale)
+        super().__init__()
+        with self.init_scope():                                                 # out: (b,    c,  w,  h)
+            self.c0_0 = L.Convolution2D(3, ch // 16, 4, 2, 1, initialW=w)       # out: (b,   64, 64, 64)
+            self.c0_1 = L.Convolution2D(ch // 16, ch // 8, 4, 2, 1, initialW=w) # out: (b,   64, 32, 32)
+            self.c1_0 = L.Convolution2D(ch // 8, ch // 8, 3, 2, 1, initialW=w)  # out: (b,  128, 16, 16)
+            self.c1_1 = L.Convolution2D(ch // 8, ch // 4, 4, 2, 1, initialW=w)  # out: (b,  256,  8,  8)
+            self.c2_0 = L.Convolution2D(ch // 4, ch // 4, 3, 1, 1, initialW=w)  # out: (b,  256,  4,  4)
+            self.c2_1 = L.Convolution2D(ch // 4, ch // 2, 4, 2, 1, initialW=w)  # out: (b,  512,  2,  2)
+            self.c3_0 = L.Convolution2D(ch // 2, ch // 2, 3, 1, 1, initialW=w)  # out: (b,  512,  2,  2)
+            self.c3_1 = L.Convolution2D(ch // 2, ch // 1, 4, 2, 1, initialW=w)  # out: (b, 1024,  1,  1)
+            self.c4_0 = L.Convolution2D(ch // 1, ch // 1, 3, 1, 1, initialW=w)  # out: (b, 1024,  1,  1)
+
+            self.l4 = L.Linear(bottom_width * bottom_width * ch, output_dim, initialW=w) # in: (4096) out: (b, 1)
+
+            self.bn0_1 = L.BatchNormalization(ch // 8, use_gamma=False)
+            self.bn1_0 = L.BatchNormalization(ch // 8, use_gamma=False)
+            self.bn1_1 = L.BatchNormalization(ch // 4, use_gamma=False)
+            self.bn2_0 = L.BatchNormalization(ch // 4, use_gamma=False)
+            self.bn2_1 = L.BatchNormalization(ch // 2, use_gamma=False)
+            self.bn3_0 = L.BatchNormalization(ch // 2, use_gamma=False)
+            self.bn3_1 = L.BatchNormalization(ch // 1, use_gamma=False)
+            self.bn4_0 = L.BatchNormalization(ch // 1, use_gamma=False)
+
+    def __call__(self, x):
+        h = F.leaky_relu(self.c0_0(x))
+        h = F.leaky_relu(self.bn0_1(self.c0_1(h)))
+        h = F.leaky_relu(self.bn1_0(self.c1_0(h)))
+        h = F.leaky_relu(self.bn1_1(self.c1_1(h)))
+        h = F.leaky_relu(self.bn2_0(self.c2_0(h)))
+        h = F.leaky_relu(self.bn2_1(self.c2_1(h)))
+        h = F.leaky_relu(self.bn3_0(self.c3_0(h)))
+        h = F.leaky_relu(self.bn3_1(self.c3_1(h)))
+        h = F.leaky_relu(self.bn4_0(self.c4_0(h)))
+        return self.l4(h)
+
+# ******* GAN 256 x 256 ************************************************ #
+
+class DCGANGenerator256(chainer.Chain):
+    def __init__(self,
+                 n_hidden=128,
+                 bottom_width=4,
+                 ch=1024,
+                 wscale=0.02,
+                 z_distribution="normal",
+                 hidden_activation=F.relu,
+                 output_activation=F.tanh,
+                 use_bn=True):
+        super().__init__()
+        self.n_hidden = n_hidden
+        self.ch = ch
+        self.bottom_width = bottom_width
+        self.z_distribution = z_distribution
+        self.hidden_activation = hidden_activation
+        self.output_activation = output_activation
+        self.use_bn = use_bn
+
+        with self.init_scope():
+            w = chainer.initializers.Normal(wscale)
+            self.l0 = L.Linear(self.n_hidden, bottom_width * bottom_width * ch, initialW=w) # out: (b, 16384, 1)
+                                                                                            # reshape: (128, 1024, 4, 4)
+            self.dc1 = L.Deconvolution2D(ch, ch // 2, 4, 2, 1, initialW=w)       # (b, 512, 8, 8)
+            self.dc2 = L.Deconvolution2D(ch // 2, ch // 4, 4, 2, 1, initialW=w)  # (b, 256, 16, 16)
+            self.dc3 = L.Deconvolution2D(ch // 4, ch // 8, 4, 2, 1, initialW=w)  # (b, 128, 32, 32)
+            self.dc4 = L.Deconvolution2D(ch // 8, ch // 8, 4, 2, 1, initialW=w) # (b, 64, 64, 64)
+            self.dc5 = L.Deconvolution2D(ch // 8, ch // 16, 4, 2, 1, initialW=w)       # (b, 64, 128, 128)
+            self.dc6 = L.Deconvolution2D(ch // 16, 3, 4, 2, 1, initialW=w)       # (b, 3, 256, 256)
+            if self.use_bn:
+                self.bn0 = L.BatchNormalization(bottom_width * bottom_width * ch)
+                self.bn1 = L.BatchNormalization(ch // 2)
+                self.bn2 = L.BatchNormalization(ch // 4)
+                self.bn3 = L.BatchNormalization(ch // 8)
+                self.bn4 = L.BatchNormalization(ch // 8)
+                self.bn5 = L.BatchNormalization(ch // 16)
+
+    def make_hidden(self, batchsize):
+        if self.z_distribution == "normal":
+            return np.random.randn(batchsize, self.n_hidden, 1, 1) \
+                .astype(np.float32)
+        elif self.z_distribution == "uniform":
+            return np.random.uniform(-1, 1, (batchsize, self.n_hidden, 1, 1)) \
+                .astype(np.float32)
+        else:
+            raise Exception("unknown z distribution: %s" % self.z_distribution)
+
+    def __call__(self, z):
+        if not self.use_bn:
+            h = F.reshape(self.hidden_activation(self.l0(z)), (len(z), self.ch, self.bottom_width, self.bottom_width))
+            h = self.hidden_activation(self.dc1(h))
+            h = self.hidden_activation(self.dc2(h))
+            h = self.hidden_activation(self.dc3(h))
+            h = self.hidden_activation(self.dc4(h))
+            h = self.hidden_activation(self.dc5(h))
+            x = self.output_activation(self.dc6(h))
+        else:
+            h = F.reshape(
+                self.hidden_activation(self.bn0(self.l0(z))), (len(z), self.ch, self.bottom_width, self.bottom_width))
+            h = self.hidden_activation(self.bn1(self.dc1(h)))
+            h = self.hidden_activation(self.bn2(self.dc2(h)))
+            h = self.hidden_activation(self.bn3(self.dc3(h)))
+            h = self.hidden_activation(self.bn4(self.dc4(h)))
+            h = self.hidden_activation(self.bn5(self.dc5(h)))
+            x = self.output_activation(self.dc6(h))
+        return x
+
+class DCGANDiscriminator256(chainer.Chain):
+    def __init__(self, bottom_width=2, ch=1024, wscale=0.02, output_dim=1):
+        w = chainer.initializers.Normal(wscale)
+        super().__init__()
+        with self.init_scope():                                                 # out: (b,    c,  w,  h)
+            self.c0_0 = L.Convolution2D(3, ch // 16, 4, 2, 1, initialW=w)       # out: (b,   64, 64, 64)
+            self.c0_1 = L.Convolution2D(ch // 16, ch // 8, 4, 2, 1, initialW=w) # out: (b,   64, 32, 32)
+            self.c1_0 = L.Convolution2D(ch // 8, ch // 8, 3, 2, 1, initialW=w)  # out: (b,  128, 16, 16)
+            self.c1_1 = L.Convolution2D(ch // 8, ch // 4, 4, 2, 1, initialW=w)  # out: (b,  256,  8,  8)
+
+            self.c2_0 = L.Convolution2D(ch // 8, ch // 8, 3, 2, 1, initialW=w)  # out: (b,  128, 16, 16)
+            self.c2_1 = L.Convolution2D(ch // 8, ch // 4, 4, 2, 1, initialW=w)  # out: (b,  256,  8,  8)
+
+            self.c3_0 = L.Convolution2D(ch // 4, ch // 4, 3, 1, 1, initialW=w)  # out: (b,  256,  4,  4)
+            self.c3_1 = L.Convolution2D(ch // 4, ch // 2, 4, 2, 1, initialW=w)  # out: (b,  512,  2,  2)
+            self.c4_0 = L.Convolution2D(ch // 2, ch // 2, 3, 1, 1, initialW=w)  # out: (b,  512,  2,  2)
+            self.c4_1 = L.Convolution2D(ch // 2, ch // 1, 4, 2, 1, initialW=w)  # out: (b, 1024,  1,  1)
+            self.c5_0 = L.Convolution2D(ch // 1, ch // 1, 3, 1, 1, initialW=w)  # out: (b, 1024,  1,  1)
+
+            self.l4 = L.Linear(bottom_width * bottom_width * ch, output_dim, initialW=w) # in: (4096) out: (b, 1)
+
+            self.bn0_1 = L.BatchNormalization(ch // 8, use_gamma=False)
+            self.bn1_0 = L.BatchNormalization(ch // 8, use_gamma=False)
+            self.bn1_1 = L.BatchNormalization(ch // 4, use_gamma=False)
+            self.bn2_0 = L.BatchNormalization(ch // 4, use_gamma=False)
+
+            self.bn2_1 = L.BatchNormalization(ch // 4, use_gamma=False)
+            self.bn3_0 = L.BatchNormalization(ch // 4, use_gamma=False)
+
+            self.bn3_1 = L.BatchNormalization(ch // 2, use_gamma=False)
+            self.bn4_0 = L.BatchNormalization(ch // 2, use_gamma=False)
+            self.bn4_1 = L.BatchNormalization(ch // 1, use_gamma=False)
+            self.bn5_0 = L.BatchNormalization(ch // 1, use_gamma=False)
+
+    def __call__(self, x):
+        h = F.leaky_relu(self.c0_0(x))
+        h = F.leaky_relu(self.bn0_1(self.c0_1(h)))
+        h = F.leaky_relu(self.bn1_0(self.c1_0(h)))
+        h = F.leaky_relu(self.bn1_1(self.c1_1(h)))
+        h = F.leaky_relu(self.bn2_0(self.c2_0(h)))
+
+        h = F.leaky_relu(self.bn2_1(self.c2_1(h)))
+        h = F.leaky_relu(self.bn3_0(self.c3_0(h)))
+
+        h = F.leaky_relu(self.bn3_1(self.c3_1(h)))
+        h = F.leaky_relu(self.bn4_0(self.c4_0(h)))
+        h = F.leaky_relu(self.bn4_1(self.c4_1(h)))
+        h = F.leaky_relu(self.bn5_0(self.c5_0(h)))
+        return self.l4(h)
+
+
+# *********** END 256x256 MODEL ****************
+
+
+class ResNetResBlockUp(chainer.Chain):
+    def __init__(self, in_ch, out_ch=None, wscale=0.02, folded_bn=False):
+        super().__init__()
+        out_ch = out_ch or in_ch
+        # With `folded_bn`, bn1 has been folded into c0 by `model_export.fold_batch_normalization` and is omitted.
+        self.folded_bn = folded_bn
+        with self.init_scope():
+            w = chainer.initializers.Normal(wscale)
+            self.c0 = L.Convolution2D(in_ch, out_ch, 3, 1, 1, initialW=w)
+            self.c1 = L.Convolution2D(out_ch, out_ch, 3, 1, 1, initialW=w)
+            self.cs = L.Convolution2D(in_ch, out_ch, 3, 1, 1, initialW=w)
+            self.bn0 = L.BatchNormalization(in_ch)
+            if not folded_bn:
+                self.bn1 = L.BatchNormalization(out_ch)
+
+    def __call__(self, x):
+        h = self.c0(F.unpooling_2d(F.relu(self.bn0(x)), 2, 2, 0, cover_all=False))
+        h = self.c1(F.relu(h if self.folded_bn else self.bn1(h)))
+        hs = self.cs(F.unpooling_2d(x, 2, 2, 0, cover_all=False))
+        return h + hs
+
+
+class ResNetResBlockDown(chainer.Chain):
+    def __init__(self, in_ch, out_ch=None, wscale=0.02):
+        super().__init__()
+        out_ch = out_ch or in_ch
+        self.in_ch = in_ch
+        self.out_ch = out_ch
+
+        with self.init_scope():
+            w = chainer.initializers.Normal(wscale)
+            self.c0 = L.Convolution2D(in_ch, out_ch, 3, 1, 1, initialW=w)
+            self.c1 = L.Convolution2D(out_ch, out_ch, 4, 2, 1, initialW=w)
+            self.cs = L.Convolution2D(in_ch, out_ch, 4, 2, 1, initialW=w)
+            self.bn0 = L.BatchNormalization(in_ch)
+            self.bn1 = L.BatchNormalization(out_ch)
+
+    def __call__(self, x):
+        self.h0 = x
+        self.h1 = self.c0(F.relu(self.h0))
+        self.h2 = self.c1(F.relu(self.h1))
+        self.h3 = self.cs(self.h0)
+        self.h4 = self.h2 + self.h3
+        return self.h4
+
+
+class LinkRelu(chainer.Chain):
+    def __init__(self):
+        super().__init__()
+
+    def __call__(self, x):
+        return F.relu(x)
+
+
+class LinkTanh(chainer.Chain):
+    def __init__(self):
+        super().__init__()
+
+    def __call__(self, x):
+        return F.tanh(x)
+
+
+class ResNetInputDense(chainer.Chain):
+    def __init__(self, n_hidden, bottom_width, ch, wscale=0.02):
+        super().__init__()
+        self.n_hidden = n_hidden
+        self.ch = ch
+        self.bottom_width = bottom_width
+        with self.init_scope():
+            w = chainer.initializers.Normal(wscale)
+            self.l = L.Linear(self.n_hidden, bottom_width * bottom_width * ch, initialW=w)
+
+    def __call__(self, z):
+        return F.reshape(self.l(z), (len(z), self.ch, self.bottom_width, self.bottom_width))
+
+
+class ResNetOutputDense(chainer.Chain):
+    def __init__(self, bottom_width, ch, n_output, wscale=0.02):
+        super().__init__()
+        self.ch = ch
+        self.bottom_width = bottom_width
+        self.n_output = n_output
+        with self.init_scope():
+            w = chainer.initializers.Normal(wscale)
+            self.l = L.Linear(bottom_width * bottom_width * ch, self.n_output, initialW=w)
+
+    def __call__(self, z):
+        z = F.reshape(z, (len(z), self.ch * self.bottom_width * self.bottom_width))
+        return self.l(z)
+
+
+class ResNetGenerator128(chainer.Chain):
+    def __init__(self, n_hidden=128, bottom_width=4, ch=1024, wscale=0.02, z_distribution="normal", folded_bn=False):
+        super().__init__()
+        self.n_hidden = n_hidden
+        self.ch = ch
+        self.bottom_width = bottom_width
+        self.z_distribution = z_distribution
+
+        with self.init_scope():
+            w = chainer.initializers.Normal(wscale)
+            self.dense = ResNetInputDense(n_hidden, bottom_width, ch)
+            self.resblockups = chainer.ChainList(
+                ResNetResBlockUp(ch, ch, folded_bn=folded_bn),
+                ResNetResBlockUp(ch, ch // 2, folded_bn=folded_bn),
+                ResNetResBlockUp(ch // 2, ch // 4, folded_bn=folded_bn),
+                ResNetResBlockUp(ch // 4, ch // 8, folded_bn=folded_bn),
+                ResNetResBlockUp(ch // 8, ch // 16, folded_bn=folded_bn),
+            )
+            self.finals = chainer.ChainList(
+                L.BatchNormalization(ch // 16),
+                LinkRelu(),
+                L.Convolution2D(ch // 16, 3, 3, 1, 1, initialW=w),
+                LinkTanh(),
+            )
+
+    def make_hidden(self, batchsize):
+        if self.z_distribution == "normal":
+            return np.random.randn(batchsize, self.n_hidden, 1, 1) \
+                .astype(np.float32)
+        elif self.z_distribution == "uniform":
+            return np.random.uniform(-1, 1, (batchsize, self.n_hidden, 1, 1)) \
+                .astype(np.float32)
+        else:
+            raise Exception("unknown z distribution: %s" % self.z_distribution)
+
+    def __call__(self, x):
+        h = x
+        h = self.dense(h)
+        for _layers in self.resblockups:
+            h = _layers(h)
+        for _layer in self.finals:
+            h = _layer(h)
+        return h
+
+
+class ResNetDiscriminator128(chainer.Chain):
+    def __init__(self, bottom_width=4, ch=1024, wscale=0.02, output_dim=1):
+        super().__init__()
+        self.bottom_width = bottom_width
+        self.ch = ch
+        self.wscale = wscale
+        self.output_dim = output_dim
+
+        with self.init_scope():
+            self.resblockdowns = chainer.ChainList(
+                ResNetResBlockDown(3, ch // 16),
+                ResNetResBlockDown(ch // 16, ch // 8),
+                ResNetResBlockDown(ch // 8, ch // 4),
+                ResNetResBlockDown(ch // 4, ch // 2),
+                ResNetResBlockDown(ch // 2, ch),
+            )
+            self.finals = chainer.ChainList(LinkRelu(), ResNetOutputDense(bottom_width, ch, output_dim))
+
+    def __call__(self, x):
+        h = x
+        for _layers in self.resblockdowns:
+            h = _layers(h)
+        for _layer in self.finals:
+            h = _layer(h)
+        return h
+
+
+class ResNetGenerator256(chainer.Chain):
+    def __init__(self, n_hidden=128, bottom_width=4, ch=1024, wscale=0.02, z_distribution="normal", folded_bn=False):
+        super().__init__()
+        self.n_hidden = n_hidden
+        self.ch = ch
+        self.bottom_width = bottom_width
+        self.z_distribution = z_distribution
+
+        with self.init_scope():
+            w = chainer.initializers.Normal(wscale)
+            self.dense = ResNetInputDense(n_hidden, bottom_width, ch)
+            self.resblockups = chainer.ChainList(
+                ResNetResBlockUp(ch, ch, folded_bn=folded_bn),
+                ResNetResBlockUp(ch, ch // 2, folded_bn=folded_bn),
+                ResNetResBlockUp(ch // 2, ch // 4, folded_bn=folded_bn),
+                ResNetResBlockUp(ch // 4, ch // 8, folded_bn=folded_bn),
+                ResNetResBlockUp(ch // 8, ch // 16, folded_bn=folded_bn),
+                ResNetResBlockUp(ch // 16, ch // 32, folded_bn=folded_bn),
+            )
+            self.finals = chainer.ChainList(
+                L.BatchNormalization(ch // 32),
+                LinkRelu(),
+                L.Convolution2D(ch // 32, 3, 3, 1, 1, initialW=w),
+                LinkTanh(),
+            )
+
+    def make_hidden(self, batchsize):
+        if self.z_distribution == "normal":
+            return np.random.randn(batchsize, self.n_hidden, 1, 1) \
+                .astype(np.float32)
+        elif self.z_distribution == "uniform":
+            return np.random.uniform(-1, 1, (batchsize, self.n_hidden, 1, 1)) \
+                .astype(np.float32)
+        else:
+            raise Exception("unknown z distribution: %s" % self.z_distribution)
+
+    def __call__(self, x):
+        h = x
+        h = self.dense(h)
+        for _layers in self.resblockups:
+            h = _layers(h)
+        for _layer in self.finals:
+            h = _layer(h)
+        return h
+
+
+class ResNetDiscriminator256(chainer.Chain):
+    def __init__(self, bottom_width=4, ch=1024, wscale=0.02, output_dim=1):
+        super().__init__()
+        self.bottom_width = bottom_width
+        self.ch = ch
+        self.wscale = wscale
+        self.output_dim = output_dim
+
+        with self.init_scope():
+            self.resblockdowns = chainer.ChainList(
+                ResNetResBlockDown(3, ch // 32),
+                ResNetResBlockDown(ch // 32, ch // 16),
+                ResNetResBlockDown(ch // 16, ch // 8),
+                ResNetResBlockDown(ch // 8, ch // 4),
+                ResNetResBlockDown(ch // 4, ch // 2),
+                ResNetResBlockDown(ch // 2, ch),
+            )
+            self.finals = chainer.ChainList(LinkRelu(), ResNetOutputDense(bottom_width, ch, output_dim))
+
+    def __call__(self, x):
+        h = x
+        for _layers in self.resblockdowns:
+            h = _layers(h)
+        for _layer in self.finals:
+            h = _layer(h)
+        return h
+
+
+ARCHS = {
+    'dcgan64': (DCGANGenerator64, DCGANDiscriminator64, 64),
+    'dcgan128': (DCGANGenerator128, DCGANDiscriminator128, 128),
+    'dcgan256': (DCGANGenerator256, DCGANDiscriminator256, 256),
+    'resnet128': (ResNetGenerator128, ResNetDiscriminator128, 128),
+    'resnet256': (ResNetGenerator256, ResNetDiscriminator256, 256),
+}
+
+
+def get_arch(arch):
+    """Return (generator_class, discriminator_class, image_size) for an `--arch` name."""
+    if arch not in ARCHS:
+        raise ValueError('Unknown -arch %s' % arch)
+    return ARCHS[arch]
+
+
+def make_inference_generator(arch, arrays, fold_bn=False):
+    """Build the generator of `arch` from serialized `arrays` (e.g. a loaded snapshot npz) for inference.
+
+    With `fold_bn`, BatchNormalization that directly follows a layer is folded into it and left out of the model:
+    DCGAN generators are built with `use_bn=False` and ResNet generators with `folded_bn=True`.
+    """
+    generator_class = get_arch(arch)[0]
+    if not fold_bn:
+        gen = generator_class()
+    else:
+        arrays = model_export.fold_batch_normalization(arrays)
+        gen = generator_class(use_bn=False) if arch.startswith('dcgan') else generator_class(folded_bn=True)
+    chainer.serializers.NpzDeserializer(arrays).load(gen)
+    return gen
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+import argparse
+
+import numpy as np
+
+import chainer_models
+import onnx_export
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='export a generator snapshot to ONNX')
+    parser.add_argument("--chainer_model_path", '-l', default='', help='load generator model')
+    parser.add_argument("--arch", default='resnet256', choices=sorted(chainer_models.ARCHS),
+                        help='generator architecture')
+    parser.add_argument("--fold_bn", action='store_true',
+                        help='fold BatchNormalization into the preceding layers before export')
+    parser.add_argument('--out', '-o', default='generator.onnx', help='output path')
+    parser.add_argument("--opset_version", type=int, default=onnx_export.OPSET_VERSION, help='ONNX opset version')
+    parser.add_argument("--check", action='store_true',
+                        help='compare ONNX Runtime output with the Chainer generator on a few latents')
+
+    args = parser.parse_args()
+
+    arrays = dict(np.load(args.chainer_model_path))
+    onnx_export.export_onnx(args.arch, arrays, args.out, args.fold_bn, args.opset_version)
+    print("Exported", args.out)
+
+    if args.check:
+        import chainer
+
+        z = np.random.RandomState(0).randn(4, 128).astype(np.float32)
+        gen = chainer_models.make_inference_generator(args.arch, arrays)
+        with chainer.using_config('train', False), chainer.using_config('enable_backprop', False):
+            expected = gen(z.reshape(z.shape + (1, 1))).array
+        print("max abs diff from Chainer: %.2e" % np.max(np.abs(onnx_export.OnnxGenerator(args.out)(z) - expected)))
@@ -2,50 +2,126 @@ import os
 os.environ["OPTIMIZE"] = "0"
 import numpy as np
 import chainer
-from chainer import cuda, serializers, Variable
+from chainer import cuda, Variable
 import chainer.functions as F
 import argparse
+from concurrent import futures
+import multiprocessing
+import pickle
+import shutil
 import sys
 sys.setrecursionlimit(10000)
 from webdnn.frontend.chainer import ChainerConverter
 from webdnn.backend.interface.generator import generate_descriptor
-from chainer_dcgan import DCGANGenerator64, ResNetGenerator128, ResNetGenerator256
+import chainer_models
+
+BACKENDS = ['webgpu', 'webgl', 'webassembly']
+# Constant encoder per encoding; `raw` keeps float32 weights.
+ENCODINGS = {'raw': None, 'eightbit': 'eightbit'}
+
+
+def graph_signature(args):
+    stat = os.stat(args.chainer_model_path)
+    return {'path': os.path.abspath(args.chainer_model_path), 'mtime': stat.st_mtime, 'size': stat.st_size,
+            'arch': args.arch, 'fold_bn': args.fold_bn, 'latent_len': args.latent_len}
+
+
+def convert_graph(args):
+    gen = chainer_models.make_inference_generator(args.arch, dict(np.load(args.chainer_model_path)), args.fold_bn)
+    print("Generator model loaded")
+
+    x = chainer.Variable(np.empty((1, args.latent_len), dtype=np.float32))
+    with chainer.using_config('train', False):
+        y = gen(x)
+    print("Start Convert")
+    return ChainerConverter().convert([x], [y])
+
+
+def cache_graph(args, cache_path):
+    """Pickle the converted WebDNN graph to `cache_path`, unless it already holds the graph of the same snapshot."""
+    signature = graph_signature(args)
+    if os.path.exists(cache_path):
+        with open(cache_path, 'rb') as f:
+            cached_signature, _ = pickle.load(f)
+        if cached_signature == signature:
+            print("Converted graph loaded from", cache_path)
+            return
+    graph = convert_graph(args)
+    with open(cache_path + '.tmp', 'wb') as f:
+        pickle.dump((signature, graph), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(cache_path + '.tmp', cache_path)
+
+
+def generate(cache_path, backend, encoding, out):
+    """Worker: generate the descriptor of one backend and encoding into `out`. Returns the bytes written.
+
+    Each worker unpickles its own graph, as descriptor generation optimizes the graph in place. Files are written to a
+    private directory first, since several backends share `out`.
+    """
+    with open(cache_path, 'rb') as f:
+        _, graph = pickle.load(f)
+    exec_info = generate_descriptor(backend, graph, constant_encoder_name=ENCODINGS[encoding])
+    tmp = os.path.join(out, '.tmp-%s-%s' % (backend, encoding))
+    shutil.rmtree(tmp, ignore_errors=True)
+    exec_info.save(tmp)
+    size = 0
+    for name in os.listdir(tmp):
+        size += os.path.getsize(os.path.join(tmp, name))
+        os.replace(os.path.join(tmp, name), os.path.join(out, name))
+    os.rmdir(tmp)
+    return size
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='discriminator testing script')
     parser.add_argument("--chainer_model_path", '-l', default='', help='load generator model')
-    # parser.add_argument("--arch", default='', help='generator architecture')
-    parser.add_argument('--out', '-o', default='gan-test', help='output path')
+    parser.add_argument("--arch", default='resnet256', choices=sorted(chainer_models.ARCHS),
+                        help='generator architecture')
+    parser.add_argument("--fold_bn", action='store_true',
+                        help='fold BatchNormalization into the preceding layers before conversion')
+    parser.add_argument('--out', '-o', default='gan-test', help='output path; eightbit descriptors go to <out>_8bit')
     parser.add_argument("--latent_len", type=int, default=128, help='latent vector length')
+    parser.add_argument("--backends", default=','.join(BACKENDS), help='comma separated descriptor backends')
+    parser.add_argument("--encodings", default=','.join(ENCODINGS), help='comma separated of: raw, eightbit')
+    parser.add_argument("--graph_cache", default='',
+                        help='pickled converted graph, reused while the snapshot is unchanged; '
+                        'defaults to <chainer_model_path>.<arch>.webdnn_graph.pkl')
+    parser.add_argument("--workers", type=int, default=0, help='worker processes; 0 uses one per descriptor')
 
     args = parser.parse_args()
+    backends = args.backends.split(',')
+    encodings = args.encodings.split(',')
+    for flag, names, known in (('--backends', backends, BACKENDS), ('--encodings', encodings, ENCODINGS)):
+        unknown = sorted(set(names) - set(known))
+        if unknown:
+            parser.error('unknown %s %s; choose from %s' % (flag, ','.join(unknown), ','.join(known)))
 
-    #if args.arch == 'dcgan64':
-    #    generator_class = DCGANGenerator64
-    #elif args.arch == 'resnet128':
-    #    generator_class = ResNetGenerator128
-    #elif args.arch == 'resnet256':
-    #else:
-    #    raise ValueError('Unknown -arch %s' % FLAGS.arch)
-    generator_class = ResNetGenerator256
-    gen = generator_class()
-    serializers.load_npz(args.chainer_model_path, gen)
-    print("Generator model loaded")
+    cache_path = args.graph_cache or '%s.%s%s.webdnn_graph.pkl' % (args.chainer_model_path, args.arch,
+                                                                   '.fold_bn' if args.fold_bn else '')
+    cache_graph(args, cache_path)
 
-    x =  chainer.Variable(np.empty((1, args.latent_len), dtype=np.float32))
-    with chainer.using_config('train', False):
-        y = gen(x)
-    print("Start Convert")
-    graph = ChainerConverter().convert([x], [y])
-    #exec_info = generate_descriptor("webgpu", graph)
-    #exec_info.save(args.out)
-    #exec_info = generate_descriptor("webgl", graph)
-    #exec_info.save(args.out)
-    exec_info = generate_descriptor("webgl", graph)
-    exec_info.save(args.out)
-    exec_info = generate_descriptor("webgl", graph, constant_encoder_name="eightbit")
-    exec_info.save(args.out+"_8bit")
-    #exec_info = generate_descriptor("webassembly", graph, constant_encoder_name="eightbit")
-    #exec_info.save(args.out+"_8bit")
-    #exec_info = generate_descriptor("webgpu", graph, constant_encoder_name="eightbit")
-    #exec_info.save(args.out+"_8bit")
+    jobs = [(backend, encoding) for backend in backends for encoding in encodings]
+    outs = {'raw': args.out, 'eightbit': args.out + "_8bit"}
+    for encoding in set(encoding for _, encoding in jobs):
+        os.makedirs(outs[encoding], exist_ok=True)
+
+    executor = futures.ProcessPoolExecutor(args.workers or len(jobs), mp_context=multiprocessing.get_context('spawn'))
+    with executor:
+        pending = {
+            executor.submit(generate, cache_path, backend, encoding, outs[encoding]): (backend, encoding)
+            for backend, encoding in jobs
+        }
+        sizes = {}
+        for future in futures.as_completed(pending):
+            try:
+                sizes[pending[future]] = future.result()
+                print("Generated %s %s" % pending[future])
+            except Exception as e:  # One backend's missing toolchain (e.g. emscripten) should not stop the others.
+                print("Failed %s %s: %r" % (pending[future] + (e, )))
+
+    print('%-12s %-9s %14s' % ('backend', 'encoding', 'bytes'))
+    for backend, encoding in jobs:
+        size = sizes.get((backend, encoding))
+        print('%-12s %-9s %14s' % (backend, encoding, 'failed' if size is None else size))
+    if len(sizes) < len(jobs):
+        sys.exit(1)
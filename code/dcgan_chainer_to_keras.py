@@ -1,34 +1,66 @@
 #!/usr/bin/env python3
 
+from concurrent import futures
 from functools import partial
+import glob
+import json
+import multiprocessing
 import os
 import sys
+import time
 
 from absl import app
 from absl import flags
 from absl import logging
 
+import chainer
 import keras
 # from keras import backend as K
 from keras.layers.core import Activation
 from keras.models import Sequential, Model
 from keras.layers import Input, Dense, Reshape, Add
-from keras.layers.convolutional import Conv2D, Conv2DTranspose
+from keras.layers.convolutional import Conv2D, Conv2DTranspose, UpSampling2D
 from keras.layers import BatchNormalization
 import numpy as np
 from PIL import Image
 import tensorflowjs as tfjs
 
+import chainer_models
+import model_export
+import tfjs_export
 
-def _make_dense(input_dim, units, weight=None, kernel_arr_name=None, bias_arr_name=None):
+
+def _chainer_param(name, axes=None):
+    """Getter of a Chainer parameter, transposed to the Keras layout: `_chainer_param(name, axes)(weight)`."""
+    def get(weight):
+        return weight[name] if axes is None else np.transpose(weight[name], axes)
+
+    return get
+
+
+def _with_chainer_weights(layer, *getters):
+    """Record on `layer` how to get each of its Keras weights, in `layer.weights` order, from the Chainer weights."""
+    layer.chainer_weights = getters
+    return layer
+
+
+def _make_dense(input_dim, units, weight=None, kernel_arr_name=None, bias_arr_name=None, activation=None):
+    return _with_chainer_weights(
+        _make_dense_layer(input_dim, units, weight, kernel_arr_name, bias_arr_name, activation),
+        _chainer_param(kernel_arr_name, (1, 0)), _chainer_param(bias_arr_name))
+
+
+def _make_dense_layer(input_dim, units, weight, kernel_arr_name, bias_arr_name, activation):
     return Dense(
         input_dim=input_dim,
         units=units,
+        activation=activation,
         kernel_initializer=(lambda _, dtype: np.transpose(weight[kernel_arr_name], (1, 0))),
         bias_initializer=(lambda _, dtype: weight[bias_arr_name]),
     ) if weight else Dense(
         input_dim=input_dim,
         units=units,
+        activation=activation,
     )
 
 
@@ -38,6 +70,15 @@ def _make_batch_normalizzation(axis,
                                gamma_arr_name=None,
                                moving_mean_arr_name=None,
                                moving_variance_arr_name=None):
+    return _with_chainer_weights(
+        _make_batch_normalizzation_layer(axis, weight, beta_arr_name, gamma_arr_name, moving_mean_arr_name,
+                                         moving_variance_arr_name),
+        _chainer_param(gamma_arr_name), _chainer_param(beta_arr_name), _chainer_param(moving_mean_arr_name),
+        _chainer_param(moving_variance_arr_name))
+
+
+def _make_batch_normalizzation_layer(axis, weight, beta_arr_name, gamma_arr_name, moving_mean_arr_name,
+                                     moving_variance_arr_name):
     return BatchNormalization(
         axis=1,
         beta_initializer=(lambda _, dtype: weight[beta_arr_name]),
@@ -47,14 +88,27 @@ def _make_batch_normalizzation(axis,
     ) if weight else BatchNormalization(axis=axis)
 
 
-def _make_conv_2d_transpose(filters, kernel_size, strides, weight=None, kernel_arr_name=None, bias_arr_name=None):
+def _make_conv_2d_transpose(filters,
+                            kernel_size,
+                            strides,
+                            weight=None,
+                            kernel_arr_name=None,
+                            bias_arr_name=None,
+                            activation=None):
+    return _with_chainer_weights(
+        _make_conv_2d_transpose_layer(filters, kernel_size, strides, weight, kernel_arr_name, bias_arr_name,
+                                      activation),
+        _chainer_param(kernel_arr_name, (2, 3, 1, 0)), _chainer_param(bias_arr_name))
+
 
+def _make_conv_2d_transpose_layer(filters, kernel_size, strides, weight, kernel_arr_name, bias_arr_name, activation):
     return Conv2DTranspose(
         filters=filters,
         kernel_size=kernel_size,
         strides=strides,
         padding='same',
         data_format='channels_first',
+        activation=activation,
         kernel_initializer=(lambda _, dtype: np.transpose(weight[kernel_arr_name], (2, 3, 1, 0))),
         bias_initializer=(lambda _, dtype: weight[bias_arr_name]),
     ) if weight else Conv2DTranspose(
@@ -63,17 +117,25 @@ def _make_conv_2d_transpose(filters, kernel_size, strides, weight=None, kernel_a
         strides=strides,
         padding='same',
         data_format='channels_first',
+        activation=activation,
     )
 
 
-def _make_conv_2d(filters, kernel_size, strides, weight=None, kernel_arr_name=None, bias_arr_name=None):
+def _make_conv_2d(filters, kernel_size, strides, weight=None, kernel_arr_name=None, bias_arr_name=None,
+                  activation=None):
+    return _with_chainer_weights(
+        _make_conv_2d_layer(filters, kernel_size, strides, weight, kernel_arr_name, bias_arr_name, activation),
+        _chainer_param(kernel_arr_name, (2, 3, 1, 0)), _chainer_param(bias_arr_name))
+
 
+def _make_conv_2d_layer(filters, kernel_size, strides, weight, kernel_arr_name, bias_arr_name, activation):
     return Conv2D(
         filters=filters,
         kernel_size=kernel_size,
         strides=strides,
         padding='same',
         data_format='channels_first',
+        activation=activation,
         kernel_initializer=(lambda x: np.transpose(weight[kernel_arr_name], (2, 3, 1, 0))),
         bias_initializer=(lambda x: weight[bias_arr_name]),
     ) if weight else Conv2D(
@@ -82,10 +144,31 @@ def _make_conv_2d(filters, kernel_size, strides, weight=None, kernel_arr_name=No
         strides=strides,
         padding='same',
         data_format='channels_first',
+        activation=activation,
     )
 
 
-def get_dcgan64_keras_generator(input_dim, ch, weight=None):
+def _add_bn_activation(model, activation, weight=None, bn_prefix=None, optimize=False):
+    '''
+    Add the BatchNormalization (if any) and activation that follow a layer to a Sequential model.
+
+    With `optimize`, BN has been folded into the layer's weights (`model_export.fold_batch_normalization`) and the
+    activation fused into the layer (`_fused(activation, optimize)`), so nothing is added.
+    '''
+    if optimize:
+        return
+    if bn_prefix:
+        model.add(
+            _make_batch_normalizzation(1, weight, bn_prefix + 'beta', bn_prefix + 'gamma', bn_prefix + 'avg_mean',
+                                       bn_prefix + 'avg_var'))
+    model.add(Activation(activation))
+
+
+def _fused(activation, optimize):
+    return activation if optimize else None
+
+
+def get_dcgan64_keras_generator(input_dim, ch, weight=None, optimize=False):
     if weight:
         print('=' * 80)
         print('weight')
@@ -97,25 +180,21 @@ def get_dcgan64_keras_generator(input_dim, ch, weight=None):
         print('=' * 80)
 
     model = Sequential()
-    model.add(_make_dense(input_dim, 4 * 4 * ch, weight, 'l0/W', 'l0/b'))
-    model.add(_make_batch_normalizzation(1, weight, 'bn0/beta', 'bn0/gamma', 'bn0/avg_mean', 'bn0/avg_var'))
-    model.add(Activation('relu'))
+    model.add(_make_dense(input_dim, 4 * 4 * ch, weight, 'l0/W', 'l0/b', _fused('relu', optimize)))
+    _add_bn_activation(model, 'relu', weight, 'bn0/', optimize)
     model.add(Reshape((ch, 4, 4)))
-    model.add(_make_conv_2d_transpose(ch // 2, 4, 2, weight, 'dc1/W', 'dc1/b'))
-    model.add(_make_batch_normalizzation(1, weight, 'bn1/beta', 'bn1/gamma', 'bn1/avg_mean', 'bn1/avg_var'))
-    model.add(Activation('relu'))
-    model.add(_make_conv_2d_transpose(ch // 4, 4, 2, weight, 'dc2/W', 'dc2/b'))
-    model.add(_make_batch_normalizzation(1, weight, 'bn2/beta', 'bn2/gamma', 'bn2/avg_mean', 'bn2/avg_var'))
-    model.add(Activation('relu'))
-    model.add(_make_conv_2d_transpose(ch // 8, 4, 2, weight, 'dc3/W', 'dc3/b'))
-    model.add(_make_batch_normalizzation(1, weight, 'bn3/beta', 'bn3/gamma', 'bn3/avg_mean', 'bn3/avg_var'))
-    model.add(Activation('relu'))
-    model.add(_make_conv_2d_transpose(3, 4, 2, weight, 'dc4/W', 'dc4/b'))
-    model.add(Activation('tanh'))
+    model.add(_make_conv_2d_transpose(ch // 2, 4, 2, weight, 'dc1/W', 'dc1/b', _fused('relu', optimize)))
+    _add_bn_activation(model, 'relu', weight, 'bn1/', optimize)
+    model.add(_make_conv_2d_transpose(ch // 4, 4, 2, weight, 'dc2/W', 'dc2/b', _fused('relu', optimize)))
+    _add_bn_activation(model, 'relu', weight, 'bn2/', optimize)
+    model.add(_make_conv_2d_transpose(ch // 8, 4, 2, weight, 'dc3/W', 'dc3/b', _fused('relu', optimize)))
+    _add_bn_activation(model, 'relu', weight, 'bn3/', optimize)
+    model.add(_make_conv_2d_transpose(3, 4, 2, weight, 'dc4/W', 'dc4/b', _fused('tanh', optimize)))
+    _add_bn_activation(model, 'tanh', optimize=optimize)
     return model
 
 
-def get_dcgan128_keras_generator(input_dim, ch, weight=None):
+def get_dcgan128_keras_generator(input_dim, ch, weight=None, optimize=False):
     if weight:
         print('=' * 80)
         print('weight')
@@ -127,38 +206,37 @@ def get_dcgan128_keras_generator(input_dim, ch, weight=None):
         print('=' * 80)
 
     model = Sequential()
-    model.add(_make_dense(input_dim, 4 * 4 * ch, weight, 'l0/W', 'l0/b'))
-    model.add(_make_batch_normalizzation(1, weight, 'bn0/beta', 'bn0/gamma', 'bn0/avg_mean', 'bn0/avg_var'))
-    model.add(Activation('relu'))
+    model.add(_make_dense(input_dim, 4 * 4 * ch, weight, 'l0/W', 'l0/b', _fused('relu', optimize)))
+    _add_bn_activation(model, 'relu', weight, 'bn0/', optimize)
     model.add(Reshape((ch, 4, 4)))
-    model.add(_make_conv_2d_transpose(ch // 2, 4, 2, weight, 'dc1/W', 'dc1/b'))
-    model.add(_make_batch_normalizzation(1, weight, 'bn1/beta', 'bn1/gamma', 'bn1/avg_mean', 'bn1/avg_var'))
-    model.add(Activation('relu'))
-    model.add(_make_conv_2d_transpose(ch // 4, 4, 2, weight, 'dc2/W', 'dc2/b'))
-    model.add(_make_batch_normalizzation(1, weight, 'bn2/beta', 'bn2/gamma', 'bn2/avg_mean', 'bn2/avg_var'))
-    model.add(Activation('relu'))
-    model.add(_make_conv_2d_transpose(ch // 8, 4, 2, weight, 'dc3/W', 'dc3/b'))
-    model.add(_make_batch_normalizzation(1, weight, 'bn3/beta', 'bn3/gamma', 'bn3/avg_mean', 'bn3/avg_var'))
-    model.add(Activation('relu'))
-    model.add(_make_conv_2d_transpose(ch // 16, 4, 2, weight, 'dc4/W', 'dc4/b'))
-    model.add(_make_batch_normalizzation(1, weight, 'bn4/beta', 'bn4/gamma', 'bn4/avg_mean', 'bn4/avg_var'))
-    model.add(Activation('relu'))
-    model.add(_make_conv_2d_transpose(3, 4, 2, weight, 'dc5/W', 'dc5/b'))
-    model.add(Activation('tanh'))
+    model.add(_make_conv_2d_transpose(ch // 2, 4, 2, weight, 'dc1/W', 'dc1/b', _fused('relu', optimize)))
+    _add_bn_activation(model, 'relu', weight, 'bn1/', optimize)
+    model.add(_make_conv_2d_transpose(ch // 4, 4, 2, weight, 'dc2/W', 'dc2/b', _fused('relu', optimize)))
+    _add_bn_activation(model, 'relu', weight, 'bn2/', optimize)
+    model.add(_make_conv_2d_transpose(ch // 8, 4, 2, weight, 'dc3/W', 'dc3/b', _fused('relu', optimize)))
+    _add_bn_activation(model, 'relu', weight, 'bn3/', optimize)
+    model.add(_make_conv_2d_transpose(ch // 16, 4, 2, weight, 'dc4/W', 'dc4/b', _fused('relu', optimize)))
+    _add_bn_activation(model, 'relu', weight, 'bn4/', optimize)
+    model.add(_make_conv_2d_transpose(3, 4, 2, weight, 'dc5/W', 'dc5/b', _fused('tanh', optimize)))
+    _add_bn_activation(model, 'tanh', optimize=optimize)
     return model
 
 
-def _make_upsampling_2d(ch, weight=None):
+def _make_upsampling_2d(ch, weight=None, upsampling='nearest'):
     '''
-    tensorflow.js and Keras doesn't support Unpooling,
-    use Conv2DTranspose with hanf-crafted weight as a replacement.
+    Equivalent of `F.unpooling_2d(x, 2, 2, 0, cover_all=False)`.
+
+    `nearest` is a parameter-free UpSampling2D. `conv_transpose` is the legacy replacement for when tensorflow.js had no
+    suitable op: a Conv2DTranspose with a hand-crafted 2x2xCxC identity kernel, i.e. 4*C*C mostly-zero weights.
     '''
+    if upsampling == 'nearest':
+        return UpSampling2D(size=2, data_format='channels_first')
 
     kernel_matrix = np.zeros((2, 2, ch, ch), dtype='f')
     for i in range(ch):
         kernel_matrix[:, :, i, i] = 1.
 
-    return Conv2DTranspose(
+    layer = Conv2DTranspose(
         filters=ch,
         kernel_size=2,
         strides=2,
@@ -170,46 +248,56 @@ def _make_upsampling_2d(ch, weight=None):
         # that tfjs would complain when it loads its weight.
         kernel_initializer=(lambda x: kernel_matrix) if weight else keras.initializers.Zeros(),
         bias_initializer=keras.initializers.Zeros())
+    return _with_chainer_weights(layer, lambda _: kernel_matrix, lambda _: np.zeros(ch, dtype='f'))
 
 
-def _make_res_net_res_block_up(in_ch, out_ch, weight=None, prefix=''):
+def _make_res_net_res_block_up(in_ch, out_ch, weight=None, prefix='', upsampling='nearest', optimize=False):
     def f(x):
         p = prefix
         bn0 = _make_batch_normalizzation(1, weight, p + 'bn0/beta', p + 'bn0/gamma', p + 'bn0/avg_mean',
                                          p + 'bn0/avg_var')
-        bn1 = _make_batch_normalizzation(1, weight, p + 'bn1/beta', p + 'bn1/gamma', p + 'bn1/avg_mean',
-                                         p + 'bn1/avg_var')
-        c0 = _make_conv_2d(out_ch, 3, 1, weight, p + 'c0/W', p + 'c0/b')
+        c0 = _make_conv_2d(out_ch, 3, 1, weight, p + 'c0/W', p + 'c0/b', _fused('relu', optimize))
         c1 = _make_conv_2d(out_ch, 3, 1, weight, p + 'c1/W', p + 'c1/b')
         cs = _make_conv_2d(out_ch, 3, 1, weight, p + 'cs/W', p + 'cs/b')
 
-        u0 = _make_upsampling_2d(in_ch, weight)
-        u1 = _make_upsampling_2d(in_ch, weight)
-
-        h = c0(u0(Activation('relu')(bn0(x))))
-        h = c1(Activation('relu')(bn1(h)))
-        hs = cs(u1(x))
+        if upsampling == 'nearest':
+            # Nearest upsampling commutes with the per-channel BN and ReLU, so both branches share one upsample.
+            x = _make_upsampling_2d(in_ch, weight, upsampling)(x)
+            h = c0(Activation('relu')(bn0(x)))
+            hs = cs(x)
+        else:
+            u0 = _make_upsampling_2d(in_ch, weight, upsampling)
+            u1 = _make_upsampling_2d(in_ch, weight, upsampling)
+            h = c0(u0(Activation('relu')(bn0(x))))
+            hs = cs(u1(x))
+        if not optimize:
+            bn1 = _make_batch_normalizzation(1, weight, p + 'bn1/beta', p + 'bn1/gamma', p + 'bn1/avg_mean',
+                                             p + 'bn1/avg_var')
+            h = Activation('relu')(bn1(h))
+        h = c1(h)
         return Add()([h, hs])
 
     return f
 
 
-def _make_rese_net_finals(ch, weight=None, prefix=''):
+def _make_rese_net_finals(ch, weight=None, prefix='', optimize=False):
     def f(x):
         p = prefix
 
         bn = _make_batch_normalizzation(1, weight, p + '0/beta', p + '0/gamma', p + '0/avg_mean', p + '0/avg_var')
-        c = _make_conv_2d(ch, 3, 1, weight, p + '2/W', p + '2/b')
+        c = _make_conv_2d(ch, 3, 1, weight, p + '2/W', p + '2/b', _fused('tanh', optimize))
 
         h = Activation('relu')(bn(x))
-        h = Activation('tanh')(c(h))
+        h = c(h)
+        if not optimize:
+            h = Activation('tanh')(h)
 
         return h
 
     return f
 
 
-def get_resnet128_keras_generator(input_dim, ch, weight=None):
+def get_resnet128_keras_generator(input_dim, ch, weight=None, upsampling='nearest', optimize=False):
     if weight:
         print('=' * 80)
         print('weight')
@@ -224,18 +312,18 @@ def get_resnet128_keras_generator(input_dim, ch, weight=None):
     x = input
     x = _make_dense(input_dim, 4 * 4 * ch, weight, 'dense/l/W', 'dense/l/b')(x)
     x = Reshape((ch, 4, 4))(x)
-    x = _make_res_net_res_block_up(ch, ch, weight, 'resblockups/0/')(x)
-    x = _make_res_net_res_block_up(ch, ch // 2, weight, 'resblockups/1/')(x)
-    x = _make_res_net_res_block_up(ch // 2, ch // 4, weight, 'resblockups/2/')(x)
-    x = _make_res_net_res_block_up(ch // 4, ch // 8, weight, 'resblockups/3/')(x)
-    x = _make_res_net_res_block_up(ch // 8, ch // 16, weight, 'resblockups/4/')(x)
-    x = _make_rese_net_finals(3, weight, 'finals/')(x)
+    x = _make_res_net_res_block_up(ch, ch, weight, 'resblockups/0/', upsampling, optimize)(x)
+    x = _make_res_net_res_block_up(ch, ch // 2, weight, 'resblockups/1/', upsampling, optimize)(x)
+    x = _make_res_net_res_block_up(ch // 2, ch // 4, weight, 'resblockups/2/', upsampling, optimize)(x)
+    x = _make_res_net_res_block_up(ch // 4, ch // 8, weight, 'resblockups/3/', upsampling, optimize)(x)
+    x = _make_res_net_res_block_up(ch // 8, ch // 16, weight, 'resblockups/4/', upsampling, optimize)(x)
+    x = _make_rese_net_finals(3, weight, 'finals/', optimize)(x)
 
     model = Model(inputs=input, outputs=x)
     return model
 
 
-def get_resnet256_keras_generator(input_dim, ch, weight=None):
+def get_resnet256_keras_generator(input_dim, ch, weight=None, upsampling='nearest', optimize=False):
     if weight:
         print('=' * 80)
         print('weight')
@@ -250,13 +338,13 @@ def get_resnet256_keras_generator(input_dim, ch, weight=None):
     x = input
     x = _make_dense(input_dim, 4 * 4 * ch, weight, 'dense/l/W', 'dense/l/b')(x)
     x = Reshape((ch, 4, 4))(x)
-    x = _make_res_net_res_block_up(ch, ch, weight, 'resblockups/0/')(x)
-    x = _make_res_net_res_block_up(ch, ch // 2, weight, 'resblockups/1/')(x)
-    x = _make_res_net_res_block_up(ch // 2, ch // 4, weight, 'resblockups/2/')(x)
-    x = _make_res_net_res_block_up(ch // 4, ch // 8, weight, 'resblockups/3/')(x)
-    x = _make_res_net_res_block_up(ch // 8, ch // 16, weight, 'resblockups/4/')(x)
-    x = _make_res_net_res_block_up(ch // 16, ch // 32, weight, 'resblockups/5/')(x)
-    x = _make_rese_net_finals(3, weight, 'finals/')(x)
+    x = _make_res_net_res_block_up(ch, ch, weight, 'resblockups/0/', upsampling, optimize)(x)
+    x = _make_res_net_res_block_up(ch, ch // 2, weight, 'resblockups/1/', upsampling, optimize)(x)
+    x = _make_res_net_res_block_up(ch // 2, ch // 4, weight, 'resblockups/2/', upsampling, optimize)(x)
+    x = _make_res_net_res_block_up(ch // 4, ch // 8, weight, 'resblockups/3/', upsampling, optimize)(x)
+    x = _make_res_net_res_block_up(ch // 8, ch // 16, weight, 'resblockups/4/', upsampling, optimize)(x)
+    x = _make_res_net_res_block_up(ch // 16, ch // 32, weight, 'resblockups/5/', upsampling, optimize)(x)
+    x = _make_rese_net_finals(3, weight, 'finals/', optimize)(x)
 
     model = Model(inputs=input, outputs=x)
     return model
@@ -279,51 +367,366 @@ def generate_images(generator, output_dir, index, latent_dim=128, nb_row=5, nb_c
     tiled_output.save(outfile)
 
 
+def fixed_latents(n):
+    """The latent set all export checks and reports are computed on."""
+    return np.random.RandomState(0).randn(n, 128).astype(np.float32)
+
+
+def chainer_reference_output(arch, weight, z, batch_size=8):
+    """Output of the Chainer generator of `arch` with `weight` for latents `z` of shape (n, n_hidden)."""
+    gen = chainer_models.make_inference_generator(arch, weight)
+    outputs = []
+    with chainer.using_config('train', False), chainer.using_config('enable_backprop', False):
+        for i in range(0, len(z), batch_size):
+            batch = z[i:i + batch_size]
+            outputs.append(gen(batch.reshape(batch.shape + (1, 1))).array)
+    return np.concatenate(outputs)
+
+
+def predict_latency(generator, z, runs=10):
+    """Mean seconds of `generator.predict` on a single latent, after one warm-up call."""
+    generator.predict(z[:1])
+    start = time.perf_counter()
+    for _ in range(runs):
+        generator.predict(z[:1])
+    return (time.perf_counter() - start) / runs
+
+
+def check_export(arch, weight, generators, tolerance, runs=10):
+    """Compare Keras generators against the Chainer generator and print their op counts and latencies.
+
+    `generators` maps a label to a Keras model. Raises ValueError if any output differs by more than `tolerance`.
+    """
+    z = fixed_latents(8)
+    expected = chainer_reference_output(arch, weight, z)
+
+    print('%-12s %8s %12s %12s %14s' % ('model', 'layers', 'params', 'max_abs_diff', 'latency_ms'))
+    failures = []
+    for label, generator in generators.items():
+        diff = float(np.max(np.abs(generator.predict(z) - expected)))
+        latency = predict_latency(generator, z, runs)
+        print('%-12s %8d %12d %12.2e %14.2f' % (label, len(generator.layers), generator.count_params(), diff,
+                                                latency * 1000))
+        if diff > tolerance:
+            failures.append(label)
+    if failures:
+        raise ValueError('Keras output of %s differs from Chainer by more than %g' % (', '.join(failures), tolerance))
+
+
+def keras_weight_name(variable):
+    """Name of a Keras weight in a tfjs weights manifest, e.g. `dense/kernel:0` => `dense/kernel`."""
+    return variable.name.split(':')[0]
+
+
+def keras_topology(model):
+    """`modelTopology` of a tfjs `model.json`, as `tfjs.converters.save_keras_model` writes it."""
+    return {
+        'keras_version': keras.__version__,
+        'backend': 'tensorflow',
+        'model_config': json.loads(model.to_json()),
+    }
+
+
+def tfjs_weight_specs(generator, weight):
+    """`(name, shape, get_array)` of every weight of `generator`, taken from the Chainer `weight` dict."""
+    specs = []
+    for layer in generator.layers:
+        getters = getattr(layer, 'chainer_weights', ())
+        if len(getters) != len(layer.weights):
+            raise ValueError('layer %s has %d weights but %d Chainer getters' % (layer.name, len(layer.weights),
+                                                                                 len(getters)))
+        for variable, get in zip(layer.weights, getters):
+            specs.append((keras_weight_name(variable), tuple(variable.shape), partial(get, weight)))
+    return specs
+
+
+def save_tfjs_model(generator, weight, path, **kwargs):
+    """Write `generator`'s topology and the Chainer `weight` as a tfjs layers model, without setting Keras weights.
+
+    `kwargs` (`quantization`, `shard_size`, `content_hash`) are passed to `tfjs_export.write_layers_model`.
+    """
+    return tfjs_export.write_layers_model(path, keras_topology(generator), tfjs_weight_specs(generator, weight),
+                                          generated_by='keras v%s' % keras.__version__, **kwargs)
+
+
+def load_tfjs_weights(generator, path):
+    """Set `generator`'s weights from a tfjs layers model written by `save_tfjs_model`."""
+    _, arrays = tfjs_export.read_layers_model(path)
+    for layer in generator.layers:
+        if layer.weights:
+            layer.set_weights([arrays[keras_weight_name(variable)] for variable in layer.weights])
+
+
+QUANTIZED_VARIANTS = ['float16', 'uint16', 'uint8', 'uint8_per_channel']
+
+
+def image_error(images, expected):
+    """PSNR (dB) and max abs difference of generator outputs in [-1, 1], measured in 0-255 pixel values."""
+    diff = (images.astype(np.float64) - expected) * 127.5
+    mse = float(np.mean(diff**2))
+    return {
+        'psnr': 10 * np.log10(255.0**2 / mse) if mse else None,
+        'max_abs_diff': float(np.max(np.abs(diff))),
+    }
+
+
+def path_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def write_quantized_variants(arch, generator, weight, chainer_weight, variants, tfjs_path, n_samples=64, **kwargs):
+    """Write each of `variants` next to the float32 tfjs model at `tfjs_path` and report its accuracy.
+
+    tfjs variants are `<tfjs_path>_<variant>` directories, measured by loading them back into `generator`;
+    `uint8_per_channel` is an npz of `model_export.quantize_per_channel`, measured with the Chainer generator, since the
+    tfjs format has one scale per tensor. Errors are against the float32 Chainer generator (`chainer_weight`) on a
+    fixed latent set. The report is printed and saved as `<tfjs_path>.report.json`. `kwargs` go to `save_tfjs_model`.
+    """
+    z = fixed_latents(n_samples)
+    expected = chainer_reference_output(arch, chainer_weight, z)
+    report = {'float32': dict(image_error(generator.predict(z), expected), path=tfjs_path)}
+    for variant in variants:
+        if variant == 'uint8_per_channel':
+            path = tfjs_path + '_uint8_per_channel.npz'
+            np.savez_compressed(path, **model_export.quantize_per_channel(weight))
+            images = chainer_reference_output(arch, model_export.dequantize_per_channel(np.load(path)), z)
+        else:
+            path = '%s_%s' % (tfjs_path, variant)
+            logging.info('Saving %s tensorflow.js model to %s', variant, path)
+            save_tfjs_model(generator, weight, path, quantization=variant, **kwargs)
+            load_tfjs_weights(generator, path)
+            images = generator.predict(z)
+        report[variant] = dict(image_error(images, expected), path=path)
+    load_tfjs_weights(generator, tfjs_path)
+
+    for entry in report.values():
+        entry['bytes'] = path_size(entry['path'])
+    print('%-18s %12s %10s %14s' % ('variant', 'bytes', 'psnr_db', 'max_abs_diff'))
+    for variant, entry in sorted(report.items(), key=lambda item: -item[1]['bytes']):
+        psnr = 'inf' if entry['psnr'] is None else '%.2f' % entry['psnr']
+        print('%-18s %12d %10s %14.3f' % (variant, entry['bytes'], psnr, entry['max_abs_diff']))
+    with open(tfjs_path + '.report.json', 'w') as f:
+        json.dump({'arch': arch, 'samples': n_samples, 'variants': report}, f, indent=2, sort_keys=True)
+    return report
+
+
 FLAGS = flags.FLAGS
 
 flags.DEFINE_string('arch', '', 'Architecture of netowrk. can be `dcgan64` or `resnet128`.')
 flags.DEFINE_string('chainer_model_path', '', '')
 flags.DEFINE_string('keras_model_path', '', '')
 flags.DEFINE_string('tfjs_model_path', '', '')
+flags.DEFINE_enum('upsampling', 'nearest', ['nearest', 'conv_transpose'],
+                  'Upsampling op of ResNet generators. `conv_transpose` is the legacy identity-kernel emulation.')
+flags.DEFINE_boolean('optimize_graph', True,
+                     'Fold BatchNormalization into the preceding layers and fuse activations into them.')
+flags.DEFINE_boolean('check', True, 'Compare the exported model with the Chainer model and the unoptimized export.')
+flags.DEFINE_float('tolerance', 1e-3, 'Max abs difference from the Chainer output allowed by --check.')
+flags.DEFINE_boolean('direct_tfjs', True,
+                     'Write the tfjs model straight from the Chainer weights instead of converting a Keras model.')
+flags.DEFINE_list('quantize', [],
+                  'Also write these smaller variants, with an accuracy report: %s. Needs --direct_tfjs.' %
+                  ', '.join(QUANTIZED_VARIANTS))
+flags.DEFINE_integer('shard_size', tfjs_export.DEFAULT_SHARD_SIZE, 'Size in bytes of tfjs weight shards.')
+flags.DEFINE_boolean('content_hash_shards', True,
+                     'Name tfjs weight shards by a hash of their contents, so unchanged shards keep their names.')
+flags.DEFINE_integer('report_samples', 64, 'Number of fixed latents the --quantize report is computed on.')
+flags.DEFINE_integer('sample_grids', 10, 'Number of sample image grids to save next to the exported model.')
+flags.DEFINE_string('batch_glob', '',
+                    'Convert every snapshot matching this glob, e.g. `$OUT/SmoothedGenerator_*.npz`, to '
+                    '`tfjs_<snapshot name>` directories. Snapshots whose output is up to date are skipped.')
+flags.DEFINE_string('batch_out', '', 'Output directory of --batch_glob. Defaults to the directory of each snapshot.')
+flags.DEFINE_integer('workers', 0, 'Number of --batch_glob worker processes. 0 uses one per CPU core.')
+
+
+def make_get_generator(arch, upsampling='nearest', optimize=False):
+    """Builder of the Keras generator of `arch`: `get_generator(weight=None, optimize=optimize)`."""
+    if arch == 'resnet128':
+        get_generator = partial(get_resnet128_keras_generator, input_dim=128, ch=1024, upsampling=upsampling)
+    elif arch == 'resnet256':
+        get_generator = partial(get_resnet256_keras_generator, input_dim=128, ch=1024, upsampling=upsampling)
+    elif arch == 'dcgan64':
+        get_generator = partial(get_dcgan64_keras_generator, input_dim=128, ch=512)
+    elif arch == 'dcgan128':
+        get_generator = partial(get_dcgan128_keras_generator, input_dim=128, ch=1024)
+    else:
+        raise ValueError('Unknow --arch %s' % arch)
+    return partial(get_generator, optimize=optimize)
+
+
+def set_chainer_weights(generator, weight):
+    """Set the weights of a generator built without `weight` from the Chainer `weight` dict."""
+    for layer in generator.layers:
+        if layer.weights:
+            layer.set_weights([get(weight) for get in layer.chainer_weights])
+
+
+_worker_generators = {}
+
+
+def get_cached_generator(get_generator, optimize):
+    """A Keras generator of `get_generator` without weights, built once per process and reused across snapshots."""
+    keywords = tuple(sorted((name, value) for name, value in get_generator.keywords.items() if name != 'optimize'))
+    key = get_generator.func, get_generator.args, keywords, optimize
+    if key not in _worker_generators:
+        _worker_generators[key] = get_generator(optimize=optimize)
+    return _worker_generators[key]
+
+
+def export_snapshot(chainer_model_path, tfjs_model_path, keras_model_path=''):
+    """Convert one Chainer snapshot as configured by the flags: export, check, quantized variants and samples."""
+    shard_kwargs = {'shard_size': FLAGS.shard_size, 'content_hash': FLAGS.content_hash_shards}
+    chainer_weight = dict(np.load(chainer_model_path))
+    weight = model_export.fold_batch_normalization(chainer_weight) if FLAGS.optimize_graph else chainer_weight
+    get_generator = make_get_generator(FLAGS.arch, FLAGS.upsampling, FLAGS.optimize_graph)
+
+    if FLAGS.direct_tfjs:
+        # The Keras model is built only for its topology; weights go from the npz straight into the shards.
+        generator = get_cached_generator(get_generator, FLAGS.optimize_graph)
+        logging.info('Saving tensorflow.js model to %s', tfjs_model_path)
+        save_tfjs_model(generator, weight, tfjs_model_path, **shard_kwargs)
+        # Checking and sampling below run on the weights read back from the shards.
+        load_tfjs_weights(generator, tfjs_model_path)
+        if keras_model_path:
+            logging.info('Saving keras model (weights) to %s', keras_model_path)
+            generator.save_weights(keras_model_path)
+    else:
+        generator = convert_with_keras(get_generator, weight, keras_model_path, tfjs_model_path)
+
+    if FLAGS.check:
+        generators = {'exported': generator}
+        if FLAGS.optimize_graph:
+            generators['unoptimized'] = get_cached_generator(get_generator, False)
+            set_chainer_weights(generators['unoptimized'], chainer_weight)
+        check_export(FLAGS.arch, chainer_weight, generators, FLAGS.tolerance)
+
+    if FLAGS.quantize:
+        write_quantized_variants(FLAGS.arch, generator, weight, chainer_weight, FLAGS.quantize, tfjs_model_path,
+                                 FLAGS.report_samples, **shard_kwargs)
+
+    sample_output_dir = (keras_model_path or tfjs_model_path) + '.sample'
+    logging.info('Sampling images, saving to %s', sample_output_dir)
+    os.system('mkdir -p "%s"' % sample_output_dir)
+    for index in range(FLAGS.sample_grids):
+        generate_images(generator, sample_output_dir, index)
+
+
+def conversion_signature(chainer_model_path):
+    """Everything a conversion's output depends on; an output with the same signature is up to date."""
+    stat = os.stat(chainer_model_path)
+    names = ['arch', 'upsampling', 'optimize_graph', 'direct_tfjs', 'quantize', 'shard_size', 'content_hash_shards',
+             'report_samples', 'sample_grids']
+    return dict({name: FLAGS[name].value for name in names}, mtime=stat.st_mtime, size=stat.st_size)
+
+
+def signature_path(tfjs_model_path):
+    # Kept outside the model directory, so it is not part of the uploaded files or their manifest.
+    return tfjs_model_path + '.convert.json'
+
+
+def is_up_to_date(chainer_model_path, tfjs_model_path):
+    if not os.path.exists(os.path.join(tfjs_model_path, 'model.json')) or not os.path.exists(
+            signature_path(tfjs_model_path)):
+        return False
+    with open(signature_path(tfjs_model_path)) as f:
+        return json.load(f) == conversion_signature(chainer_model_path)
+
+
+def init_worker(argv):
+    # Spawned workers import this module afresh, so their flags have to be parsed again.
+    FLAGS(argv)
+
+
+def convert_in_worker(chainer_model_path, tfjs_model_path):
+    export_snapshot(chainer_model_path, tfjs_model_path)
+    with open(signature_path(tfjs_model_path), 'w') as f:
+        json.dump(conversion_signature(chainer_model_path), f, indent=2, sort_keys=True)
+    return tfjs_model_path
+
+
+def batch_tfjs_model_path(chainer_model_path):
+    """`<dir>/SmoothedGenerator_<iter>.npz` => `<--batch_out or dir>/tfjs_SmoothedGenerator_<iter>`."""
+    directory, name = os.path.split(chainer_model_path)
+    return os.path.join(FLAGS.batch_out or directory, 'tfjs_' + os.path.splitext(name)[0])
+
+
+def convert_batch():
+    """Convert every snapshot matching `--batch_glob` that is not up to date, spread over worker processes.
+
+    Failed snapshots are listed at the end, and the process then exits with status 1.
+    """
+    todo = {}
+    paths = sorted(glob.glob(FLAGS.batch_glob))
+    for path in paths:
+        if not is_up_to_date(path, batch_tfjs_model_path(path)):
+            todo[path] = batch_tfjs_model_path(path)
+    print('%d snapshots, %d to convert' % (len(paths), len(todo)))
+    if not todo:
+        return
+
+    workers = min(FLAGS.workers or os.cpu_count(), len(todo))
+    # Split the cores between workers instead of letting every worker's TensorFlow and BLAS use all of them.
+    for name in ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS']:
+        os.environ.setdefault(name, str(max(1, os.cpu_count() // workers)))
+    executor = futures.ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                                           initializer=init_worker, initargs=(sys.argv, ))
+    failed = []
+    with executor:
+        pending = {executor.submit(convert_in_worker, path, tfjs_path): path for path, tfjs_path in todo.items()}
+        for future in futures.as_completed(pending):
+            try:
+                print('converted %s' % future.result())
+            except Exception as e:  # One bad snapshot should not stop the others.
+                print('failed %s: %r' % (pending[future], e))
+                failed.append(pending[future])
+    if failed:
+        print('%d of %d conversions failed:' % (len(failed), len(todo)))
+        for path in sorted(failed):
+            print('  %s' % path)
+        sys.exit(1)
 
 
 def main(argv):
     del argv  # Unused.
 
-    weight = np.load(FLAGS.chainer_model_path)
+    unknown = set(FLAGS.quantize) - set(QUANTIZED_VARIANTS)
+    if unknown:
+        raise ValueError('Unknown --quantize %s' % ', '.join(sorted(unknown)))
+    if FLAGS.quantize and not FLAGS.direct_tfjs:
+        raise ValueError('--quantize needs --direct_tfjs')
 
-    if FLAGS.arch == 'resnet128':
-        get_generator = partial(get_resnet128_keras_generator, input_dim=128, ch=1024)
-    elif FLAGS.arch == 'resnet256':
-        get_generator = partial(get_resnet256_keras_generator, input_dim=128, ch=1024)
-    elif FLAGS.arch == 'dcgan64':
-        get_generator = partial(get_dcgan64_keras_generator, input_dim=128, ch=512)
-    elif FLAGS.arch == 'dcgan128':
-        get_generator = partial(get_dcgan128_keras_generator, input_dim=128, ch=1024)
-    else:
-        raise ValueError('Unknow --arch %s' % FLAGS.arch)
+    if FLAGS.batch_glob:
+        if not FLAGS.direct_tfjs:
+            raise ValueError('--batch_glob needs --direct_tfjs')
+        convert_batch()
+        return
+
+    if FLAGS.direct_tfjs:
+        print('Keras summary')
+        get_generator = make_get_generator(FLAGS.arch, FLAGS.upsampling, FLAGS.optimize_graph)
+        get_cached_generator(get_generator, FLAGS.optimize_graph).summary()
+    export_snapshot(FLAGS.chainer_model_path, FLAGS.tfjs_model_path, FLAGS.keras_model_path)
 
 
+def convert_with_keras(get_generator, weight, keras_model_path, tfjs_model_path):
+    """The original conversion: set the weights in Keras, save and reload them, then convert with tensorflowjs."""
     generator = get_generator(weight=weight)
     print('Keras summary')
     generator.summary()
-    logging.info('Saving keras model (weights) to %s', FLAGS.keras_model_path)
-    generator.save_weights(FLAGS.keras_model_path)
+    logging.info('Saving keras model (weights) to %s', keras_model_path)
+    generator.save_weights(keras_model_path)
     del generator
     # this avoids lambda initilizers in generator, which whould cause error in tfjs.
     generator = get_generator()
-    generator.load_weights(FLAGS.keras_model_path)
-    generator.save_weights(FLAGS.keras_model_path)
-
-    logging.info('Saving tensorflow.js model to %s', FLAGS.tfjs_model_path)
-    os.system('mkdir -p "%s"' % FLAGS.tfjs_model_path)
-    tfjs.converters.save_keras_model(generator, FLAGS.tfjs_model_path)
+    generator.load_weights(keras_model_path)
+    generator.save_weights(keras_model_path)
 
-    sample_output_dir = FLAGS.keras_model_path + '.sample'
-    logging.info('Sampling images, saving to %s', sample_output_dir)
-    os.system('mkdir -p "%s"' % sample_output_dir)
-    for index in range(10):
-        generate_images(generator, sample_output_dir, index)
+    logging.info('Saving tensorflow.js model to %s', tfjs_model_path)
+    os.system('mkdir -p "%s"' % tfjs_model_path)
+    tfjs.converters.save_keras_model(generator, tfjs_model_path)
+    return generator
 
 
 import pdb, traceback, sys, code  # noqa
@@ -0,0 +1,253 @@
+'''
+Sample-quality evaluation: Fréchet distance between feature statistics of generated and real images.
+
+Features come from a locally supplied pretrained network (`chainer.links.VGG16Layers` or `ResNet50Layers` weights), so
+nothing is downloaded. Statistics are accumulated batch by batch, so samples are never all held in memory. Statistics of
+the real images are computed once per dataset and cached next to its npz.
+
+This module must not import chainer_dcgan, which defines absl flags and is usually run as `__main__`.
+'''
+from concurrent import futures
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import os
+import warnings
+
+import chainer
+import chainer.functions as F
+import chainer.links as L
+from chainer.training import extension
+from chainer.training import trigger as trigger_module
+import numpy as np
+
+import trainer_extensions
+
+# network -> (link class, feature layer, BGR mean pixel the weights were trained with)
+NETWORKS = {
+    'vgg16': (L.VGG16Layers, 'fc7', (103.939, 116.779, 123.68)),
+    'resnet50': (L.ResNet50Layers, 'pool5', (103.063, 115.903, 123.152)),
+}
+
+
+def make_fixed_hidden(gen, n_images, seed=0):
+    """Latents drawn with `seed`, leaving the global NumPy RNG (used in training and checkpoints) as it was."""
+    state = np.random.get_state()
+    np.random.seed(seed)
+    z = gen.make_hidden(n_images)
+    np.random.set_state(state)
+    return z
+
+
+def send(device, array):
+    # NumPy arrays are used as they are on iDeep, as in chainer_dcgan.to_device.
+    if isinstance(device, chainer.backend.Intel64Device):
+        return array
+    return device.send(array)
+
+
+class FeatureExtractor(object):
+    """Embeds batches of images in [-1, 1] (NCHW, RGB) with a pretrained network, returning float64 host features."""
+
+    def __init__(self, network, model_path, device=None):
+        link_class, self.layer, mean = NETWORKS[network]
+        self.model = link_class(pretrained_model=model_path)
+        self.device = device or chainer.get_device('@numpy')
+        self.model.to_device(self.device)
+        self.mean = send(self.device, np.asarray(mean, dtype=np.float32)[None, :, None, None])
+
+    def __call__(self, x):
+        if isinstance(x, np.ndarray):
+            x = send(self.device, x)
+        with chainer.using_config('train', False), chainer.using_config('enable_backprop', False):
+            # RGB => BGR and mean subtracted as in the networks' `prepare`, but batched on the device.
+            x = F.flip(F.cast(x, np.float32), 1)
+            x = (x + 1.0) * 127.5 - self.mean
+            x = F.resize_images(x, (224, 224))
+            y = self.model(x, layers=[self.layer])[self.layer]
+        y = chainer.backend.CpuDevice().send(y.array)
+        return y.reshape(len(y), -1).astype(np.float64)
+
+
+class RunningStatistics(object):
+    """Mean and covariance of feature vectors, accumulated in float64 one batch at a time."""
+
+    def __init__(self):
+        self.n = 0
+        self.sum = None
+        self.outer = None
+
+    def update(self, features):
+        if self.sum is None:
+            self.sum = np.zeros(features.shape[1])
+            self.outer = np.zeros((features.shape[1], features.shape[1]))
+        self.n += len(features)
+        self.sum += features.sum(axis=0)
+        self.outer += features.T.dot(features)
+
+    @property
+    def mean(self):
+        return self.sum / self.n
+
+    @property
+    def covariance(self):
+        mean = self.mean
+        return (self.outer - self.n * np.outer(mean, mean)) / (self.n - 1)
+
+
+def frechet_distance(mu1, sigma1, mu2, sigma2, eps=1e-6):
+    """Fréchet distance between the Gaussians N(mu1, sigma1) and N(mu2, sigma2)."""
+    import scipy.linalg
+
+    diff = mu1 - mu2
+    covmean, _ = scipy.linalg.sqrtm(sigma1.dot(sigma2), disp=False)
+    if not np.isfinite(covmean).all():
+        # The product is singular, e.g. with fewer samples than feature dimensions.
+        offset = np.eye(sigma1.shape[0]) * eps
+        covmean = scipy.linalg.sqrtm((sigma1 + offset).dot(sigma2 + offset))
+    covmean = covmean.real
+    return float(diff.dot(diff) + np.trace(sigma1) + np.trace(sigma2) - 2 * np.trace(covmean))
+
+
+def reference_statistics_path(npz_path, key, network):
+    return '{}.{}.{}_{}.stats.npz'.format(os.path.splitext(npz_path)[0], key, network, NETWORKS[network][1])
+
+
+def reference_statistics(npz_path, key, network, extractor, batch_size=100):
+    """Return `(mean, covariance)` of the features of the images in `npz_path[key]`, cached after the first call."""
+    path = reference_statistics_path(npz_path, key, network)
+    if os.path.exists(path):
+        stats = np.load(path)
+        return stats['mean'], stats['covariance']
+
+    images = np.load(npz_path)[key]
+    statistics = RunningStatistics()
+    for i in range(0, len(images), batch_size):
+        x = (images[i:i + batch_size].astype(np.float32) - 127.5) / 127.5
+        statistics.update(extractor(x))
+
+    trainer_extensions.save_npz_atomic(
+        path, {'mean': statistics.mean, 'covariance': statistics.covariance, 'n': np.asarray(statistics.n)})
+    return statistics.mean, statistics.covariance
+
+
+def generator_statistics(gen, extractor, n_samples=5000, batch_size=100, seed=0):
+    """Return `(mean, covariance)` of the features of `n_samples` images from `gen`, drawn with a fixed seed.
+
+    All latents are drawn at once and then split into batches, so the latent set does not depend on `batch_size`.
+    """
+    statistics = RunningStatistics()
+    latents = make_fixed_hidden(gen, n_samples, seed).astype(np.float32)
+    for start in range(0, n_samples, batch_size):
+        z = send(gen.device, latents[start:start + batch_size])
+        with chainer.using_config('train', False), chainer.using_config('enable_backprop', False):
+            x = gen(z)
+        statistics.update(extractor(x.array))
+    return statistics.mean, statistics.covariance
+
+
+def evaluate_generator(gen, extractor, npz_path, key, network, n_samples=5000, batch_size=100, seed=0):
+    """Fréchet distance between `gen`'s samples and the images in `npz_path[key]`."""
+    mu_real, sigma_real = reference_statistics(npz_path, key, network, extractor, batch_size)
+    mu_fake, sigma_fake = generator_statistics(gen, extractor, n_samples, batch_size, seed)
+    return frechet_distance(mu_fake, sigma_fake, mu_real, sigma_real)
+
+
+_worker_extractors = {}
+
+
+def evaluate_snapshot(gen_class, arrays, device_name, network, model_path, npz_path, key, **kwargs):
+    """Entry point for worker processes: build `gen_class` from host `arrays` and evaluate it on `device_name`.
+
+    The feature network is loaded once per worker process.
+    """
+    device = chainer.get_device(device_name)
+    device.use()
+    gen = gen_class()
+    chainer.serializers.NpzDeserializer(arrays).load(gen)
+    gen.to_device(device)
+
+    if (network, model_path, device_name) not in _worker_extractors:
+        _worker_extractors[network, model_path, device_name] = FeatureExtractor(network, model_path, device)
+    extractor = _worker_extractors[network, model_path, device_name]
+    return evaluate_generator(gen, extractor, npz_path, key, network, **kwargs)
+
+
+class FrechetEvaluation(extension.Extension):
+    """Reports `evaluation/frechet_distance` of a generator every `trigger`.
+
+    In-process, the evaluation runs on the training thread when triggered. With `separate_process`, a copy of the
+    weights is handed to a spawned worker and training continues; the result is reported when it arrives, together with
+    `evaluation/iteration` of the weights it was computed on. A new evaluation is not started while one is pending.
+    A failed evaluation is skipped with a warning and training continues. A result still pending when training ends
+    is waited for and printed.
+    """
+
+    trigger = 1, 'iteration'
+
+    def __init__(self, gen, network, model_path, npz_path, key, trigger=(10000, 'iteration'), n_samples=5000,
+                 batch_size=100, seed=0, separate_process=False):
+        self.gen = gen
+        self.network = network
+        self.model_path = model_path
+        self.npz_path = npz_path
+        self.key = key
+        self.eval_trigger = trigger_module.get_trigger(trigger)
+        self.eval_kwargs = {'n_samples': n_samples, 'batch_size': batch_size, 'seed': seed}
+        self.separate_process = separate_process
+        self.extractor = None
+        self.executor = None
+        self.pending = None
+
+    def __call__(self, trainer):
+        if self.pending is not None and self.pending[1].done():
+            iteration, future = self.pending
+            self.pending = None
+            distance = self.result(iteration, future)
+            if distance is not None:
+                chainer.report({'evaluation/frechet_distance': distance, 'evaluation/iteration': iteration})
+
+        if not self.eval_trigger(trainer):
+            return
+
+        iteration = trainer.updater.iteration
+        if not self.separate_process:
+            # An evaluation error, such as a missing feature network, drops that evaluation instead of the run.
+            try:
+                if self.extractor is None:
+                    self.extractor = FeatureExtractor(self.network, self.model_path, self.gen.device)
+                distance = evaluate_generator(self.gen, self.extractor, self.npz_path, self.key, self.network,
+                                              **self.eval_kwargs)
+            except Exception as e:
+                warnings.warn('Evaluation of iteration {} failed: {!r}'.format(iteration, e))
+                return
+            chainer.report({'evaluation/frechet_distance': distance, 'evaluation/iteration': iteration})
+        elif self.pending is None:
+            if self.executor is None:
+                self.executor = futures.ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn'))
+            future = self.executor.submit(
+                evaluate_snapshot, type(self.gen), trainer_extensions.host_copy(self.gen), self.gen.device.name,
+                self.network, self.model_path, self.npz_path, self.key, **self.eval_kwargs)
+            self.pending = iteration, future
+
+    def result(self, iteration, future):
+        """The distance computed by `future`, or None with a warning if its evaluation failed."""
+        try:
+            return future.result()
+        except Exception as e:
+            warnings.warn('Evaluation of iteration {} failed: {!r}'.format(iteration, e))
+            if isinstance(e, BrokenProcessPool):
+                # The worker died; the next evaluation starts a new one.
+                self.executor.shutdown(wait=False)
+                self.executor = None
+            return None
+
+    def finalize(self):
+        # The reporter is no longer active after training, so a last pending result is printed instead.
+        if self.pending is not None:
+            iteration, future = self.pending
+            self.pending = None
+            distance = self.result(iteration, future)
+            if distance is not None:
+                print('evaluation/frechet_distance of iteration {}: {}'.format(iteration, distance))
+        if self.executor is not None:
+            self.executor.shutdown()
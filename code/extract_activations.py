@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+'''
+Extract intermediate activation maps of a generator snapshot for gl-activation-map-viewer.
+
+A fixed latent set is run through the generator in batches, without backprop, and the outputs of the selected links
+are captured with a `chainer.LinkHook`. By default these are the `dc*` deconvolutions of DCGAN generators and every
+`resblockups` stage of ResNet generators. Each layer is written to its own `.npy` file, shaped (N, C, H, W), which
+can be memory-mapped (`np.load(path, mmap_mode='r')`) or fetched and viewed as a typed array after its short header.
+
+Storage is float16, or with `--quantize` uint8 with a per-channel scale and offset: value = q * scale + offset, in
+`<layer>.scale.npy` and `<layer>.offset.npy` of shape (C,). `index.json` describes the layers; the latents are in
+`latents.npy`.
+
+Training flags such as `--arch`, `--backend` and `--gpu` are shared with chainer_dcgan.py.
+
+Example:
+
+  ./extract_activations.py --arch dcgan64 --snapshot $DCGAN64_OUT/SmoothedGenerator_50000.npz \\
+    --activations_out activations/dcgan64 --n_latents 1024 --quantize --gpu -1
+'''
+import json
+import os
+import re
+
+from absl import app
+from absl import flags
+import chainer
+import numpy as np
+
+import chainer_dcgan
+import evaluation
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string('snapshot', '', 'Generator snapshot npz.')
+flags.DEFINE_list('layers', [], 'Link paths to capture, e.g. `dc1,dc2` or `resblockups/0`. Defaults to all stages.')
+flags.DEFINE_integer('n_latents', 256, 'Number of latents to run.')
+flags.DEFINE_integer('seed', 0, 'Seed of the latent set.')
+flags.DEFINE_integer('extract_batch_size', 32, 'Latents per forward pass.')
+flags.DEFINE_boolean('quantize', False, 'Store uint8 with per-channel scale and offset instead of float16.')
+flags.DEFINE_string('activations_out', 'activations', 'Output directory.')
+
+DEFAULT_LAYERS = r'^(dc\d+|resblockups/\d+)$'
+
+
+class CaptureHook(chainer.LinkHook):
+    """Passes the outputs of the links in `names` ({link: name}) to `callback(name, host array)`."""
+
+    name = 'CaptureHook'
+
+    def __init__(self, names, callback):
+        self.names = names
+        self.callback = callback
+
+    def forward_postprocess(self, args):
+        if args.link in self.names:
+            self.callback(self.names[args.link], chainer.backend.CpuDevice().send(args.out.array))
+
+
+def layer_file(directory, layer, suffix='.npy'):
+    return os.path.join(directory, layer.replace('/', '_') + suffix)
+
+
+class ActivationWriter(object):
+    """Writes captured batches into float16 memory-mapped `.npy` files, tracking per-channel min and max."""
+
+    def __init__(self, directory, n):
+        self.directory = directory
+        self.n = n
+        self.arrays = {}
+        self.low = {}
+        self.high = {}
+        self.count = {}
+
+    def __call__(self, layer, x):
+        if layer not in self.arrays:
+            self.arrays[layer] = np.lib.format.open_memmap(
+                layer_file(self.directory, layer), mode='w+', dtype=np.float16, shape=(self.n, ) + x.shape[1:])
+            self.low[layer] = np.full(x.shape[1], np.inf, dtype=np.float32)
+            self.high[layer] = np.full(x.shape[1], -np.inf, dtype=np.float32)
+            self.count[layer] = 0
+        start = self.count[layer]
+        self.arrays[layer][start:start + len(x)] = x
+        self.count[layer] += len(x)
+        axes = (0, ) + tuple(range(2, x.ndim))
+        self.low[layer] = np.minimum(self.low[layer], x.min(axis=axes))
+        self.high[layer] = np.maximum(self.high[layer], x.max(axis=axes))
+
+
+def quantize_layer(directory, layer, low, high, chunk=64):
+    """Rewrite a float16 layer file as uint8 with per-channel scale and offset, `chunk` samples at a time."""
+    path = layer_file(directory, layer)
+    source = np.load(path, mmap_mode='r')
+    scale = (high - low) / 255
+    scale[scale == 0] = 1
+    broadcast = (1, -1) + (1, ) * (source.ndim - 2)
+    target = np.lib.format.open_memmap(path + '.tmp', mode='w+', dtype=np.uint8, shape=source.shape)
+    for i in range(0, len(source), chunk):
+        x = source[i:i + chunk].astype(np.float32)
+        target[i:i + chunk] = np.clip(np.round((x - low.reshape(broadcast)) / scale.reshape(broadcast)), 0, 255)
+    target.flush()
+    del source, target
+    os.replace(path + '.tmp', path)
+    np.save(layer_file(directory, layer, '.scale.npy'), scale.astype(np.float32))
+    np.save(layer_file(directory, layer, '.offset.npy'), low.astype(np.float32))
+
+
+def load_activations(directory, layer, dequantize=False):
+    """Memory-mapped activations of `layer` as written by this tool; `dequantize` returns float32 in memory."""
+    x = np.load(layer_file(directory, layer), mmap_mode='r')
+    if not dequantize or x.dtype != np.uint8:
+        return x
+    broadcast = (1, -1) + (1, ) * (x.ndim - 2)
+    scale = np.load(layer_file(directory, layer, '.scale.npy')).reshape(broadcast)
+    offset = np.load(layer_file(directory, layer, '.offset.npy')).reshape(broadcast)
+    return x * scale + offset
+
+
+def main(argv):
+    del argv  # Unused.
+
+    device = chainer_dcgan.get_device(FLAGS.backend, FLAGS.gpu)
+    device.use()
+    gen = chainer_dcgan.get_arch(FLAGS.arch)[0]()
+    chainer.serializers.load_npz(FLAGS.snapshot, gen)
+    gen.to_device(device)
+
+    paths = {link: name.lstrip('/') for name, link in gen.namedlinks(skipself=True)}
+    selected = set(FLAGS.layers) or {name for name in paths.values() if re.match(DEFAULT_LAYERS, name)}
+    unknown = selected - set(paths.values())
+    if unknown:
+        raise ValueError('Unknown --layers %s; links are %s' % (', '.join(sorted(unknown)),
+                                                                ', '.join(sorted(paths.values()))))
+    names = {link: name for link, name in paths.items() if name in selected}
+
+    if not os.path.exists(FLAGS.activations_out):
+        os.makedirs(FLAGS.activations_out)
+    z = evaluation.make_fixed_hidden(gen, FLAGS.n_latents, FLAGS.seed)
+    np.save(os.path.join(FLAGS.activations_out, 'latents.npy'), z.reshape(len(z), -1))
+
+    writer = ActivationWriter(FLAGS.activations_out, len(z))
+    with CaptureHook(names, writer), chainer.using_config('train', False), chainer.using_config(
+            'enable_backprop', False):
+        for i in range(0, len(z), FLAGS.extract_batch_size):
+            gen(chainer_dcgan.to_device(device, z[i:i + FLAGS.extract_batch_size]))
+
+    index = {'arch': FLAGS.arch, 'snapshot': os.path.abspath(FLAGS.snapshot), 'seed': FLAGS.seed, 'layers': []}
+    for layer in sorted(writer.arrays, key=lambda layer: list(names.values()).index(layer)):
+        writer.arrays[layer].flush()
+        shape = writer.arrays[layer].shape
+        del writer.arrays[layer]
+        entry = {'name': layer, 'file': os.path.basename(layer_file(FLAGS.activations_out, layer)),
+                 'shape': list(shape), 'dtype': 'float16'}
+        if FLAGS.quantize:
+            quantize_layer(FLAGS.activations_out, layer, writer.low[layer], writer.high[layer])
+            entry.update(dtype='uint8', scale=os.path.basename(layer_file(FLAGS.activations_out, layer, '.scale.npy')),
+                         offset=os.path.basename(layer_file(FLAGS.activations_out, layer, '.offset.npy')))
+        index['layers'].append(entry)
+        print('%-16s %-24s %s' % (layer, shape, entry['dtype']))
+
+    with open(os.path.join(FLAGS.activations_out, 'index.json'), 'w') as f:
+        json.dump(index, f, indent=2)
+
+
+if __name__ == '__main__':
+    app.run(main)
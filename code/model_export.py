@@ -0,0 +1,130 @@
+'''
+Transforms of serialized generator weights (the dict of arrays in a Chainer npz) for inference-only use.
+
+Only NumPy is needed, so the functions work on snapshots without Chainer or a GPU.
+'''
+import re
+
+import numpy as np
+
+# Default `eps` of `chainer.links.BatchNormalization`.
+BN_EPS = 2e-5
+
+
+def batch_normalization_pairs(arrays):
+    """Find the BatchNormalizations of a generator that directly follow a Linear/Convolution/Deconvolution layer.
+
+    Returns a list of `(layer, bn, out_axis)` where `layer` and `bn` are link paths in `arrays` and `out_axis` is the
+    axis of the layer's W that indexes its output units. Layers whose output is reshaped into channels (the first
+    Linear) are folded per unit, which requires that unit `u` feeds channel `u // (units / channels)`.
+    """
+    pairs = []
+    for key in sorted(arrays):
+        # DCGAN generators: l0 -> bn0 and dc<i> -> bn<i>.
+        match = re.match(r'^(l0|dc(\d+))/W$', key)
+        if match:
+            bn = 'bn0' if match.group(1) == 'l0' else 'bn' + match.group(2)
+            out_axis = 0 if match.group(1) == 'l0' else 1
+            pairs.append((match.group(1), bn, out_axis))
+        # ResNet generators: c0 -> bn1 inside each up block.
+        match = re.match(r'^(resblockups/\d+)/c0/W$', key)
+        if match:
+            pairs.append((match.group(1) + '/c0', match.group(1) + '/bn1', 0))
+    return [(layer, bn, out_axis) for layer, bn, out_axis in pairs
+            if layer + '/b' in arrays and bn + '/avg_mean' in arrays]
+
+
+def fold_batch_normalization(arrays, pairs=None, eps=BN_EPS):
+    """Fold inference-mode BatchNormalization into the preceding layer.
+
+    The folded BatchNormalization links are set to the identity (gamma=1, beta=0, mean=0, var=1-eps) rather than
+    removed, so the result still loads into the original model class with `chainer.serializers.load_npz`.
+    """
+    arrays = dict(arrays)
+    if pairs is None:
+        pairs = batch_normalization_pairs(arrays)
+
+    for layer, bn, out_axis in pairs:
+        W = arrays[layer + '/W'].astype(np.float64)
+        b = arrays[layer + '/b'].astype(np.float64)
+        mean = arrays[bn + '/avg_mean'].astype(np.float64)
+        var = arrays[bn + '/avg_var'].astype(np.float64)
+        gamma = arrays[bn + '/gamma'].astype(np.float64) if bn + '/gamma' in arrays else np.ones_like(mean)
+        beta = arrays[bn + '/beta'].astype(np.float64) if bn + '/beta' in arrays else np.zeros_like(mean)
+
+        scale = gamma / np.sqrt(var + eps)
+        shift = beta - mean * scale
+        # Expand per-channel statistics to per-unit ones when the layer output is reshaped into channels.
+        assert b.size % mean.size == 0, (layer, bn)
+        scale = np.repeat(scale, b.size // mean.size)
+        shift = np.repeat(shift, b.size // mean.size)
+
+        shape = [1] * W.ndim
+        shape[out_axis] = -1
+        dtype = arrays[layer + '/W'].dtype
+        arrays[layer + '/W'] = (W * scale.reshape(shape)).astype(dtype)
+        arrays[layer + '/b'] = (b * scale + shift).astype(dtype)
+
+        dtype = arrays[bn + '/avg_mean'].dtype
+        arrays[bn + '/avg_mean'] = np.zeros_like(mean, dtype=dtype)
+        arrays[bn + '/avg_var'] = np.full_like(var, 1 - eps, dtype=dtype)
+        if bn + '/gamma' in arrays:
+            arrays[bn + '/gamma'] = np.ones_like(gamma, dtype=arrays[bn + '/gamma'].dtype)
+        if bn + '/beta' in arrays:
+            arrays[bn + '/beta'] = np.zeros_like(beta, dtype=arrays[bn + '/beta'].dtype)
+    return arrays
+
+
+def inference_arrays(arrays, fold_bn=False, dtype=np.float16):
+    """Make a compact inference-only copy of generator weights: BN optionally folded and floats cast to `dtype`."""
+    if fold_bn:
+        arrays = fold_batch_normalization(arrays)
+    return {
+        key: value.astype(dtype) if np.issubdtype(value.dtype, np.floating) else value
+        for key, value in arrays.items()
+    }
+
+
+# Suffixes of the per-channel quantization parameters stored next to each quantized array.
+SCALE_SUFFIX = '@scale'
+MIN_SUFFIX = '@min'
+
+
+def channel_axis(key):
+    """Output-channel axis of a parameter: 1 for Deconvolution2D W of DCGAN generators (in, out, kh, kw), else 0."""
+    return 1 if re.match(r'^dc\d+/W$', key) else 0
+
+
+def quantize_per_channel(arrays, bits=8):
+    """Quantize every weight matrix/kernel to unsigned `bits`-bit integers with one scale and min per output channel.
+
+    One-dimensional arrays (biases and BatchNormalization parameters) are tiny and sensitive, so they stay as they are.
+    The result is a flat dict that can be saved with `np.savez` and restored with `dequantize_per_channel`.
+    """
+    dtype = np.uint8 if bits <= 8 else np.uint16
+    levels = 2 ** bits - 1
+    quantized = {}
+    for key, value in arrays.items():
+        if value.ndim < 2 or not np.issubdtype(value.dtype, np.floating):
+            quantized[key] = value
+            continue
+        axis = channel_axis(key)
+        reduce_axes = tuple(i for i in range(value.ndim) if i != axis)
+        low = value.min(axis=reduce_axes, keepdims=True).astype(np.float32)
+        scale = (value.max(axis=reduce_axes, keepdims=True) - low).astype(np.float32) / levels
+        scale[scale == 0] = 1
+        quantized[key] = np.clip(np.round((value - low) / scale), 0, levels).astype(dtype)
+        quantized[key + SCALE_SUFFIX] = scale
+        quantized[key + MIN_SUFFIX] = low
+    return quantized
+
+
+def dequantize_per_channel(arrays):
+    """Inverse of `quantize_per_channel`: float32 arrays that load into the original model class."""
+    arrays = dict(arrays)
+    return {
+        key: (value * arrays[key + SCALE_SUFFIX] + arrays[key + MIN_SUFFIX]).astype(np.float32)
+        if key + SCALE_SUFFIX in arrays else value
+        for key, value in arrays.items()
+        if not key.endswith((SCALE_SUFFIX, MIN_SUFFIX))
+    }
@@ -0,0 +1,88 @@
+'''
+ONNX export of the Chainer generators and an ONNX Runtime wrapper to run them without Chainer or TensorFlow.
+
+Export traces the generator in inference mode with onnx-chainer: BatchNormalization uses its running statistics (or is
+folded into the preceding layers) and `F.unpooling_2d` becomes a nearest-neighbour `Resize`. The batch size of the
+traced graph is then made dynamic. onnx-chainer ships with Chainer 7 as the `onnx_chainer` package; it, onnx and
+onnxruntime are imported only when used.
+
+This module must not import chainer_dcgan, which defines absl flags and is usually run as `__main__`.
+'''
+import numpy as np
+
+import chainer_models
+
+OPSET_VERSION = 11
+INPUT_NAME = 'z'
+OUTPUT_NAME = 'image'
+
+
+def make_batch_dynamic(model, batch_size):
+    """Replace the traced batch size of `model`'s input, output and Reshape targets by a symbolic `batch`.
+
+    The generators reshape to `(len(z), ...)`, which onnx-chainer records as a constant shape; its batch entry is set to
+    0, which Reshape reads as "copy the input's first dimension".
+    """
+    from onnx import numpy_helper
+
+    constants = {tensor.name: tensor for tensor in model.graph.initializer}
+    for node in model.graph.node:
+        if node.op_type == 'Constant':
+            constants[node.output[0]] = node.attribute[0].t
+    for node in model.graph.node:
+        if node.op_type != 'Reshape':
+            continue
+        shape = numpy_helper.to_array(constants[node.input[1]]).copy()
+        assert shape[0] == batch_size, (node.name, shape)
+        shape[0] = 0
+        constants[node.input[1]].CopyFrom(numpy_helper.from_array(shape, constants[node.input[1]].name))
+
+    for value in list(model.graph.input) + list(model.graph.output):
+        value.type.tensor_type.shape.dim[0].dim_param = 'batch'
+    return model
+
+
+def export_onnx(arch, arrays, path, fold_bn=False, opset_version=OPSET_VERSION):
+    """Export the generator of `arch` with serialized `arrays` to an ONNX file at `path` taking `z` of shape (n, 128).
+
+    Returns the path.
+    """
+    import onnx
+    import onnx_chainer
+
+    gen = chainer_models.make_inference_generator(arch, arrays, fold_bn)
+    # A batch size unlikely to equal any other dimension, so make_batch_dynamic can check what it rewrites.
+    batch_size = 5
+    z = np.zeros((batch_size, gen.n_hidden), dtype=np.float32)
+    # onnx-chainer traces the computational graph, so backprop stays enabled; `train=False` selects inference mode.
+    model = onnx_chainer.export(gen, z, opset_version=opset_version, input_names=[INPUT_NAME],
+                                output_names=[OUTPUT_NAME], train=False)
+    model = make_batch_dynamic(model, batch_size)
+    onnx.checker.check_model(model)
+    onnx.save(model, path)
+    return path
+
+
+class OnnxGenerator(object):
+    """Runs an exported generator on the ONNX Runtime CPU provider.
+
+    `threads` limits ONNX Runtime's intra-op threads; 0 lets it use every core.
+    """
+
+    def __init__(self, path, threads=0):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+
+    def __call__(self, z):
+        """Images in [-1, 1] (NCHW, RGB) for latents `z` of shape (n, 128) or (n, 128, 1, 1)."""
+        z = np.asarray(z, dtype=np.float32).reshape(len(z), -1)
+        return self.session.run([OUTPUT_NAME], {INPUT_NAME: z})[0]
+
+    def generate_uint8(self, z):
+        """Images as uint8 (NHWC, RGB), ready to be saved."""
+        x = self(z)
+        return np.clip(np.round(x * 127.5 + 127.5), 0, 255).astype(np.uint8).transpose(0, 2, 3, 1)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+'''
+Package a tfjs model directory for upload as the delta against a previous release.
+
+The model must be exported with content-hashed shard names (the default of dcgan_chainer_to_keras.py), so an unchanged
+shard keeps its name and its cached copies stay valid. Files that are new or changed since `--previous` are copied to
+`--out` together with `delta.json`, which lists changed, unchanged and removed files. With `--destination`, the upload
+commands are printed: shards are immutable and can be cached for a year, while `model.json` and `manifest.json`,
+whose names never change, are cached briefly.
+
+Example:
+
+  ./package_tfjs.py --model_dir $RESNET128_OUT/tfjs_SmoothedGenerator_${ITER} \\
+    --previous releases/resnet128/manifest.json --out releases/resnet128-delta \\
+    --destination gs://store.alantian.net/tfjs_gan/chainer-resent128-celebahq-128/tfjs_SmoothedGenerator
+'''
+import json
+import os
+import shutil
+
+from absl import app
+from absl import flags
+
+import tfjs_export
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string('model_dir', '', 'tfjs model directory to package.')
+flags.DEFINE_string('previous', '', 'manifest.json of the previous release, or its directory. Empty packages all.')
+flags.DEFINE_string('out', '', 'Directory to copy new and changed files to.')
+flags.DEFINE_string('destination', '', 'If given, print gsutil commands uploading the delta there.')
+
+SHARD_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+INDEX_CACHE_CONTROL = 'public, max-age=300'
+
+
+def load_previous(path):
+    if not path:
+        return {}
+    if os.path.isdir(path):
+        return tfjs_export.read_manifest(path)
+    with open(path) as f:
+        return json.load(f)['files']
+
+
+def diff_manifests(previous, current):
+    """Return `{'changed': [...], 'unchanged': [...], 'removed': [...]}` of file names; new files count as changed."""
+    return {
+        'changed': sorted(name for name, entry in current.items() if previous.get(name) != entry),
+        'unchanged': sorted(name for name, entry in current.items() if previous.get(name) == entry),
+        'removed': sorted(name for name in previous if name not in current),
+    }
+
+
+def main(argv):
+    del argv  # Unused.
+
+    current = tfjs_export.write_manifest(FLAGS.model_dir)
+    delta = diff_manifests(load_previous(FLAGS.previous), current)
+
+    if not os.path.exists(FLAGS.out):
+        os.makedirs(FLAGS.out)
+    # The manifest is always packaged: it is the `--previous` of the next release.
+    for name in delta['changed'] + [tfjs_export.MANIFEST_NAME]:
+        shutil.copy2(os.path.join(FLAGS.model_dir, name), os.path.join(FLAGS.out, name))
+    with open(os.path.join(FLAGS.out, 'delta.json'), 'w') as f:
+        json.dump(delta, f, indent=2)
+
+    changed_bytes = sum(current[name]['size'] for name in delta['changed'])
+    total_bytes = sum(entry['size'] for entry in current.values())
+    print('{} of {} files changed ({} of {} bytes), {} removed'.format(len(delta['changed']), len(current),
+                                                                       changed_bytes, total_bytes,
+                                                                       len(delta['removed'])))
+
+    if FLAGS.destination:
+        shards = [name for name in delta['changed'] if name.endswith('.bin')]
+        indexes = [name for name in delta['changed'] if not name.endswith('.bin')] + [tfjs_export.MANIFEST_NAME]
+        # Shards first, so clients never fetch a model.json that references shards not yet uploaded.
+        for names, cache_control in [(shards, SHARD_CACHE_CONTROL), (indexes, INDEX_CACHE_CONTROL)]:
+            if names:
+                print('gsutil -m -h "Cache-Control:{}" cp {} {}/'.format(
+                    cache_control, ' '.join(os.path.join(FLAGS.out, name) for name in names), FLAGS.destination))
+        if delta['removed']:
+            print('# after clients have moved to the new model.json:')
+            print('gsutil -m rm {}'.format(
+                ' '.join('{}/{}'.format(FLAGS.destination, name) for name in delta['removed'])))
+
+
+if __name__ == '__main__':
+    app.run(main)
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+'''
+Check that every inference backend of the generators produces the same images as Chainer, and time them on CPU.
+
+A fixed latent batch is run through each available backend for each arch. Errors are the max and mean abs difference
+from the Chainer generator in output units ([-1, 1]); latency is the p50/p95 of `--runs` calls at each batch size.
+The script fails if any error exceeds `--max_abs_error`.
+
+Backends:
+
+  chainer          the reference, `chainer_models.make_inference_generator`
+  chainer_fold_bn  the same with BatchNormalization folded (`--fold_bn` of convert_webdnn.py)
+  keras            the Keras rebuild of dcgan_chainer_to_keras.py, without graph optimization
+  keras_optimized  the same with BN folded and activations fused (its default `--optimize_graph`)
+  tfjs             the optimized rebuild with weights written to and read back from tfjs shards
+  webdnn           listed for completeness: WebDNN descriptors only run in a browser through webdnn.js
+
+Archs without a snapshot in `--snapshots` use seeded random initial weights, which checks the graph translation but
+not, for example, BN folding with trained statistics.
+
+Example:
+
+  ./parity_check.py --snapshots resnet128=$RESNET128_OUT/SmoothedGenerator_20000.npz --archs dcgan64,resnet128
+'''
+import importlib
+import json
+import tempfile
+import time
+
+from absl import app
+from absl import flags
+import chainer
+import numpy as np
+
+import chainer_models
+import model_export
+import trainer_extensions
+
+FLAGS = flags.FLAGS
+
+# Flag names differ from dcgan_chainer_to_keras.py's, whose flags are defined when the Keras backends import it.
+flags.DEFINE_list('archs', sorted(chainer_models.ARCHS), 'Archs to check.')
+flags.DEFINE_list('snapshots', [], '`arch=path` of generator snapshots. Other archs use random initial weights.')
+flags.DEFINE_list('backends', ['chainer_fold_bn', 'keras', 'keras_optimized', 'tfjs', 'webdnn'],
+                  'Backends to compare against chainer.')
+flags.DEFINE_list('batch_sizes', ['1', '8', '64'], 'Batch sizes to time.')
+flags.DEFINE_integer('runs', 20, 'Timed calls per batch size, after one warm-up call.')
+flags.DEFINE_float('max_abs_error', 1e-3, 'Fail if a backend differs from chainer by more than this.')
+flags.DEFINE_string('report', '', 'If given, also write the results to this JSON file.')
+
+
+class ChainerBackend(object):
+
+    fold_bn = False
+
+    def unavailable(self, arch):
+        """Return why the backend cannot run `arch` here, or None."""
+        return None
+
+    def load(self, arch, weight):
+        self.gen = chainer_models.make_inference_generator(arch, weight, self.fold_bn)
+
+    def __call__(self, z):
+        with chainer.using_config('train', False), chainer.using_config('enable_backprop', False):
+            return self.gen(z.reshape(z.shape + (1, 1))).array
+
+
+class ChainerFoldBNBackend(ChainerBackend):
+
+    fold_bn = True
+
+
+class KerasBackend(object):
+
+    optimize = False
+
+    def unavailable(self, arch):
+        try:
+            self.exporter = importlib.import_module('dcgan_chainer_to_keras')
+        except ImportError as e:
+            return 'cannot import dcgan_chainer_to_keras: %s' % e
+        try:
+            self.get_generator = self.exporter.make_get_generator(arch, 'nearest', self.optimize)
+        except ValueError:
+            return 'no Keras builder for %s' % arch
+        return None
+
+    def load(self, arch, weight):
+        if self.optimize:
+            weight = model_export.fold_batch_normalization(weight)
+        self.model = self.get_generator()
+        self.exporter.set_chainer_weights(self.model, weight)
+
+    def __call__(self, z):
+        return self.model.predict(z, batch_size=len(z), verbose=0)
+
+
+class KerasOptimizedBackend(KerasBackend):
+
+    optimize = True
+
+
+class TfjsBackend(KerasOptimizedBackend):
+
+    def load(self, arch, weight):
+        weight = model_export.fold_batch_normalization(weight)
+        self.model = self.get_generator()
+        with tempfile.TemporaryDirectory() as directory:
+            self.exporter.save_tfjs_model(self.model, weight, directory)
+            self.exporter.load_tfjs_weights(self.model, directory)
+
+
+class WebDNNBackend(object):
+
+    def unavailable(self, arch):
+        return 'WebDNN descriptors run only in a browser (webdnn.js); check them on the web page'
+
+
+BACKENDS = {
+    'chainer': ChainerBackend,
+    'chainer_fold_bn': ChainerFoldBNBackend,
+    'keras': KerasBackend,
+    'keras_optimized': KerasOptimizedBackend,
+    'tfjs': TfjsBackend,
+    'webdnn': WebDNNBackend,
+}
+
+
+def initial_weights(arch, seed=0):
+    """Serialized weights of a freshly initialized generator of `arch`, drawn with `seed`."""
+    state = np.random.get_state()
+    np.random.seed(seed)
+    gen = chainer_models.get_arch(arch)[0]()
+    np.random.set_state(state)
+    return trainer_extensions.host_copy(gen)
+
+
+def latency(backend, z, runs):
+    """Return `(p50, p95)` seconds of `backend(z)`, after one warm-up call."""
+    backend(z)
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        backend(z)
+        times.append(time.perf_counter() - start)
+    return float(np.percentile(times, 50)), float(np.percentile(times, 95))
+
+
+def check_arch(arch, weight, backend_names, batch_sizes, runs):
+    """Return `{backend: result}` for `arch`; a result has either `skipped` or errors and latencies."""
+    z = np.random.RandomState(0).randn(max(batch_sizes), 128).astype(np.float32)
+    results = {}
+    expected = None
+    for name in ['chainer'] + [name for name in backend_names if name != 'chainer']:
+        backend = BACKENDS[name]()
+        reason = backend.unavailable(arch)
+        if reason:
+            results[name] = {'skipped': reason}
+            continue
+        backend.load(arch, weight)
+        output = np.asarray(backend(z), dtype=np.float64)
+        if expected is None:
+            expected = output
+        diff = np.abs(output - expected)
+        results[name] = {'max_abs_error': float(diff.max()), 'mean_abs_error': float(diff.mean()), 'latency': {}}
+        for batch_size in batch_sizes:
+            p50, p95 = latency(backend, z[:batch_size], runs)
+            results[name]['latency'][batch_size] = {'p50': p50, 'p95': p95}
+    return results
+
+
+def main(argv):
+    del argv  # Unused.
+
+    unknown = set(FLAGS.backends) - set(BACKENDS)
+    if unknown:
+        raise ValueError('Unknown --backends %s' % ', '.join(sorted(unknown)))
+    snapshots = dict(item.split('=', 1) for item in FLAGS.snapshots)
+    batch_sizes = [int(batch_size) for batch_size in FLAGS.batch_sizes]
+
+    report = {}
+    for arch in FLAGS.archs:
+        weight = dict(np.load(snapshots[arch])) if arch in snapshots else initial_weights(arch)
+        report[arch] = check_arch(arch, weight, FLAGS.backends, batch_sizes, FLAGS.runs)
+
+    header = '%-10s %-16s %12s %12s' % ('arch', 'backend', 'max_abs_err', 'mean_abs_err')
+    print(header + ''.join(' %16s' % ('p50/p95 ms @%d' % batch_size) for batch_size in batch_sizes))
+    failures = []
+    for arch, results in report.items():
+        for name, result in results.items():
+            if 'skipped' in result:
+                print('%-10s %-16s skipped: %s' % (arch, name, result['skipped']))
+                continue
+            line = '%-10s %-16s %12.2e %12.2e' % (arch, name, result['max_abs_error'], result['mean_abs_error'])
+            for batch_size in batch_sizes:
+                timing = result['latency'][batch_size]
+                line += ' %16s' % ('%.1f/%.1f' % (timing['p50'] * 1000, timing['p95'] * 1000))
+            print(line)
+            if result['max_abs_error'] > FLAGS.max_abs_error:
+                failures.append('%s/%s' % (arch, name))
+
+    if FLAGS.report:
+        with open(FLAGS.report, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if failures:
+        raise SystemExit('max abs error above %g: %s' % (FLAGS.max_abs_error, ', '.join(failures)))
+
+
+if __name__ == '__main__':
+    app.run(main)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+'''
+Score every generator snapshot in a training output directory and print them ranked by Fréchet distance.
+
+Each snapshot generates the same fixed latent set, embedded with the feature network of chainer_dcgan.py's heavy
+evaluation. Snapshots are spread over a process pool, and results are cached in `<out>/scores.json` keyed by file
+modification time and size, so re-runs only score new or changed snapshots.
+
+Training flags such as `--arch`, `--npz_path`, `--evaluation_model_path` and `--evaluation_samples` are shared with
+chainer_dcgan.py.
+
+Example:
+
+  ./score_snapshots.py --arch resnet128 --image_size 128 --npz_path $DATA_FILE_SIZE_128 --out $RESNET128_OUT \\
+    --evaluation_model_path ResNet-50-model.caffemodel --gpu -1
+'''
+from concurrent import futures
+import json
+import multiprocessing
+import os
+
+from absl import app
+from absl import flags
+import chainer
+import numpy as np
+
+import chainer_dcgan
+import evaluation
+import trainer_extensions
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string('prefix', 'SmoothedGenerator_', 'Score `<prefix><iteration>.npz` files in --out.')
+flags.DEFINE_integer('workers', 0, 'Number of worker processes. 0 uses one per CPU core, or one on GPU.')
+flags.DEFINE_integer('seed', 0, 'Seed of the fixed latent set.')
+flags.DEFINE_string('cache', '', 'Score cache. Defaults to `<out>/scores.json`.')
+
+
+def score_snapshot(path, gen_class, device_name, network, model_path, npz_path, key, **kwargs):
+    arrays = dict(np.load(path))
+    return evaluation.evaluate_snapshot(gen_class, arrays, device_name, network, model_path, npz_path, key, **kwargs)
+
+
+def prepare_reference(device_name, network, model_path, npz_path, key, batch_size):
+    """Compute the cached reference statistics once, before workers could race to write them."""
+    if not os.path.exists(evaluation.reference_statistics_path(npz_path, key, network)):
+        extractor = evaluation.FeatureExtractor(network, model_path, chainer.get_device(device_name))
+        evaluation.reference_statistics(npz_path, key, network, extractor, batch_size)
+
+
+def load_cache(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_cache(path, cache):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(cache, f, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def main(argv):
+    del argv  # Unused.
+
+    cache_path = FLAGS.cache or os.path.join(FLAGS.out, 'scores.json')
+    cache = load_cache(cache_path)
+    key = 'size_%d' % FLAGS.image_size
+    # A cached score is reused only if the snapshot and every setting that affects the score are unchanged.
+    config = {
+        'arch': FLAGS.arch,
+        'npz_path': os.path.abspath(FLAGS.npz_path),
+        'key': key,
+        'network': FLAGS.evaluation_network,
+        'model_path': os.path.abspath(FLAGS.evaluation_model_path),
+        'samples': FLAGS.evaluation_samples,
+        'seed': FLAGS.seed,
+    }
+
+    snapshots = trainer_extensions.list_snapshots(FLAGS.out, FLAGS.prefix)
+    todo = {}
+    for iteration, path in snapshots.items():
+        stat = os.stat(path)
+        signature = dict(config, mtime=stat.st_mtime, size=stat.st_size)
+        entry = cache.get(os.path.basename(path))
+        if entry is None or entry['signature'] != signature:
+            todo[iteration] = path, signature
+    print('{} snapshots, {} to score'.format(len(snapshots), len(todo)))
+
+    if todo:
+        device = chainer_dcgan.get_device(FLAGS.backend, FLAGS.gpu)
+        is_gpu = isinstance(device, chainer.backend.GpuDevice)
+        workers = FLAGS.workers or (1 if is_gpu else os.cpu_count())
+        workers = min(workers, len(todo))
+        # Split the cores between workers instead of letting every worker's BLAS use all of them.
+        for name in ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS']:
+            os.environ.setdefault(name, str(max(1, os.cpu_count() // workers)))
+
+        gen_class = chainer_dcgan.get_arch(FLAGS.arch)[0]
+        common = (FLAGS.evaluation_network, FLAGS.evaluation_model_path, FLAGS.npz_path, key)
+        executor = futures.ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+        with executor:
+            executor.submit(prepare_reference, device.name, *common, FLAGS.evaluation_batch_size).result()
+            pending = {
+                executor.submit(score_snapshot, path, gen_class, device.name, *common,
+                                n_samples=FLAGS.evaluation_samples, batch_size=FLAGS.evaluation_batch_size,
+                                seed=FLAGS.seed): (iteration, path, signature)
+                for iteration, (path, signature) in todo.items()
+            }
+            for future in futures.as_completed(pending):
+                iteration, path, signature = pending[future]
+                cache[os.path.basename(path)] = {'iteration': iteration, 'score': future.result(),
+                                                 'signature': signature}
+                save_cache(cache_path, cache)
+                print('scored {}: {:.4f}'.format(os.path.basename(path), future.result()))
+
+    ranked = sorted((cache[os.path.basename(path)]['score'], iteration, path) for iteration, path in snapshots.items())
+    print('{:>4}  {:>10}  {:>16}  {}'.format('rank', 'iteration', 'frechet_distance', 'path'))
+    for rank, (score, iteration, path) in enumerate(ranked, 1):
+        print('{:>4}  {:>10}  {:>16.4f}  {}'.format(rank, iteration, score, path))
+
+
+if __name__ == '__main__':
+    app.run(main)
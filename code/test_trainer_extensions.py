@@ -0,0 +1,73 @@
+'''
+Tests of trainer_extensions. Run from this directory with `python -m unittest test_trainer_extensions`.
+'''
+import io
+import os
+import tempfile
+import types
+import unittest
+
+import chainer
+from chainer.training import extensions
+
+import trainer_extensions
+
+
+def resume(report):
+    """Round-trip `report` through a checkpoint, as `--resume` does, and return the restored extension."""
+    serializer = chainer.serializers.DictionarySerializer()
+    report.serialize(serializer)
+    resumed = trainer_extensions.JsonLinesLogReport(max_history=report.log.entries.maxlen)
+    resumed.serialize(chainer.serializers.NpzDeserializer(serializer.target))
+    return resumed
+
+
+class JsonLinesLogReportTest(unittest.TestCase):
+
+    def test_print_report_after_resume_beyond_max_history(self):
+        report = trainer_extensions.JsonLinesLogReport(max_history=3)
+        for iteration in range(1, 6):
+            report.log.append({'iteration': iteration})
+
+        resumed = resume(report)
+        self.assertEqual([entry['iteration'] for entry in resumed.log], [3, 4, 5])
+
+        # A resumed `PrintReport` starts reading at entry 0.
+        out = io.StringIO()
+        print_report = extensions.PrintReport(['iteration'], out=out)
+        trainer = types.SimpleNamespace(get_extension=lambda name: resumed)
+        print_report(trainer)
+        for iteration in range(6, 10):
+            resumed.log.append({'iteration': iteration})
+            print_report(trainer)
+
+        lines = out.getvalue().replace('\033[J', '').splitlines()
+        printed = [int(line) for line in lines if line.strip().isdigit()]
+        self.assertEqual(printed, list(range(3, 10)))
+
+    def test_initialize_truncates_the_log_of_an_earlier_run(self):
+        with tempfile.TemporaryDirectory() as out:
+            path = os.path.join(out, 'log.jsonl')
+            with open(path, 'w') as f:
+                f.write('{"iteration": 100}\n{"iteration": 200}\n{"itera')
+            trainer = types.SimpleNamespace(out=out, updater=types.SimpleNamespace(iteration=0))
+
+            trainer_extensions.JsonLinesLogReport().initialize(trainer)
+            self.assertEqual(trainer_extensions.read_log_entries(path), [])
+
+    def test_initialize_on_resume_drops_later_and_incomplete_lines(self):
+        report = trainer_extensions.JsonLinesLogReport()
+        report.log.append({'iteration': 100})
+        resumed = resume(report)
+        with tempfile.TemporaryDirectory() as out:
+            path = os.path.join(out, 'log.jsonl')
+            with open(path, 'w') as f:
+                f.write('{"iteration": 100}\n{"iteration": 200}\n{"itera')
+            trainer = types.SimpleNamespace(out=out, updater=types.SimpleNamespace(iteration=150))
+
+            resumed.initialize(trainer)
+            self.assertEqual(trainer_extensions.read_log_entries(path), [{'iteration': 100}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,208 @@
+'''
+Writes and reads TensorFlow.js layers-model artifacts (`model.json` plus binary weight shards) with NumPy only.
+
+The writer takes the Keras topology as JSON and the weights as a list of `(name, shape, get_array)`. Each array is
+produced, written and released in turn, so only one converted array is in memory at a time and no Keras weights have to
+be set or saved.
+
+Weights can be stored quantized as tfjs understands it: `float16`, or `uint8`/`uint16` affine with one `scale` and `min`
+per tensor, dequantized as `q * scale + min`. float16 weights need a tfjs release that supports them (3.x and later).
+
+With content-hashed shard names, a re-export only changes the names of shards whose bytes changed, so unchanged shards
+stay valid in HTTP caches and need not be uploaded again. `manifest.json` lists the sha256 and size of every file and is
+what `package_tfjs.py` diffs between releases.
+'''
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+
+DEFAULT_SHARD_SIZE = 4 * 1024 * 1024
+# Hex digits of the sha256 in content-addressed shard names.
+HASH_LENGTH = 16
+MANIFEST_NAME = 'manifest.json'
+
+# Storage dtype of each tfjs weight quantization; None stores float32.
+QUANTIZATION_DTYPES = {None: '<f4', 'float16': '<f2', 'uint8': 'u1', 'uint16': '<u2'}
+
+
+def quantize(array, quantization=None):
+    """Return `(stored array, manifest `quantization` entry or None)` of a float32 array."""
+    if quantization is None:
+        return array, None
+    if quantization == 'float16':
+        return array.astype('<f2'), {'dtype': 'float16'}
+
+    dtype = np.dtype(QUANTIZATION_DTYPES[quantization])
+    low, high = (float(array.min()), float(array.max())) if array.size else (0.0, 0.0)
+    scale = (high - low) / np.iinfo(dtype).max or 1.0
+    q = np.clip(np.round((array - low) / scale), 0, np.iinfo(dtype).max).astype(dtype)
+    return q, {'dtype': quantization, 'scale': scale, 'min': low}
+
+
+def dequantize(array, quantization=None):
+    """Inverse of `quantize`: the float32 array tfjs reconstructs from stored `array`."""
+    if quantization is None or quantization['dtype'] == 'float16':
+        return array.astype(np.float32)
+    return (array * quantization['scale'] + quantization['min']).astype(np.float32)
+
+
+class ShardWriter(object):
+    """Writes the bytes of arrays as one stream split into files of `shard_size` bytes, as tfjs expects.
+
+    Shards are written to temporary files and named by `finish`, once their number and contents are known.
+    """
+
+    def __init__(self, directory, shard_size):
+        self.directory = directory
+        self.shard_size = shard_size
+        self.temp_paths = []
+        self.digests = []
+        self.file = None
+        self.remaining = 0
+
+    def write(self, array):
+        data = memoryview(np.ascontiguousarray(array).reshape(-1).view(np.uint8))
+        while len(data):
+            if self.remaining == 0:
+                self.next_shard()
+            n = min(self.remaining, len(data))
+            self.file.write(data[:n])
+            self.digests[-1].update(data[:n])
+            data = data[n:]
+            self.remaining -= n
+
+    def next_shard(self):
+        self.close()
+        self.temp_paths.append(os.path.join(self.directory, '.shard%d.tmp' % len(self.temp_paths)))
+        self.digests.append(hashlib.sha256())
+        self.file = open(self.temp_paths[-1], 'wb')
+        self.remaining = self.shard_size
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def finish(self, content_hash=False):
+        """Rename the shards and return their paths relative to `directory`.
+
+        Shards are named `group1-<sha256 prefix>.bin` with `content_hash`, so that unchanged shards keep their names
+        across exports, or `group1-shard<i>of<n>.bin` as tensorflowjs names them.
+        """
+        self.close()
+        if not self.temp_paths:
+            self.next_shard()
+            self.close()
+        paths = [
+            'group1-%s.bin' % digest.hexdigest()[:HASH_LENGTH] if content_hash else
+            'group1-shard%dof%d.bin' % (i + 1, len(self.temp_paths)) for i, digest in enumerate(self.digests)
+        ]
+        for temp_path, path in zip(self.temp_paths, paths):
+            os.replace(temp_path, os.path.join(self.directory, path))
+        return paths
+
+
+def write_layers_model(directory, topology, weight_specs, shard_size=DEFAULT_SHARD_SIZE, generated_by=None,
+                       quantization=None, content_hash=False):
+    """Write `model.json`, the weight shards and `manifest.json` for `weight_specs` into `directory`.
+
+    `weight_specs` is a list of `(name, shape, get_array)`; `get_array()` is called once per weight, in order.
+    `quantization` is a key of `QUANTIZATION_DTYPES`; `content_hash` names shards by their contents (see
+    `ShardWriter.finish`). Shards of a previous export in `directory` that are no longer referenced are removed.
+    Returns the path of `model.json`.
+    """
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    weights = []
+    writer = ShardWriter(directory, shard_size)
+    try:
+        for name, shape, get_array in weight_specs:
+            array = np.ascontiguousarray(get_array(), dtype='<f4')
+            if array.shape != tuple(shape):
+                raise ValueError('weight %s has shape %s, expected %s' % (name, array.shape, tuple(shape)))
+            stored, entry = quantize(array, quantization)
+            writer.write(stored)
+            weights.append({'name': name, 'shape': list(shape), 'dtype': 'float32'})
+            if entry is not None:
+                weights[-1]['quantization'] = entry
+    except BaseException:
+        writer.close()
+        for temp_path in writer.temp_paths:
+            os.remove(temp_path)
+        raise
+    paths = writer.finish(content_hash)
+
+    model_json = {
+        'format': 'layers-model',
+        'generatedBy': generated_by,
+        'convertedBy': 'chainer-model-trainer',
+        'modelTopology': topology,
+        'weightsManifest': [{
+            'paths': paths,
+            'weights': weights
+        }],
+    }
+    path = os.path.join(directory, 'model.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(model_json, f)
+    os.replace(path + '.tmp', path)
+
+    for name in os.listdir(directory):
+        if re.match(r'^group1-.*\.bin$', name) and name not in paths:
+            os.remove(os.path.join(directory, name))
+    write_manifest(directory)
+    return path
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def write_manifest(directory):
+    """Write `manifest.json`: the sha256 and size of every file of the model, keyed by path relative to `directory`."""
+    files = {}
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if name != MANIFEST_NAME and os.path.isfile(path):
+            files[name] = {'sha256': file_digest(path), 'size': os.path.getsize(path)}
+    with open(os.path.join(directory, MANIFEST_NAME + '.tmp'), 'w') as f:
+        json.dump({'files': files}, f, indent=2, sort_keys=True)
+    os.replace(os.path.join(directory, MANIFEST_NAME + '.tmp'), os.path.join(directory, MANIFEST_NAME))
+    return files
+
+
+def read_manifest(directory):
+    with open(os.path.join(directory, MANIFEST_NAME)) as f:
+        return json.load(f)['files']
+
+
+def _read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def read_layers_model(directory):
+    """Return `(model_json, {weight name: float32 array})` of a tfjs layers model written by `write_layers_model`."""
+    with open(os.path.join(directory, 'model.json')) as f:
+        model_json = json.load(f)
+
+    weights = {}
+    for group in model_json['weightsManifest']:
+        data = b''.join(_read_bytes(os.path.join(directory, path)) for path in group['paths'])
+        offset = 0
+        for spec in group['weights']:
+            quantization = spec.get('quantization')
+            dtype = np.dtype(QUANTIZATION_DTYPES[quantization and quantization['dtype']])
+            size = int(np.prod(spec['shape']))
+            array = np.frombuffer(data, dtype=dtype, count=size, offset=offset)
+            weights[spec['name']] = dequantize(array, quantization).reshape(spec['shape'])
+            offset += dtype.itemsize * size
+    return model_json, weights
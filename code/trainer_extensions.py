@@ -0,0 +1,502 @@
+'''
+Trainer extensions that keep disk I/O off the training thread.
+
+This module must not import chainer_dcgan, which defines absl flags and is usually run as `__main__`.
+'''
+import collections
+import glob
+import http.server
+import json
+import os
+import queue
+import re
+import resource
+import sys
+import threading
+import time
+import traceback
+import warnings
+
+import chainer
+from chainer import reporter
+from chainer.training import extension
+from chainer.training import trigger as trigger_module
+import numpy as np
+
+
+def host_copy(target):
+    """Serialize `target` into a dict of host arrays that later training steps cannot modify."""
+    serializer = chainer.serializers.DictionarySerializer()
+    serializer.save(target)
+    cpu = chainer.backend.CpuDevice()
+    return {key: np.array(cpu.send(value), copy=True) for key, value in serializer.target.items()}
+
+
+def save_npz_atomic(path, arrays, compress=True):
+    """Write `arrays` in the format of `chainer.serializers.save_npz`, renaming into place once complete."""
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        if compress:
+            np.savez_compressed(f, **arrays)
+        else:
+            np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+def to_float(value):
+    """Convert a reported value (Variable, device array or scalar) to a Python float."""
+    return float(chainer.backend.CpuDevice().send(getattr(value, 'array', value)))
+
+
+def rss_bytes():
+    """Current resident set size, or None where /proc is not available."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+def peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def device_memory_bytes():
+    """(used, pooled) bytes of the CuPy default memory pool, or (None, None) when CUDA is not available."""
+    if not chainer.backends.cuda.available:
+        return None, None
+    pool = chainer.backends.cuda.cupy.get_default_memory_pool()
+    return pool.used_bytes(), pool.total_bytes()
+
+
+def list_snapshots(directory, prefix):
+    """Map iteration to path for every `<prefix><iteration>.npz` in `directory`."""
+    snapshots = {}
+    for path in glob.glob(os.path.join(directory, prefix + '*.npz')):
+        match = re.match(re.escape(prefix) + r'(\d+)\.npz$', os.path.basename(path))
+        if match:
+            snapshots[int(match.group(1))] = path
+    return snapshots
+
+
+def find_latest_checkpoint(directory, prefix='checkpoint_'):
+    """Return the `<prefix><iteration>.npz` in `directory` with the highest iteration, or None."""
+    snapshots = list_snapshots(directory, prefix)
+    return snapshots[max(snapshots)] if snapshots else None
+
+
+class AsyncWriter(object):
+    """Writes npz files on a background thread.
+
+    `write` blocks while `max_outstanding` writes are queued or in progress, which bounds the host memory held by
+    pending snapshots. An error in the background is raised again on the next `write` or on `finalize`.
+    """
+
+    def __init__(self, max_outstanding=2, compress=True):
+        assert max_outstanding >= 1
+        self.compress = compress
+        self.task_queue = queue.Queue()
+        self.slots = threading.BoundedSemaphore(max_outstanding)
+        self.error = None
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while True:
+            task = self.task_queue.get()
+            if task is None:
+                break
+            path, arrays = task
+            try:
+                save_npz_atomic(path, arrays, self.compress)
+            except Exception as e:  # noqa
+                traceback.print_exc()
+                self.error = e
+            finally:
+                self.slots.release()
+
+    def check_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def write(self, path, arrays):
+        """Queue `arrays` for writing to `path`."""
+        self.check_error()
+        self.slots.acquire()
+        self.task_queue.put((path, arrays))
+
+    def finalize(self):
+        """Wait for pending writes. Safe to call more than once."""
+        if self.thread.is_alive():
+            self.task_queue.put(None)
+            self.thread.join()
+        self.check_error()
+
+
+class AsyncSnapshot(extension.Extension):
+    """Like `extensions.snapshot_object`, but compression and disk I/O happen on an `AsyncWriter` thread.
+
+    Only the copy of the parameters to host happens on the training thread. Several snapshots may share a writer.
+    `transform` maps the host arrays to the arrays actually written. Without a writer the file is written on the
+    training thread.
+    """
+
+    def __init__(self, target, filename, writer, transform=None):
+        self.target = target
+        self.filename = filename
+        self.writer = writer
+        self.transform = transform
+
+    def __call__(self, trainer):
+        path = os.path.join(trainer.out, self.filename.format(trainer))
+        arrays = host_copy(self.target)
+        if self.transform is not None:
+            arrays = self.transform(arrays)
+        if self.writer is None:
+            save_npz_atomic(path, arrays)
+        else:
+            self.writer.write(path, arrays)
+
+    def finalize(self):
+        if self.writer is not None:
+            self.writer.finalize()
+
+
+class SnapshotRetention(extension.Extension):
+    """Delete `<prefix><iteration>.npz` files in the output directory, or its `subdir`, that a retention policy drops.
+
+    A snapshot is kept if it is one of the `keep_last` newest, if its iteration is a multiple of `keep_every`, or if
+    it is one of the `keep_best` by the observed value of `metric` (lowest unless `minimize` is False). The metric is
+    recorded when this extension runs, so it should share the snapshot's trigger. With all rules at 0 every snapshot is
+    kept. Files still queued on an `AsyncWriter` are not seen until the next call.
+    """
+
+    priority = -100
+
+    def __init__(self, prefix, keep_last=0, keep_every=0, keep_best=0, metric=None, minimize=True, subdir=''):
+        assert not keep_best or metric, 'keep_best needs a metric'
+        self.prefix = prefix
+        self.subdir = subdir
+        self.keep_last = keep_last
+        self.keep_every = keep_every
+        self.keep_best = keep_best
+        self.metric = metric
+        self.minimize = minimize
+        self.scores = {}
+
+    def select(self, iterations):
+        """Return the subset of `iterations` to keep."""
+        iterations = sorted(iterations)
+        if not (self.keep_last or self.keep_every or self.keep_best):
+            return set(iterations)
+
+        keep = set(iterations[-self.keep_last:]) if self.keep_last else set()
+        if self.keep_every:
+            keep.update(i for i in iterations if i % self.keep_every == 0)
+        if self.keep_best:
+            scored = sorted((i for i in iterations if i in self.scores), key=self.scores.get,
+                            reverse=not self.minimize)
+            keep.update(scored[:self.keep_best])
+        return keep
+
+    def __call__(self, trainer):
+        if self.metric and self.metric in trainer.observation:
+            self.scores[trainer.updater.iteration] = to_float(trainer.observation[self.metric])
+
+        snapshots = list_snapshots(os.path.join(trainer.out, self.subdir), self.prefix)
+        keep = self.select(snapshots)
+        for iteration, path in snapshots.items():
+            if iteration not in keep:
+                os.remove(path)
+                self.scores.pop(iteration, None)
+
+    def serialize(self, serializer):
+        # Scores are kept as JSON like `LogReport` keeps its log.
+        if isinstance(serializer, chainer.serializer.Serializer):
+            serializer('_scores', json.dumps(sorted(self.scores.items())))
+        else:
+            # Checkpoints written before this extension was registered have no scores; start without them.
+            try:
+                self.scores = dict(json.loads(serializer('_scores', '')))
+            except KeyError:
+                self.scores = {}
+
+
+class BoundedLog(object):
+    """The newest `max_entries` of an append-only list, indexed as if no entry had been dropped.
+
+    `len()` is the total number of entries appended, which is what `PrintReport` uses to find unprinted entries.
+    `PrintReport` does not save its position in checkpoints and starts again at entry 0 after a resume, so a restored
+    log is numbered from 0 as well (see `JsonLinesLogReport.serialize`).
+    """
+
+    def __init__(self, max_entries=1000):
+        self.entries = collections.deque(maxlen=max_entries)
+        self.total = 0
+
+    def append(self, entry):
+        self.entries.append(entry)
+        self.total += 1
+
+    def __len__(self):
+        return self.total
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.total
+        offset = index - (self.total - len(self.entries))
+        if not 0 <= offset < len(self.entries):
+            raise IndexError('log entry {} is no longer in memory'.format(index))
+        return self.entries[offset]
+
+    def __iter__(self):
+        return iter(self.entries)
+
+
+def read_log_entries(path):
+    """Parse the JSON Lines log at `path` into a list of dicts.
+
+    The lines are parsed with a single `json.loads`, which is much faster than one call per line on large logs. A
+    truncated last line, as left by a run that was killed while appending, is skipped with a warning.
+    """
+    with open(path) as f:
+        lines = [line for line in f.read().splitlines() if line.strip()]
+    try:
+        return json.loads('[' + ','.join(lines) + ']')
+    except ValueError:
+        try:
+            json.loads(lines[-1])
+        except ValueError:
+            warnings.warn('Skipping the incomplete last line of {}: {!r}'.format(path, lines[-1]))
+            return json.loads('[' + ','.join(lines[:-1]) + ']')
+        raise
+
+
+class JsonLinesLogReport(extension.Extension):
+    """Drop-in replacement for `extensions.LogReport` that appends each entry to a JSON Lines file.
+
+    `LogReport` keeps every entry and rewrites the whole JSON file on each trigger. Here each trigger appends one line,
+    and only the newest `max_history` entries are kept in memory as a `BoundedLog`, which `PrintReport` can read as
+    usual. A new run truncates an existing file. On resume, an incomplete last line left by a crash and lines written
+    after the restored iteration are dropped, so the file has no duplicates and new entries start on a line of their
+    own.
+    """
+
+    trigger = 1, 'iteration'
+
+    def __init__(self, keys=None, trigger=(1, 'epoch'), filename='log.jsonl', max_history=1000):
+        self._keys = keys
+        self._trigger = trigger_module.get_trigger(trigger)
+        self._filename = filename
+        self._log = BoundedLog(max_history)
+        self._resumed = False
+        self._init_summary()
+
+    @property
+    def log(self):
+        return self._log
+
+    def _init_summary(self):
+        self._summary = reporter.DictSummary()
+
+    def initialize(self, trainer):
+        path = os.path.join(trainer.out, self._filename)
+        if not os.path.exists(path):
+            return
+        if not self._resumed:
+            # A new run replaces the log of an earlier run in the same directory, as `LogReport` does.
+            open(path, 'w').close()
+            return
+        # One rewrite at resume, dropping an incomplete last line and entries of iterations that are about to be
+        # trained again.
+        iteration = trainer.updater.iteration
+        entries = [entry for entry in read_log_entries(path) if entry['iteration'] <= iteration]
+        with open(path + '.tmp', 'w') as f:
+            f.writelines(json.dumps(entry) + '\n' for entry in entries)
+        os.replace(path + '.tmp', path)
+
+    def __call__(self, trainer):
+        observation = trainer.observation
+        if self._keys is None:
+            self._summary.add(observation)
+        else:
+            self._summary.add({k: observation[k] for k in self._keys if k in observation})
+
+        if not self._trigger(trainer):
+            return
+
+        entry = {name: float(value) for name, value in self._summary.compute_mean().items()}
+        entry['epoch'] = trainer.updater.epoch
+        entry['iteration'] = trainer.updater.iteration
+        entry['elapsed_time'] = trainer.elapsed_time
+        self._log.append(entry)
+
+        if not os.path.exists(trainer.out):
+            os.makedirs(trainer.out, exist_ok=True)
+        with open(os.path.join(trainer.out, self._filename), 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+        self._init_summary()
+
+    def serialize(self, serializer):
+        if hasattr(self._trigger, 'serialize'):
+            self._trigger.serialize(serializer['_trigger'])
+        # The summary is not kept, as with `LogReport`.
+        if isinstance(serializer, chainer.serializer.Serializer):
+            serializer('_log', json.dumps(list(self._log)))
+        else:
+            # The restored entries are renumbered from 0, where the resumed `PrintReport` starts reading. Like
+            # `LogReport` with `PrintReport`, this reprints the restored entries once.
+            entries = json.loads(serializer('_log', ''))
+            self._log = BoundedLog(self._log.entries.maxlen)
+            for entry in entries:
+                self._log.append(entry)
+            self._resumed = True
+
+
+def load_log(path, keys=None):
+    """Load a JSON Lines log written by `JsonLinesLogReport` into a dict of float64 columns.
+
+    See `read_log_entries` for how the file is parsed. Entries missing a key get NaN in that column.
+    """
+    rows = read_log_entries(path)
+    if keys is None:
+        keys = sorted(set().union(*rows)) if rows else []
+    return {key: np.array([row.get(key, np.nan) for row in rows], dtype=np.float64) for key in keys}
+
+
+class Telemetry(extension.Extension):
+    """Publishes training health gauges in the Prometheus text format.
+
+    Every `interval` iterations the gauges are rendered and served on `http://127.0.0.1:<port>/metrics` and/or
+    written to `filename` (atomically, on a background thread). They cover iterations and images per second, the
+    fraction of the step spent waiting for data (`time/data` over `time/total`), current and peak RSS, the CuPy memory
+    pool's used and reserved bytes, each optimizer's learning rate and the latest values of `keys`. Per iteration this
+    only sums the phase times and keeps the arrays of the reported values; they are converted to floats, which may
+    synchronize with the GPU, only when publishing.
+    """
+
+    trigger = 1, 'iteration'
+    priority = extension.PRIORITY_READER
+
+    def __init__(self, keys=(), interval=100, port=0, filename=None, namespace='chainer_dcgan'):
+        self.keys = list(keys)
+        self.interval = interval
+        self.port = port
+        self.filename = filename
+        self.namespace = namespace
+        self.text = ''
+        self.latest = {}
+        self.data_time = 0.0
+        self.total_time = 0.0
+        self.last_iteration = None
+        self.last_time = None
+        self.server = None
+        self.file_queue = None
+
+    def initialize(self, trainer):
+        self.last_iteration = trainer.updater.iteration
+        self.last_time = time.perf_counter()
+        if self.port:
+            telemetry = self
+
+            class Handler(http.server.BaseHTTPRequestHandler):
+                def do_GET(self):
+                    body = telemetry.text.encode()
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, *args):
+                    pass
+
+            self.server = http.server.ThreadingHTTPServer(('127.0.0.1', self.port), Handler)
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        if self.filename:
+            # Holds at most one pending text; a newer one is dropped while the disk is busy.
+            self.file_queue = queue.Queue(maxsize=1)
+            threading.Thread(target=self.write_files, daemon=True).start()
+
+    def write_files(self):
+        while True:
+            text = self.file_queue.get()
+            if text is None:
+                break
+            with open(self.filename + '.tmp', 'w') as f:
+                f.write(text)
+            os.replace(self.filename + '.tmp', self.filename)
+
+    def __call__(self, trainer):
+        observation = trainer.observation
+        self.data_time += observation.get('time/data', 0.0)
+        self.total_time += observation.get('time/total', 0.0)
+        for key in self.keys:
+            if key in observation:
+                # Only the array is kept, not the Variable and its graph. It is copied to the host when publishing.
+                value = observation[key]
+                self.latest[key] = getattr(value, 'array', value)
+
+        iteration = trainer.updater.iteration
+        if iteration - self.last_iteration < self.interval:
+            return
+
+        now = time.perf_counter()
+        iterations_per_second = (iteration - self.last_iteration) / (now - self.last_time)
+        batch_size = getattr(trainer.updater.get_iterator('main'), 'batch_size', 0)
+        gauges = [
+            ('iteration', {}, iteration),
+            ('iterations_per_second', {}, iterations_per_second),
+            ('images_per_second', {}, iterations_per_second * batch_size),
+            ('data_wait_fraction', {}, self.data_time / self.total_time if self.total_time else 0.0),
+            ('rss_bytes', {}, rss_bytes()),
+            ('peak_rss_bytes', {}, peak_rss_bytes()),
+        ]
+        used_bytes, pooled_bytes = device_memory_bytes()
+        gauges.append(('device_memory_used_bytes', {}, used_bytes))
+        gauges.append(('device_memory_pool_bytes', {}, pooled_bytes))
+        for name, optimizer in sorted(trainer.updater.get_all_optimizers().items()):
+            lr = getattr(optimizer, 'alpha', getattr(optimizer, 'lr', None))
+            gauges.append(('learning_rate', {'optimizer': name}, lr))
+        for key, value in sorted(self.latest.items()):
+            gauges.append(('value', {'key': key}, to_float(value)))
+        self.publish(gauges)
+
+        self.last_iteration = iteration
+        self.last_time = now
+        self.data_time = self.total_time = 0.0
+
+    def publish(self, gauges):
+        lines = []
+        for name, labels, value in gauges:
+            if value is None:
+                continue
+            name = '{}_{}'.format(self.namespace, name)
+            if not any(line == '# TYPE {} gauge'.format(name) for line in lines):
+                lines.append('# TYPE {} gauge'.format(name))
+            label_text = ','.join('{}="{}"'.format(k, v) for k, v in sorted(labels.items()))
+            lines.append('{}{} {}'.format(name, '{' + label_text + '}' if label_text else '', float(value)))
+        self.text = '\n'.join(lines) + '\n'
+
+        if self.file_queue is not None:
+            try:
+                self.file_queue.put_nowait(self.text)
+            except queue.Full:
+                pass
+
+    def finalize(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        if self.file_queue is not None:
+            self.file_queue.put(None)
+            self.file_queue = None